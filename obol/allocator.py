@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+import logging
+import random
+import time
+
+import ldap
+
+logger = logging.getLogger(__name__)
+
+
+class IdAllocator(object):
+    """Hand out uid/gid numbers from blocks reserved on the server
+
+    The next free number is kept in the uidNumber attribute of a
+    uidNext entry (cn=uid or cn=gid). A block of numbers is reserved
+    by replacing the current value with current + size in a single
+    modify that deletes the old value, so a concurrent reservation
+    makes the modify fail instead of handing out the same numbers
+    twice. On such a conflict the allocator backs off exponentially
+    with full jitter and tries again.
+    """
+    def __init__(self, conn, dn, block=1, max_delay=10.0,
+                 base_backoff=0.01, max_backoff=1.0):
+        self.conn = conn
+        self.dn = dn
+        self.block = max(1, block)
+        self.max_delay = max_delay
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.next = 0
+        self.end = 0
+
+        self.reservations = 0
+        self.conflicts = 0
+        self.retries = 0
+        self.allocated = 0
+
+    def _current(self):
+        filter = '(objectclass=*)'
+        attrs = ['uidNumber']
+        result = self.conn.search_s(self.dn, ldap.SCOPE_BASE, filter, attrs)
+        return result[0][1]['uidNumber'][0]
+
+    def _swap(self, old, new):
+        mod_attrs = [(ldap.MOD_DELETE, 'uidNumber', old),
+                     (ldap.MOD_ADD, 'uidNumber', new)]
+        self.conn.modify_s(self.dn, mod_attrs)
+
+    def reserve(self, size=None):
+        """Reserve a contiguous block of numbers on the server"""
+        size = size or self.block
+        started = time.time()
+        attempt = 0
+        while True:
+            current = self._current()
+            try:
+                self._swap(current, str(int(current) + size))
+                break
+            except (ldap.NO_SUCH_ATTRIBUTE, ldap.TYPE_OR_VALUE_EXISTS):
+                # somebody else moved the counter in the meantime
+                self.conflicts += 1
+                # let --trace know about the retry
+                retried = getattr(self.conn, 'retried', None)
+                if retried is not None:
+                    retried('id allocation')
+                if time.time() - started > self.max_delay:
+                    raise
+            delay = min(self.max_backoff, self.base_backoff * 2 ** attempt)
+            attempt += 1
+            self.retries += 1
+            time.sleep(random.uniform(0, delay))
+
+        self.reservations += 1
+        self.next = int(current)
+        self.end = self.next + size
+        logger.debug('reserved %s numbers %d-%d',
+                     self.dn, self.next, self.end - 1)
+
+    def allocate(self):
+        """Return the next free number as a string"""
+        if self.next >= self.end:
+            self.reserve()
+        value = self.next
+        self.next += 1
+        self.allocated += 1
+        return str(value)
+
+    def give_back(self, value):
+        """Take back the number last handed out, because it was not used
+
+        The number is returned to the server by release().
+        """
+        if str(self.next - 1) == value:
+            self.next -= 1
+            self.allocated -= 1
+
+    def release(self):
+        """Give the unused rest of the current block back
+
+        This only succeeds when nobody reserved numbers after us; if
+        somebody did, the unused numbers are logged and skipped.
+        """
+        if self.next >= self.end:
+            return
+        try:
+            self._swap(str(self.end), str(self.next))
+            logger.debug('returned %s numbers %d-%d',
+                         self.dn, self.next, self.end - 1)
+        except (ldap.NO_SUCH_ATTRIBUTE, ldap.TYPE_OR_VALUE_EXISTS):
+            logger.warning('%s numbers %d-%d were reserved but not used',
+                           self.dn, self.next, self.end - 1)
+        self.next = self.end
+
+    def stats(self):
+        return {'reservations': self.reservations,
+                'conflicts': self.conflicts,
+                'retries': self.retries,
+                'allocated': self.allocated}
+
+
+def uid_allocator(conn, b, block=1):
+    return IdAllocator(conn, 'cn=uid,%s' % b, block)
+
+
+def gid_allocator(conn, b, block=1):
+    return IdAllocator(conn, 'cn=gid,%s' % b, block)
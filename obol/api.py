@@ -0,0 +1,850 @@
+#!/usr/bin/env python
+"""obol as a library
+
+The functions in this module do the work of the obol commands on a
+bound connection. They do not print: failures raise ldap.LDAPError,
+or, for operations that carry on after a partial failure, are
+returned as a list of (what, error) pairs.
+
+Directory runs them on a pool of connections, so it can be shared by
+the threads of a service. AsyncDirectory has the same methods, but
+they return at once with a result to wait on:
+
+    directory = AsyncDirectory(connect, size=8)
+    results = [directory.add_user(name) for name in names]
+    for result in results:
+        uidNumber = result.get()
+    directory.close()
+"""
+import collections
+import logging
+import weakref
+from multiprocessing.pool import ThreadPool
+
+import ldap
+from ldap.controls import RequestControl
+from ldap.extop import ExtendedRequest
+
+from .allocator import gid_allocator, uid_allocator
+from .passwords import hash_password
+from .pipeline import Pipeline, describe
+from .search import paged_search
+from .server import ConnectionPool
+from .sort import sorted_search
+
+logger = logging.getLogger(__name__)
+
+
+def user_records(b, context, username, uidNumber, cn=None, sn=None,
+                 givenName=None, password=None, shell='/bin/bash'):
+    """Return the (dn, add_record) pairs for a user and its own group"""
+    records = []
+
+    # first the group
+    dn = 'cn=%s,%s,%s' % (username, context, b)
+    add_record = [
+        ('objectclass', ['top', 'posixGroup']),
+        ('cn', [username]),
+        ('memberuid', [uidNumber]),
+        ('gidNumber', [uidNumber])
+    ]
+    records.append((dn, add_record))
+
+    # now the user
+    dn = 'uid=%s,%s,%s' % (username, context, b)
+
+    # set some default values
+    if not cn:
+        cn = username
+    if not sn:
+        sn = username
+
+    add_record = [
+        ('objectclass', ['top', 'person', 'organizationalPerson',
+                         'inetOrgPerson', 'posixAccount',
+                         'shadowAccount']),
+        ('uid', [username]),
+        ('cn', [cn]),
+        ('sn', [sn]),
+        ('loginShell', [shell]),
+        ('uidNumber', [uidNumber]),
+        ('gidNumber', [uidNumber]),
+        ('homeDirectory', ['/home/%s' % username])
+    ]
+
+    if givenName:
+        add_record.append(('givenName', [givenName]))
+    if password:
+        password = hash_password(password)
+        add_record.append(('userPassword', [password]))
+    records.append((dn, add_record))
+
+    return records
+
+
+# The user fields that can be changed, and the attributes they are
+# kept in
+USER_ATTRIBUTES = [
+    ('cn', 'cn'),
+    ('sn', 'sn'),
+    ('givenName', 'givenName'),
+    ('shell', 'loginShell'),
+]
+
+
+def lower_keys(attrs):
+    return dict((key.lower(), values) for key, values in attrs.items())
+
+
+def replace_mods(entry, record):
+    """Return MOD_REPLACE operations for the fields that changed
+
+    entry holds the current attributes with lower case names, record
+    the new values by field name. Fields that are not in record or
+    that already have the new value are left alone.
+    """
+    mods = []
+    for field, attr in USER_ATTRIBUTES:
+        value = record.get(field)
+        if value is None:
+            continue
+        if entry.get(attr.lower(), []) != [value]:
+            mods.append((ldap.MOD_REPLACE, attr, [value]))
+    return mods
+
+
+def current_users(conn, base_dn, usernames, page_size=500, chunk=100):
+    """Return {uid: attributes} of the users that exist under base_dn
+
+    The users are fetched with one search per chunk of names, so a
+    bulk change needs a handful of round trips instead of one per user.
+    """
+    usernames = list(usernames)
+    attrs = ['uid'] + [attr for _, attr in USER_ATTRIBUTES]
+    users = {}
+    for start in range(0, len(usernames), chunk):
+        names = usernames[start:start + chunk]
+        filter = '(&(objectclass=posixAccount)(|%s))' % ''.join(
+            '(uid=%s)' % name for name in names)
+        for dn, entry in paged_search(conn, base_dn, ldap.SCOPE_SUBTREE,
+                                      filter, attrs, page_size):
+            entry = lower_keys(entry)
+            for uid in entry.get('uid', []):
+                users[uid] = entry
+    return users
+
+
+def modify_members(conn, dn, op, names):
+    """Add or delete memberUid values of a group in a single modify
+
+    If the server rejects the whole batch because some of the values
+    are already present (or missing, when deleting), the group is read
+    back once and only the valid values are sent again. Returns a list
+    of (name, reason) for the names that were skipped.
+    """
+    unique = []
+    for name in names:
+        if name not in unique:
+            unique.append(name)
+
+    try:
+        conn.modify_s(dn, [(op, 'memberuid', unique)])
+        return []
+    except (ldap.TYPE_OR_VALUE_EXISTS, ldap.NO_SUCH_ATTRIBUTE):
+        pass
+
+    result = conn.search_s(dn, ldap.SCOPE_BASE, '(objectclass=*)',
+                           ['memberuid'])
+    current = set()
+    for _, attrs in result:
+        for key, values in attrs.items():
+            if key.lower() == 'memberuid':
+                current.update(values)
+
+    if op == ldap.MOD_ADD:
+        valid = [name for name in unique if name not in current]
+        errors = [(name, 'already a member')
+                  for name in unique if name in current]
+    else:
+        valid = [name for name in unique if name in current]
+        errors = [(name, 'not a member')
+                  for name in unique if name not in current]
+
+    if valid:
+        conn.modify_s(dn, [(op, 'memberuid', valid)])
+    return errors
+
+
+def member_groups(conn, b, username, grouptree='ou=Group', page_size=500):
+    """Return the dns of the groups username is a member of"""
+    base_dn = '%s,%s' % (grouptree, b)
+    filter = '(&(objectclass=posixGroup)(memberuid=%s))' % username
+    return [dn for dn, _ in paged_search(conn, base_dn, ldap.SCOPE_SUBTREE,
+                                         filter, ['1.1'], page_size)]
+
+
+def search_chunks(conn, base_dn, attr, values, filter='(objectclass=*)',
+                  attrs=None, chunk=100, window=8):
+    """Return the entries under base_dn whose attr is one of values
+
+    The values are looked up with OR filters of up to chunk values.
+    Those searches are pipelined, window at a time, so resolving many
+    names costs a few round trips instead of one per name.
+    """
+    values = list(values)
+    entries = []
+    errors = []
+
+    def done(tag, result, error):
+        if error is not None:
+            errors.append(error)
+            return
+        entries.extend((dn, entry) for dn, entry in result[1]
+                       if dn is not None)
+
+    pipeline = Pipeline(conn, window, done)
+    for start in range(0, len(values), chunk):
+        terms = ''.join('(%s=%s)' % (attr, value)
+                        for value in values[start:start + chunk])
+        pipeline.submit(start, 'search_ext', base_dn, ldap.SCOPE_SUBTREE,
+                        '(&%s(|%s))' % (filter, terms), attrs)
+    pipeline.flush()
+    if errors:
+        raise errors[0]
+    return entries
+
+
+def first_value(entry, attr, default=None):
+    """The first value of an attribute, looked up case insensitively"""
+    for key, values in entry.items():
+        if key.lower() == attr.lower() and values:
+            return values[0]
+    return default
+
+
+def user_groups(conn, b, username, context='ou=People', attrs=None):
+    """Return the (dn, attributes) of the groups of username
+
+    That is the group of its gidNumber and the groups that list it as
+    a memberUid, found with one search for the user and one for the
+    groups in all trees.
+    """
+    user = show_user(conn, b, username, context, ['gidNumber'])
+    if user is None:
+        raise ldap.NO_SUCH_OBJECT({'desc': 'No such object',
+                                   'info': 'no user %s' % username})
+    terms = '(memberuid=%s)' % username
+    gidNumber = first_value(user[1], 'gidNumber')
+    if gidNumber is not None:
+        terms += '(gidNumber=%s)' % gidNumber
+    return conn.search_s(b, ldap.SCOPE_SUBTREE,
+                         '(&(objectclass=posixGroup)(|%s))' % terms, attrs)
+
+
+def group_members(conn, b, groupname, context='ou=Group'):
+    """Return the memberUid values of a group"""
+    group = show_group(conn, b, groupname, context, ['memberuid'])
+    if group is None:
+        raise ldap.NO_SUCH_OBJECT({'desc': 'No such object',
+                                   'info': 'no group %s' % groupname})
+    for key, values in group[1].items():
+        if key.lower() == 'memberuid':
+            return values
+    return []
+
+
+def resolve_users(conn, b, usernames, context='ou=People', attrs=None,
+                  chunk=100, window=8):
+    """Look up the entries of many users, see search_chunks
+
+    Returns the (dn, attributes) of the users that were found, in the
+    order of usernames, and the names that were not found.
+    """
+    if attrs and 'uid' not in attrs:
+        attrs = ['uid'] + list(attrs)
+    found = {}
+    for dn, entry in search_chunks(conn, '%s,%s' % (context, b), 'uid',
+                                   usernames, '(objectclass=posixAccount)',
+                                   attrs, chunk, window):
+        for uid in lower_keys(entry).get('uid', []):
+            found[uid.lower()] = (dn, entry)
+    users = [found[name.lower()] for name in usernames
+             if name.lower() in found]
+    missing = [name for name in usernames if name.lower() not in found]
+    return users, missing
+
+
+def find_orphans(conn, b, context='ou=People', page_size=500):
+    """Find dangling memberUids and personal groups without a user
+
+    Users and groups are read in a single paged search over the whole
+    base. Returns a list of (group dn, memberUid) for members that do
+    not exist, and the dns of the personal groups (the groups in the
+    user tree) whose user is gone.
+    """
+    user_dn = ('%s,%s' % (context, b)).lower()
+    users = set()
+    numbers = set()
+    groups = []
+    filter = '(|(objectclass=posixAccount)(objectclass=posixGroup))'
+    attrs = ['objectclass', 'uid', 'uidNumber', 'cn', 'memberuid']
+    for dn, entry in paged_search(conn, b, ldap.SCOPE_SUBTREE, filter,
+                                  attrs, page_size):
+        entry = lower_keys(entry)
+        classes = [value.lower() for value in entry.get('objectclass', [])]
+        if 'posixaccount' in classes:
+            users.update(uid.lower() for uid in entry.get('uid', []))
+            numbers.update(entry.get('uidnumber', []))
+        if 'posixgroup' in classes:
+            groups.append((dn, entry))
+
+    dangling = []
+    orphaned = []
+    for dn, entry in groups:
+        personal = dn.lower().endswith(',' + user_dn)
+        if personal and not any(cn.lower() in users
+                                for cn in entry.get('cn', [])):
+            orphaned.append(dn)
+            continue
+        for member in entry.get('memberuid', []):
+            # personal groups list the uidNumber of their user
+            if member.lower() in users or (personal and member in numbers):
+                continue
+            dangling.append((dn, member))
+    return dangling, orphaned
+
+
+# LDAP Transactions, RFC 5805
+TXN_START = '1.3.6.1.1.21.1'
+TXN_SPECIFICATION = '1.3.6.1.1.21.2'
+TXN_END = '1.3.6.1.1.21.3'
+
+# connections to servers that turned out not to support transactions
+_no_transactions = weakref.WeakKeyDictionary()
+
+
+def _ber(tag, value):
+    """A BER encoded element with a definite length"""
+    length = len(value)
+    if length < 0x80:
+        header = chr(length)
+    else:
+        octets = ''
+        while length:
+            octets = chr(length & 0xff) + octets
+            length >>= 8
+        header = chr(0x80 | len(octets)) + octets
+    return chr(tag) + header + value
+
+
+class Transaction(object):
+    """An LDAP transaction (RFC 5805) on a connection
+
+    Update operations sent with control() as a server control are
+    queued by the server, and applied all at once or not at all when
+    the transaction ends.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        _, self.id = conn.extop_s(ExtendedRequest(TXN_START, None))
+
+    def control(self):
+        return RequestControl(TXN_SPECIFICATION, True, self.id)
+
+    def end(self, commit=True):
+        # SEQUENCE { commit BOOLEAN DEFAULT TRUE, identifier OCTET STRING }
+        value = _ber(0x04, self.id)
+        if not commit:
+            value = _ber(0x01, '\x00') + value
+        self.conn.extop_s(ExtendedRequest(TXN_END, _ber(0x30, value)))
+
+
+def _undo(operation):
+    """The operation that reverts an add or a MOD_ADD modify"""
+    method, args = operation
+    if method == 'add':
+        return 'delete', (args[0],)
+    dn, mod_attrs = args
+    return 'modify', (dn, [(ldap.MOD_DELETE, attr, values)
+                           for _, attr, values in mod_attrs])
+
+
+def apply_in_transaction(conn, operations):
+    """Send (method, args) operations as a single transaction
+
+    Raises the first error if the transaction was not committed.
+    """
+    transaction = Transaction(conn)
+    errors = []
+
+    def done(index, result, error):
+        if error is not None:
+            errors.append((index, error))
+
+    control = [transaction.control()]
+    pipeline = Pipeline(conn, len(operations), done)
+    for index, (method, args) in enumerate(operations):
+        pipeline.submit(index, method + '_ext', *args, serverctrls=control)
+    pipeline.flush()
+    if errors:
+        try:
+            transaction.end(False)
+        except ldap.LDAPError as error:
+            logger.debug('abort failed: %s', describe(error))
+        raise min(errors)[1]
+    transaction.end(True)
+
+
+def apply_with_rollback(conn, operations):
+    """Send (method, args) operations at once, undo them on failure
+
+    The operations are adds and MOD_ADD modifies. When one of them
+    fails, the ones that succeeded are reverted and the first error
+    is raised.
+    """
+    succeeded = []
+    errors = []
+
+    def done(index, result, error):
+        if error is None:
+            succeeded.append(index)
+        else:
+            errors.append((index, error))
+
+    pipeline = Pipeline(conn, len(operations), done)
+    for index, (method, args) in enumerate(operations):
+        pipeline.submit(index, method, *args)
+    pipeline.flush()
+    if not errors:
+        return
+
+    def undone(index, result, error):
+        if error is not None:
+            logger.warning('could not undo %s %s: %s', operations[index][0],
+                           operations[index][1][0], describe(error))
+
+    # in reverse, so that users are removed before their groups
+    pipeline = Pipeline(conn, max(1, len(succeeded)), undone)
+    for index in sorted(succeeded, reverse=True):
+        method, args = _undo(operations[index])
+        pipeline.submit(index, method, *args)
+    pipeline.flush()
+    raise min(errors)[1]
+
+
+def apply_atomically(conn, operations, transactions=None):
+    """Apply all of the operations or none of them
+
+    A transaction is used when the server supports it. Otherwise the
+    operations are pipelined and the ones that succeeded are undone
+    when another one failed. transactions tells whether the server
+    supports them, from obol.features; when None a transaction is
+    tried.
+    """
+    if transactions is not False and conn not in _no_transactions:
+        try:
+            apply_in_transaction(conn, operations)
+            return
+        except (ldap.PROTOCOL_ERROR, ldap.UNWILLING_TO_PERFORM,
+                ldap.UNAVAILABLE_CRITICAL_EXTENSION) as error:
+            logger.debug('not using transactions: %s', describe(error))
+            _no_transactions[conn] = True
+    apply_with_rollback(conn, operations)
+
+
+def user_operations(b, username, uidNumber, cn=None, sn=None,
+                    givenName=None, password=None, shell='/bin/bash',
+                    groups=None, context='ou=People', grouptree='ou=Group'):
+    """The (method, args) operations that add a user to the directory"""
+    operations = [('add', record)
+                  for record in user_records(b, context, username, uidNumber,
+                                             cn, sn, givenName, password,
+                                             shell)]
+    for group in groups or []:
+        dn = 'cn=%s,%s,%s' % (group, grouptree, b)
+        operations.append(('modify', (dn, [(ldap.MOD_ADD, 'memberuid',
+                                            [username])])))
+    return operations
+
+
+def add_user(conn, b, username, uidNumber=None, cn=None, sn=None,
+             givenName=None, password=None, shell='/bin/bash', groups=None,
+             context='ou=People', grouptree='ou=Group', transactions=None):
+    """Add a user, its own group and its memberships as a unit
+
+    Either everything is added or nothing is, see apply_atomically.
+    A uidNumber that was allocated for a user that could not be added
+    is given back. Returns the uidNumber of the user.
+    """
+    allocator = None
+    if not uidNumber:
+        allocator = uid_allocator(conn, b)
+        uidNumber = allocator.allocate()
+
+    operations = user_operations(b, username, uidNumber, cn, sn, givenName,
+                                 password, shell, groups, context, grouptree)
+    try:
+        apply_atomically(conn, operations, transactions)
+    except ldap.LDAPError:
+        if allocator is not None:
+            allocator.give_back(uidNumber)
+            allocator.release()
+        raise
+    return uidNumber
+
+
+def delete_users(conn, b, usernames, context='ou=People',
+                 grouptree='ou=Group', groups=None, window=64, chunk=100):
+    """Delete many users, their memberships and their own groups
+
+    groups maps usernames to the dns of the groups they are a member
+    of; the groups of the other users are found with a search per
+    chunk of names. All operations are pipelined, window at a time,
+    and every group loses all of its deleted members in one modify.
+    Every step is tried, also when an earlier one failed. Returns
+    {username: [(dn, error), ...]} for the users a step failed for.
+    """
+    usernames = list(collections.OrderedDict.fromkeys(usernames))
+    names = dict((name.lower(), name) for name in usernames)
+    groups = dict(groups or {})
+    # group dn -> the memberUid values to remove from it
+    members = collections.OrderedDict()
+    for name in usernames:
+        for dn in groups.get(name, []):
+            members.setdefault(dn, []).append(name)
+    unknown = [name for name in usernames if name not in groups]
+    if unknown:
+        wanted = set(name.lower() for name in unknown)
+        for dn, entry in search_chunks(conn, '%s,%s' % (grouptree, b),
+                                       'memberuid', unknown,
+                                       '(objectclass=posixGroup)',
+                                       ['memberuid'], chunk, window):
+            for member in lower_keys(entry).get('memberuid', []):
+                if member.lower() in wanted:
+                    members.setdefault(dn, []).append(member)
+
+    errors = {}
+
+    def done(tag, result, error):
+        owners, dn = tag
+        if error is not None:
+            for name in owners:
+                errors.setdefault(name, []).append((dn, error))
+
+    pipeline = Pipeline(conn, window, done)
+    for name in usernames:
+        dn = 'uid=%s,%s,%s' % (name, context, b)
+        pipeline.submit(([name], dn), 'delete', dn)
+    for dn, values in members.items():
+        owners = [names.get(value.lower(), value) for value in values]
+        mod_attrs = [(ldap.MOD_DELETE, 'memberuid', values)]
+        pipeline.submit((owners, dn), 'modify', dn, mod_attrs)
+    for name in usernames:
+        dn = 'cn=%s,%s,%s' % (name, context, b)
+        pipeline.submit(([name], dn), 'delete', dn)
+    pipeline.flush()
+    return errors
+
+
+def delete_user(conn, b, username, context='ou=People',
+                grouptree='ou=Group', groups=None, window=64):
+    """Delete a user, see delete_users
+
+    Returns a list of (dn, error) for the steps that failed.
+    """
+    if groups is not None:
+        groups = {username: groups}
+    return delete_users(conn, b, [username], context, grouptree, groups,
+                        window).get(username, [])
+
+
+def delete_groups(conn, b, groupnames, context='ou=Group', window=64):
+    """Delete many groups with pipelined deletes
+
+    Returns {groupname: error} for the groups that were not deleted.
+    """
+    errors = {}
+
+    def done(name, result, error):
+        if error is not None:
+            errors[name] = error
+
+    pipeline = Pipeline(conn, window, done)
+    for name in collections.OrderedDict.fromkeys(groupnames):
+        pipeline.submit(name, 'delete', 'cn=%s,%s,%s' % (name, context, b))
+    pipeline.flush()
+    return errors
+
+
+def modify_user(conn, b, username, context='ou=People', **fields):
+    """Change the USER_ATTRIBUTES fields of a user
+
+    Only the attributes that differ are sent. Returns whether the user
+    was changed.
+    """
+    base_dn = '%s,%s' % (context, b)
+    current = current_users(conn, base_dn, [username], 0)
+    if username not in current:
+        raise ldap.NO_SUCH_OBJECT({'desc': 'No such object',
+                                   'info': 'no user %s' % username})
+    mod_attrs = replace_mods(current[username], fields)
+    if mod_attrs:
+        conn.modify_s('uid=%s,%s' % (username, base_dn), mod_attrs)
+    return bool(mod_attrs)
+
+
+def reset_password(conn, b, username, password=None, context='ou=People',
+                   scheme=None, rounds=None):
+    """Set the password of a user
+
+    Without a scheme the password is sent with the password modify
+    extended operation and the server hashes it, or makes one up when
+    password is None. Returns what passwd_s returned in that case.
+    """
+    dn = 'uid=%s,%s,%s' % (username, context, b)
+    if scheme and password:
+        secret = hash_password(password, scheme, rounds)
+        conn.modify_s(dn, [(ldap.MOD_REPLACE, 'userPassword', [secret])])
+        return None
+    return conn.passwd_s(dn, None, password)
+
+
+def add_group(conn, b, groupname, gidNumber=None, context='ou=Group'):
+    """Add a group and return its gidNumber"""
+    if not gidNumber:
+        gidNumber = gid_allocator(conn, b).allocate()
+
+    dn = 'cn=%s,%s,%s' % (groupname, context, b)
+    add_record = [
+        ('objectclass', ['top', 'posixGroup']),
+        ('cn', [groupname]),
+        ('gidNumber', [gidNumber])
+    ]
+    conn.add_s(dn, add_record)
+    return gidNumber
+
+
+def delete_group(conn, b, groupname, context='ou=Group'):
+    conn.delete_s('cn=%s,%s,%s' % (groupname, context, b))
+
+
+def add_members(conn, b, groupname, usernames, context='ou=Group'):
+    """Add users to a group, see modify_members"""
+    dn = 'cn=%s,%s,%s' % (groupname, context, b)
+    return modify_members(conn, dn, ldap.MOD_ADD, usernames)
+
+
+def remove_members(conn, b, groupname, usernames, context='ou=Group'):
+    """Remove users from a group, see modify_members"""
+    dn = 'cn=%s,%s,%s' % (groupname, context, b)
+    return modify_members(conn, dn, ldap.MOD_DELETE, usernames)
+
+
+def list_users(conn, b, context='ou=People', filter=None, attrs=None,
+               page_size=500, sort=None, offset=0, count=None,
+               controls=None):
+    """Yield the (dn, attributes) of the users, a page at a time
+
+    sort, offset and count order the users and select a window of
+    them, see obol.sort.sorted_search.
+    """
+    filter = filter or '(objectclass=person)'
+    return sorted_search(conn, '%s,%s' % (context, b), filter,
+                         attrs or ['uid'], sort, offset, count, page_size,
+                         controls=controls)
+
+
+def list_groups(conn, b, context='ou=Group', filter=None, attrs=None,
+                page_size=500, sort=None, offset=0, count=None,
+                controls=None):
+    """Yield the (dn, attributes) of the groups, a page at a time"""
+    filter = filter or '(objectclass=posixGroup)'
+    return sorted_search(conn, '%s,%s' % (context, b), filter,
+                         attrs or ['cn'], sort, offset, count, page_size,
+                         controls=controls)
+
+
+def show_user(conn, b, username, context='ou=People', attrs=None):
+    """Return the (dn, attributes) of username, or None"""
+    result = conn.search_s('%s,%s' % (context, b), ldap.SCOPE_SUBTREE,
+                           '(uid=%s)' % username, attrs)
+    return result[0] if result else None
+
+
+def show_group(conn, b, groupname, context='ou=Group', attrs=None):
+    """Return the (dn, attributes) of groupname, or None"""
+    result = conn.search_s('%s,%s' % (context, b), ldap.SCOPE_SUBTREE,
+                           '(cn=%s)' % groupname, attrs)
+    return result[0] if result else None
+
+
+class Directory(object):
+    """The obol operations on a pool of bound connections
+
+    connect is called without arguments to open a bound connection
+    whenever the pool needs one, for example:
+
+        def connect():
+            conn = ldap.initialize('ldap://localhost')
+            conn.simple_bind_s('cn=Manager,dc=local', password)
+            return conn
+
+    The methods block and can be called from many threads at once;
+    every call takes a connection from the pool for its duration.
+    """
+    def __init__(self, connect, b='dc=local', user_tree='ou=People',
+                 group_tree='ou=Group', size=4, page_size=500, window=64):
+        self.pool = ConnectionPool(connect, size)
+        self.b = b
+        self.user_tree = user_tree
+        self.group_tree = group_tree
+        self.page_size = page_size
+        self.window = window
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def run(self, function, *args, **kwargs):
+        """Call function(conn, *args, **kwargs) on a pooled connection"""
+        conn = self.pool.get()
+        try:
+            return function(conn, *args, **kwargs)
+        except ldap.SERVER_DOWN:
+            self.pool.discard(conn)
+            conn = None
+            raise
+        finally:
+            if conn is not None:
+                self.pool.put(conn)
+
+    def close(self):
+        """Unbind the idle connections"""
+        while not self.pool.idle.empty():
+            self.pool.discard(self.pool.idle.get())
+
+    def add_user(self, username, **kwargs):
+        kwargs.setdefault('context', self.user_tree)
+        kwargs.setdefault('grouptree', self.group_tree)
+        return self.run(add_user, self.b, username, **kwargs)
+
+    def delete_user(self, username, groups=None):
+        return self.run(delete_user, self.b, username, self.user_tree,
+                        self.group_tree, groups, self.window)
+
+    def delete_users(self, usernames, groups=None):
+        return self.run(delete_users, self.b, usernames, self.user_tree,
+                        self.group_tree, groups, self.window)
+
+    def modify_user(self, username, **fields):
+        return self.run(modify_user, self.b, username, self.user_tree,
+                        **fields)
+
+    def reset_password(self, username, password=None, scheme=None,
+                       rounds=None):
+        return self.run(reset_password, self.b, username, password,
+                        self.user_tree, scheme, rounds)
+
+    def member_groups(self, username):
+        return self.run(member_groups, self.b, username, self.group_tree,
+                        self.page_size)
+
+    def add_group(self, groupname, gidNumber=None):
+        return self.run(add_group, self.b, groupname, gidNumber,
+                        self.group_tree)
+
+    def delete_group(self, groupname):
+        return self.run(delete_group, self.b, groupname, self.group_tree)
+
+    def delete_groups(self, groupnames):
+        return self.run(delete_groups, self.b, groupnames, self.group_tree,
+                        self.window)
+
+    def add_members(self, groupname, usernames):
+        return self.run(add_members, self.b, groupname, usernames,
+                        self.group_tree)
+
+    def remove_members(self, groupname, usernames):
+        return self.run(remove_members, self.b, groupname, usernames,
+                        self.group_tree)
+
+    def allocate_uid(self):
+        return self.run(lambda conn: uid_allocator(conn, self.b).allocate())
+
+    def allocate_gid(self):
+        return self.run(lambda conn: gid_allocator(conn, self.b).allocate())
+
+    def user_groups(self, username, attrs=None):
+        return self.run(user_groups, self.b, username, self.user_tree, attrs)
+
+    def group_members(self, groupname):
+        return self.run(group_members, self.b, groupname, self.group_tree)
+
+    def resolve_users(self, usernames, attrs=None, chunk=100, window=8):
+        return self.run(resolve_users, self.b, usernames, self.user_tree,
+                        attrs, chunk, window)
+
+    def find_orphans(self):
+        return self.run(find_orphans, self.b, self.user_tree,
+                        self.page_size)
+
+    def list_users(self, filter=None, attrs=None, sort=None, offset=0,
+                   count=None):
+        """The users as a list, the connection is not held between pages"""
+        return self.run(lambda conn: list(list_users(
+            conn, self.b, self.user_tree, filter, attrs, self.page_size,
+            sort, offset, count)))
+
+    def list_groups(self, filter=None, attrs=None, sort=None, offset=0,
+                    count=None):
+        return self.run(lambda conn: list(list_groups(
+            conn, self.b, self.group_tree, filter, attrs, self.page_size,
+            sort, offset, count)))
+
+    def show_user(self, username, attrs=None):
+        return self.run(show_user, self.b, username, self.user_tree, attrs)
+
+    def show_group(self, groupname, attrs=None):
+        return self.run(show_group, self.b, groupname, self.group_tree,
+                        attrs)
+
+
+class AsyncDirectory(Directory):
+    """A Directory whose methods return at once
+
+    Python 2 has no asyncio; every call is run on a thread pool with a
+    thread per connection instead, and returns a
+    multiprocessing.pool.AsyncResult. Wait for it with get(), which
+    returns the result or raises the error of the call, or pass a
+    callback when it should not be waited on:
+
+        directory.run_async(delete_user, directory.b, name,
+                            callback=deleted)
+
+    Any number of calls can be outstanding; they are queued until a
+    thread and its connection are free.
+    """
+    def __init__(self, connect, b='dc=local', user_tree='ou=People',
+                 group_tree='ou=Group', size=4, page_size=500, window=64):
+        super(AsyncDirectory, self).__init__(connect, b, user_tree,
+                                             group_tree, size, page_size,
+                                             window)
+        self.threads = ThreadPool(size)
+
+    def run(self, function, *args, **kwargs):
+        return self.run_async(function, *args, **kwargs)
+
+    def run_async(self, function, *args, **kwargs):
+        """Queue function(conn, *args, **kwargs), return an AsyncResult"""
+        callback = kwargs.pop('callback', None)
+        return self.threads.apply_async(
+            super(AsyncDirectory, self).run, (function,) + args, kwargs,
+            callback)
+
+    def close(self):
+        """Wait for the outstanding calls and unbind the connections"""
+        self.threads.close()
+        self.threads.join()
+        super(AsyncDirectory, self).close()
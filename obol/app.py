@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+import logging
+
+from cliff import help
+from cliff.app import App
+from cliff.commandmanager import CommandManager
+
+import importlib
+import os
+import re
+import sys
+from ConfigParser import ConfigParser
+
+from .servers import POLICIES, ServerList, split_hosts
+
+# The command modules, ldap and everything else that is only needed
+# to run a command are imported when a command is dispatched, so
+# --help and --version start fast.
+
+# The commands of obol, the classes that implement them and the line
+# --help shows for them
+COMMANDS = [
+    ('init', 'obol.user:Init', "Initialize the tree"),
+    ('user list', 'obol.user:UserList', "List all users"),
+    ('user add', 'obol.user:UserAdd', "Add a user to the LDAP"),
+    ('user import', 'obol.user:UserImport',
+     "Add users in bulk from a CSV, LDIF or JSON lines file"),
+    ('user delete', 'obol.user:UserDelete',
+     "Delete one or more users from the LDAP"),
+    ('user modify', 'obol.user:UserModify', "Modify one or more users"),
+    ('user reset', 'obol.user:UserReset',
+     "Reset a user's password, or the passwords of many users"),
+    ('user show', 'obol.user:UserShow', "Show one or more users"),
+    ('user groups', 'obol.user:UserGroups', "List the groups of a user"),
+    ('group show', 'obol.group:GroupShow', "Show a group"),
+    ('group list', 'obol.group:GroupList', "List all groups"),
+    ('group add', 'obol.group:GroupAdd', "Add a group to the LDAP"),
+    ('group delete', 'obol.group:GroupDelete',
+     "Delete one or more groups from the LDAP"),
+    ('group useradd', 'obol.group:GroupAddUsers', "Add users to a group"),
+    ('group userdel', 'obol.group:GroupDelUsers',
+     "Remove users from a group"),
+    ('group addusers', 'obol.group:GroupAddUsers', "Add users to a group"),
+    ('group delusers', 'obol.group:GroupDelUsers',
+     "Remove users from a group"),
+    ('group members', 'obol.group:GroupMembers',
+     "List the members of a group"),
+    ('serve', 'obol.server:Serve',
+     "Keep bound connections open behind a local socket"),
+    ('mirror', 'obol.mirror:MirrorCommand',
+     "Keep a local copy of the user and group trees up to date"),
+    ('server status', 'obol.servers:ServerStatus',
+     "Check all servers in parallel and report replication drift"),
+    ('server info', 'obol.servers:ServerInfo',
+     "Show what the provider supports, from its root DSE"),
+    ('sync', 'obol.sync:Sync',
+     "Bring the users and groups in line with a desired state file"),
+    ('batch', 'obol.batch:Batch',
+     "Run obol commands from a file or stdin over one connection"),
+    ('export', 'obol.transfer:Export',
+     "Write the user and group trees to an LDIF file"),
+    ('import', 'obol.transfer:Import',
+     "Load entries from an LDIF file with pipelined adds"),
+    ('report orphans', 'obol.report:Orphans',
+     "Report dangling memberUids and personal groups without a user"),
+]
+
+
+class LazyCommand(object):
+    """A command that is imported when it is used
+
+    cliff calls load() on the entries of the command table when it
+    dispatches a command, like it does for setuptools entry points.
+    The description is what --help shows, without loading it.
+    """
+    def __init__(self, name, path, description):
+        self.name = name
+        self.path = path
+        self.description = description
+
+    def load(self):
+        module, _, cls = self.path.partition(':')
+        return getattr(importlib.import_module(module), cls)
+
+
+class StaticCommandManager(CommandManager):
+    """A command manager that does not scan setuptools entry points"""
+    def __init__(self, commands):
+        super(StaticCommandManager, self).__init__(None)
+        for name, path, description in commands:
+            self.commands[name] = LazyCommand(name, path, description)
+
+    def _load_commands(self):
+        pass
+
+    def load_commands(self, namespace):
+        pass
+
+
+class HelpCommand(help.HelpCommand):
+    """print detailed help for another command"""
+
+    def take_action(self, parsed_args):
+        if not parsed_args.cmd:
+            self.app.print_commands()
+            return 0
+        return super(HelpCommand, self).take_action(parsed_args)
+
+
+class ObolApp(App):
+    def __init__(self):
+        manager = StaticCommandManager(COMMANDS)
+
+        super(ObolApp, self).__init__(
+            description='Obol: LDAP command line tool',
+            version='2.0',
+            command_manager=manager,
+            deferred_help=True,
+            )
+        # cliff's help loads every command to describe it
+        manager.add_command('help', HelpCommand)
+
+        config = ConfigParser({'user_tree': 'ou=People',
+                               'group_tree': 'ou=Group'})
+        config.read(['/etc/obol/obol.config',
+                     os.path.expanduser('~/.obol.cfg')])
+        self.config = config
+        self.cache = None
+        self.tracer = None
+        self._servers = None
+        self.readonly = False
+        self.connections = {}
+        self._profile = None
+
+    @property
+    def servers(self):
+        """The provider and replicas, see obol.servers.ServerList"""
+        if self._servers is None:
+            self._servers = ServerList(self.options.H,
+                                       split_hosts(self.options.replicas),
+                                       self.options.read_from,
+                                       self.state_path('servers.json'))
+        return self._servers
+
+    @property
+    def conn(self):
+        """The connection of the current command, bound on first use"""
+        return self.connection(self.readonly)
+
+    def default(self, key, default=''):
+        """A utility function to retrieve defaults from a config file"""
+        try:
+            return self.config.get('default', key)
+        except:
+            return default
+
+    def state_path(self, name):
+        """Return the path of a local state file for the current server"""
+        directory = self.default('cache_dir', '~/.cache/obol')
+        server = re.sub(r'[^\w.=-]+', '_',
+                        '%s_%s' % (self.options.H, self.options.b))
+        return os.path.join(os.path.expanduser(directory), server, name)
+
+    def connect(self, host=None):
+        """Open a new connection bound with the global options"""
+        import ldap
+        from .connection import bind, prepare
+
+        host = host or self.options.H
+        conn = ldap.initialize(host)
+        prepare(conn, self.options, host)
+        if self.tracer is not None:
+            from .trace import TracedConnection
+            conn = TracedConnection(conn, self.tracer)
+        bind(conn, self.options)
+        return conn
+
+    def open_cache(self):
+        from .cache import SearchCache
+
+        path = self.state_path('cache.sqlite')
+        ttl = int(self.default('cache_ttl', 300))
+        size = int(self.default('cache_size', 10 * 1024 * 1024))
+        return SearchCache(path, ttl, size)
+
+    def invalidate(self, *dns):
+        """Drop cached search results that could contain any of dns"""
+        cache = self.cache
+        if cache is None:
+            if not os.path.exists(self.state_path('cache.sqlite')):
+                return
+            cache = self.open_cache()
+        for dn in dns:
+            cache.invalidate(dn)
+
+    def profile(self, refresh=False):
+        """What the provider supports, see obol.features.Profile
+
+        The root DSE and schema are read once and kept in a state file
+        for profile_ttl seconds, so commands can pick the fastest way
+        to do something without asking the server first. They are read
+        over the provider connection, also by commands that read from
+        a replica, as the profile is stored under -H.
+        """
+        from .features import ProfileCache
+
+        ttl = int(self.default('profile_ttl', 86400))
+        if refresh or self._profile is None or self._profile.age() > ttl:
+            cache = ProfileCache(self.state_path('profile.json'), ttl)
+            self._profile = cache.get(self.options.H,
+                                      lambda: self.connection(False), refresh)
+        return self._profile
+
+    def connection(self, readonly=False):
+        """Return a bound connection for reading or for writing"""
+        if readonly not in self.connections:
+            host, conn = self.servers.connect(self.connect, readonly)
+            self.connections[readonly] = conn
+        return self.connections[readonly]
+
+    def print_commands(self):
+        """Print the usage and the commands from the COMMANDS table"""
+        self.parser.print_help(self.stdout)
+        self.stdout.write('\nCommands:\n')
+        for name, entry in sorted(self.command_manager):
+            description = getattr(entry, 'description', None)
+            if description is None:
+                # the commands of cliff itself, which are cheap to load
+                description = entry.load().__doc__.strip().split('\n')[0]
+            self.stdout.write('  %-14s  %s\n' % (name, description))
+
+    def print_help_if_requested(self):
+        if self.deferred_help and self.options.deferred_help:
+            self.print_commands()
+            sys.exit(0)
+
+    def initialize_app(self, argv):
+        self.LOG.debug('initialize_app')
+        if self.options.trace:
+            from .trace import Tracer
+            self.tracer = Tracer(self.options.trace_output)
+        self.cache = self.open_cache() if self.options.cache else None
+
+    def build_option_parser(self, description, version, argparse_kwargs=None):
+        parser = super(ObolApp, self).build_option_parser(
+            description,
+            version,
+            argparse_kwargs
+            )
+
+        parser.add_argument('-D', metavar='BIND DN',
+                            default=self.default('bindDN',
+                                                 'cn=Manager,dc=local'))
+        parser.add_argument('-w', metavar='BIND PASSWORD',
+                            default=self.default('password'))
+        parser.add_argument('-H', metavar='HOST',
+                            default=self.default('host', 'ldap://localhost'))
+        parser.add_argument('-Y', metavar='MECHANISM', type=str.upper,
+                            choices=['EXTERNAL'],
+                            default=self.default('sasl_mech') or None,
+                            help="bind with SASL EXTERNAL instead of -D "
+                                 "and -w, e.g. over ldapi://")
+        parser.add_argument('-Z', '--starttls', action='store_true',
+                            default=self.default('starttls') == 'yes',
+                            help="issue StartTLS on ldap:// connections")
+        parser.add_argument('--cacert', metavar='FILE',
+                            default=self.default('tls_cacert') or None,
+                            help="CA certificates to verify the server with")
+        parser.add_argument('--cert', metavar='FILE',
+                            default=self.default('tls_cert') or None,
+                            help="client certificate, for SASL EXTERNAL")
+        parser.add_argument('--key', metavar='FILE',
+                            default=self.default('tls_key') or None,
+                            help="key of the client certificate")
+        parser.add_argument('--tls-reqcert',
+                            choices=['never', 'allow', 'try', 'demand'],
+                            default=self.default('tls_reqcert') or None,
+                            help="how to check the certificate of the "
+                                 "server")
+        parser.add_argument('--network-timeout', metavar='SECONDS',
+                            type=float,
+                            default=self.default('network_timeout') or None,
+                            help="give up connecting after this long")
+        parser.add_argument('--timeout', metavar='SECONDS', type=float,
+                            default=self.default('timeout') or None,
+                            help="give up waiting for a result after "
+                                 "this long")
+        parser.add_argument('--keepalive', metavar='IDLE[,PROBES,INTERVAL]',
+                            default=self.default('keepalive') or None,
+                            help="TCP keepalive: idle seconds before the "
+                                 "first probe, number of probes and "
+                                 "seconds between them")
+        parser.add_argument('--replicas', metavar='HOSTS',
+                            default=self.default('replicas'),
+                            help="comma separated read-only replicas of -H")
+        parser.add_argument('--read-from', choices=POLICIES,
+                            default=self.default('read_from', 'round-robin'),
+                            help="how to pick the server for reads")
+        parser.add_argument('-b', metavar='BASE_DN',
+                            default=self.default('baseDN', 'dc=local'))
+        parser.add_argument('--page-size', type=int,
+                            default=int(self.default('page_size', 500)),
+                            help="entries per page for searches, 0 to "
+                                 "disable paging")
+        parser.add_argument('--cache', action='store_true',
+                            default=self.default('cache') == 'yes',
+                            help="answer show commands from a local cache")
+        parser.add_argument('--trace', action='store_true',
+                            default=self.default('trace') == 'yes',
+                            help="count and time the LDAP operations")
+        parser.add_argument('--trace-output', metavar='TARGET',
+                            default=self.default('trace_output', 'stderr'),
+                            help="where --trace reports to: stderr, "
+                                 "json:FILE, statsd or statsd://HOST:PORT")
+        loglevels = [key for key in logging._levelNames
+                     if isinstance(key, str)]
+
+        parser.add_argument('--logLevel', choices=loglevels,
+                            default=self.default('logLevel', 'INFO'))
+        return parser
+
+    def prepare_to_run_command(self, cmd):
+        self.LOG.debug('prepare_to_run_command %s', cmd.__class__.__name__)
+        if self.tracer is not None:
+            self.tracer.start(cmd.cmd_name)
+        # reads may go to a replica, everything else to the provider;
+        # the connection is only opened when the command uses it
+        self.readonly = getattr(cmd, 'readonly', False)
+
+    def clean_up(self, cmd, result, err):
+        self.LOG.debug('clean_up %s', cmd.__class__.__name__)
+        if err:
+            self.LOG.debug('got an error: %s', err)
+        # write commands list the entries they touched, also when
+        # they failed halfway
+        self.invalidate(*getattr(cmd, 'invalidates', []))
+        if self.tracer is not None:
+            if self.tracer.command is None:
+                self.tracer.command = cmd.cmd_name
+            self.tracer.report()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+import StringIO
+import collections
+import copy
+import json
+import logging
+import shlex
+import sys
+import threading
+import time
+
+from cliff.command import Command
+
+from .pipeline import describe
+from .server import (CONNECTION_OPTIONS, ConnectionPool, RequestApp,
+                     ThreadLocalStream)
+
+logger = logging.getLogger(__name__)
+
+
+class Line(object):
+    """One command of a batch and what came of it"""
+    def __init__(self, number, text):
+        self.number = number
+        self.text = text
+        self.status = None
+        self.stdout = StringIO.StringIO()
+        self.stderr = StringIO.StringIO()
+        self.elapsed = 0.0
+        self.done = threading.Event()
+
+    def result(self):
+        return {'line': self.number,
+                'command': self.text,
+                'status': self.status,
+                'stdout': self.stdout.getvalue(),
+                'stderr': self.stderr.getvalue(),
+                'elapsed': round(self.elapsed, 6)}
+
+
+class Batch(Command):
+    """Run obol commands from a file or stdin over one connection
+
+    Every input line is an obol command line without the leading
+    `obol`; empty lines and lines starting with # are skipped. For
+    every command a JSON line with its status and output is written,
+    in input order and as soon as it is known, so obol batch can be
+    driven as a coprocess. With --parallel N up to N commands run at
+    once on their own connections; a line with just `wait` waits for
+    all commands before it.
+    """
+
+    def get_parser(self, name):
+        parser = super(Batch, self).get_parser(name)
+        parser.add_argument('filename', help="commands to run, - for stdin")
+        parser.add_argument('--keep-going', action='store_true',
+                            help="run the remaining commands after a "
+                                 "command failed")
+        parser.add_argument('--parallel', type=int, default=1,
+                            help="number of commands to run at once")
+        return parser
+
+    def execute(self, line, conn):
+        """Run the command of line on conn and record the outcome"""
+        sys.stdout.local.stream = line.stdout
+        sys.stderr.local.stream = line.stderr
+        started = time.time()
+        try:
+            line.status = self.run_line(line, conn)
+        except Exception as error:
+            logger.debug('line %d failed', line.number, exc_info=True)
+            line.stderr.write('%s\n' % describe(error))
+            line.status = 1
+        finally:
+            line.elapsed = time.time() - started
+            if line.status:
+                self.failures.append(line.number)
+            sys.stdout.local.stream = None
+            sys.stderr.local.stream = None
+
+    def run_line(self, line, conn):
+        app = self.app
+        argv = shlex.split(line.text)
+        # the options given to `obol batch` apply to every line
+        try:
+            options, argv = app.parser.parse_known_args(
+                argv, copy.copy(app.options))
+        except SystemExit as exit:
+            return exit.code
+        if not argv or argv[0] in ('batch', 'serve'):
+            line.stderr.write('Not a command that can run in a batch\n')
+            return 2
+        # every line runs on the connections of the batch, bound before
+        # the first line was read
+        for name in CONNECTION_OPTIONS + ['w']:
+            if getattr(options, name) != getattr(app.options, name):
+                line.stderr.write('-%s cannot differ from the batch, give it '
+                                  'to obol batch instead\n' % name)
+                return 2
+        try:
+            factory, name, argv = app.command_manager.find_command(argv)
+        except ValueError as error:
+            line.stderr.write('%s\n' % error)
+            return 2
+
+        request = RequestApp(app, conn, options)
+        cmd = factory(request, options, cmd_name=name)
+        try:
+            args = cmd.get_parser('obol %s' % name).parse_args(argv)
+        except SystemExit as exit:
+            return exit.code
+        try:
+            result = cmd.run(args)
+        except Exception as error:
+            request.clean_up(cmd, 1, error)
+            raise
+        request.clean_up(cmd, result, None)
+        return result or 0
+
+    def take_action(self, args):
+        parallel = max(1, args.parallel)
+        pool = ConnectionPool(self.app.connect, parallel)
+        pool.put(self.app.conn)
+        pool.opened = 1
+
+        output = sys.stdout
+        sys.stdout = ThreadLocalStream(sys.stdout)
+        sys.stderr = ThreadLocalStream(sys.stderr)
+        if args.filename == '-':
+            stream = sys.stdin
+        else:
+            stream = open(args.filename)
+
+        pending = collections.deque()
+        slots = threading.Semaphore(parallel)
+        self.failures = []
+
+        def emit(wait=False):
+            while pending and (wait or pending[0].done.is_set()):
+                line = pending.popleft()
+                line.done.wait()
+                output.write(json.dumps(line.result()) + '\n')
+                output.flush()
+
+        def work(line):
+            conn = pool.get()
+            try:
+                self.execute(line, conn)
+            finally:
+                pool.put(conn)
+                line.done.set()
+                slots.release()
+
+        try:
+            # readline, so that lines are handled as they come in
+            for number, text in enumerate(iter(stream.readline, ''), 1):
+                text = text.strip()
+                if not text or text.startswith('#'):
+                    continue
+                if text == 'wait':
+                    emit(True)
+                    continue
+                if self.failures and not args.keep_going:
+                    break
+
+                line = Line(number, text)
+                pending.append(line)
+                if parallel == 1:
+                    self.execute(line, self.app.conn)
+                    line.done.set()
+                else:
+                    slots.acquire()
+                    thread = threading.Thread(target=work, args=(line,))
+                    thread.daemon = True
+                    thread.start()
+                emit(False)
+            emit(True)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            sys.stdout = sys.stdout.default
+            sys.stderr = sys.stderr.default
+
+        if self.failures:
+            return 1
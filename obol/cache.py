@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+import base64
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from .search import paged_search
+
+logger = logging.getLogger(__name__)
+
+# operational attributes that change whenever an entry changes
+STAMPS = ['entryCSN', 'modifyTimestamp']
+
+SCHEMA = """
+create table if not exists results (
+    key text primary key,
+    base text not null,
+    stamps text not null,
+    data text not null,
+    size integer not null,
+    stored real not null,
+    used real not null
+)
+"""
+
+
+def _stamps(entries):
+    """Map each dn to the value that changes when the entry changes"""
+    stamps = {}
+    for dn, attrs in entries:
+        stamp = ''
+        for key, values in attrs.items():
+            if key.lower() == 'entrycsn':
+                stamp = values[0]
+                break
+            if key.lower() == 'modifytimestamp':
+                stamp = values[0]
+        stamps[dn] = stamp
+    return stamps
+
+
+def _strip(entries, attrs):
+    """Drop the stamp attributes unless they were asked for"""
+    wanted = set(attr.lower() for attr in attrs or [])
+    drop = set(stamp.lower() for stamp in STAMPS) - wanted
+    return [(dn, dict((key, values) for key, values in entry.items()
+                      if key.lower() not in drop))
+            for dn, entry in entries]
+
+
+def encode_entries(entries):
+    return json.dumps([(dn, dict((key, [base64.b64encode(value)
+                                        for value in values])
+                                 for key, values in entry.items()))
+                       for dn, entry in entries])
+
+
+def decode_entries(data):
+    return [(dn.encode('utf-8'),
+             dict((key.encode('utf-8'), [base64.b64decode(value)
+                                         for value in values])
+                  for key, values in entry.items()))
+            for dn, entry in json.loads(data)]
+
+
+class SearchCache(object):
+    """A read-through cache of search results in a sqlite file
+
+    Results are kept for ttl seconds. After that they are revalidated
+    by searching again for just the entryCSN/modifyTimestamp of the
+    entries: if no entry was added, removed or changed the cached
+    result is used again. The least recently used results are evicted
+    when the cache grows beyond size bytes.
+    """
+    def __init__(self, path, ttl=300, size=10 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.size = size
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with self._db() as db:
+            db.execute(SCHEMA)
+
+    def _db(self):
+        return _Database(self.path)
+
+    @staticmethod
+    def key(base, scope, filter, attrs):
+        key = '%s|%s|%s|%s' % (base.lower(), scope, filter,
+                               ','.join(attrs or ['*']))
+        return key.decode('utf-8')
+
+    def search(self, conn, base, scope, filter, attrs=None, page_size=500):
+        """Return the result of a search, from the cache if possible"""
+        key = self.key(base, scope, filter, attrs)
+        now = time.time()
+        with self._db() as db:
+            row = db.execute('select stamps, data, stored from results '
+                             'where key = ?', (key,)).fetchone()
+
+        if row is not None:
+            stamps, data, stored = row
+            if now - stored < self.ttl:
+                self.hits += 1
+                self._touch(key, now, False)
+                return decode_entries(data)
+
+            current = _stamps(paged_search(conn, base, scope, filter,
+                                           STAMPS, page_size))
+            if (current == _decode_stamps(stamps) and
+                    all(current.values())):
+                self.revalidated += 1
+                self._touch(key, now, True)
+                return decode_entries(data)
+
+        self.misses += 1
+        fetch = list(attrs or ['*']) + STAMPS
+        entries = list(paged_search(conn, base, scope, filter, fetch,
+                                    page_size))
+        stamps = json.dumps(_stamps(entries))
+        entries = _strip(entries, attrs)
+        self.store(key, base, stamps, encode_entries(entries), now)
+        return entries
+
+    def _touch(self, key, now, stored):
+        with self._db() as db:
+            if stored:
+                db.execute('update results set used = ?, stored = ? '
+                           'where key = ?', (now, now, key))
+            else:
+                db.execute('update results set used = ? where key = ?',
+                           (now, key))
+
+    def store(self, key, base, stamps, data, now):
+        with self._db() as db:
+            db.execute('insert or replace into results values '
+                       '(?, ?, ?, ?, ?, ?, ?)',
+                       (key, base.lower().decode('utf-8'), stamps, data,
+                        len(data), now, now))
+            self._evict(db)
+
+    def _evict(self, db):
+        total = db.execute('select coalesce(sum(size), 0) '
+                           'from results').fetchone()[0]
+        if total <= self.size:
+            return
+        for key, size in db.execute('select key, size from results '
+                                    'order by used').fetchall():
+            db.execute('delete from results where key = ?', (key,))
+            total -= size
+            if total <= self.size:
+                break
+
+    def invalidate(self, dn):
+        """Forget every result of a search that could contain dn
+
+        dn may also be the base of a subtree, in which case all results
+        of searches in that subtree are dropped too.
+        """
+        dn = dn.lower().decode('utf-8')
+        with self._db() as db:
+            for key, base in db.execute('select key, base '
+                                        'from results').fetchall():
+                if (dn == base or dn.endswith(',' + base) or
+                        base.endswith(',' + dn)):
+                    db.execute('delete from results where key = ?', (key,))
+
+    def clear(self):
+        with self._db() as db:
+            db.execute('delete from results')
+
+
+def _decode_stamps(stamps):
+    return dict((dn.encode('utf-8'), stamp.encode('utf-8'))
+                for dn, stamp in json.loads(stamps).items())
+
+
+class _Database(object):
+    """A sqlite connection that commits and closes on exit
+
+    A new connection is used for every operation, so the cache can be
+    shared between the threads of `obol serve`.
+    """
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, timeout=10)
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.db.commit()
+        self.db.close()
+
+
+def cached_search(app, base, scope, filter, attrs=None):
+    """Search through the cache of the application if it has one"""
+    page_size = app.options.page_size
+    if app.cache is None:
+        return paged_search(app.conn, base, scope, filter, attrs, page_size)
+    try:
+        return app.cache.search(app.conn, base, scope, filter, attrs,
+                                page_size)
+    except sqlite3.Error as error:
+        logger.warning('cache not available: %s', error)
+        return paged_search(app.conn, base, scope, filter, attrs, page_size)
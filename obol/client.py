@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+import json
+import socket
+import sys
+
+# The client side of `obol serve`. It runs before anything else is
+# imported, so it only uses the standard library.
+
+
+def forward(path, argv):
+    """Run a command line through a running obol server
+
+    Returns the exit status of the command, or None when no server is
+    listening on path or it refused to run the command.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except socket.error:
+        client.close()
+        return None
+
+    try:
+        client.sendall(json.dumps({'argv': argv}) + '\n')
+        for line in client.makefile('r'):
+            message = json.loads(line)
+            if 'stdout' in message:
+                sys.stdout.write(message['stdout'])
+            elif 'stderr' in message:
+                sys.stderr.write(message['stderr'])
+            elif 'status' in message:
+                return message['status']
+            elif 'refused' in message:
+                return None
+    finally:
+        client.close()
+    return 1
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+import logging
+
+import ldap
+import ldap.sasl
+
+logger = logging.getLogger(__name__)
+
+# the TLS options are set once per process, see configure_tls
+_tls = {}
+
+
+def parse_keepalive(value):
+    """Split IDLE[,PROBES[,INTERVAL]] into three ints or Nones"""
+    if not value:
+        return None, None, None
+    parts = [int(part) if part else None for part in value.split(',')]
+    if len(parts) > 3:
+        raise ValueError("Illegal keepalive value %s" % value)
+    return tuple(parts + [None] * (3 - len(parts)))
+
+
+def configure_tls(options):
+    """Set the TLS options of the process from the global options
+
+    They are set on the library instead of on every connection, so all
+    connections share one TLS context and its session cache instead of
+    each creating its own.
+    """
+    settings = [(ldap.OPT_X_TLS_CACERTFILE, options.cacert),
+                (ldap.OPT_X_TLS_CERTFILE, options.cert),
+                (ldap.OPT_X_TLS_KEYFILE, options.key)]
+    if options.tls_reqcert:
+        value = getattr(ldap, 'OPT_X_TLS_%s' % options.tls_reqcert.upper())
+        settings.append((ldap.OPT_X_TLS_REQUIRE_CERT, value))
+    for option, value in settings:
+        if value is not None and _tls.get(option) != value:
+            ldap.set_option(option, value)
+            _tls[option] = value
+
+
+def prepare(conn, options, host):
+    """Apply the timeout, keepalive and TLS options to a new connection
+
+    StartTLS is done here when asked for, so the bind that follows is
+    protected.
+    """
+    conn.set_option(ldap.OPT_PROTOCOL_VERSION, ldap.VERSION3)
+    if options.network_timeout:
+        conn.set_option(ldap.OPT_NETWORK_TIMEOUT, options.network_timeout)
+    if options.timeout:
+        conn.set_option(ldap.OPT_TIMEOUT, options.timeout)
+        # the synchronous methods of python-ldap wait this long
+        conn.timeout = options.timeout
+
+    idle, probes, interval = parse_keepalive(options.keepalive)
+    for name, value in [('OPT_X_KEEPALIVE_IDLE', idle),
+                        ('OPT_X_KEEPALIVE_PROBES', probes),
+                        ('OPT_X_KEEPALIVE_INTERVAL', interval)]:
+        option = getattr(ldap, name, None)
+        if value is None:
+            continue
+        if option is None:
+            logger.warning('this python-ldap cannot set %s', name)
+            continue
+        conn.set_option(option, value)
+
+    configure_tls(options)
+    if options.starttls and host.lower().startswith('ldap://'):
+        conn.start_tls_s()
+
+
+def bind(conn, options):
+    """Bind with SASL EXTERNAL if asked for, otherwise with -D and -w
+
+    EXTERNAL uses the credentials of the transport: the uid of the
+    process on ldapi://, or the client certificate (--cert) on TLS.
+    """
+    if options.Y == 'EXTERNAL':
+        conn.sasl_interactive_bind_s('', ldap.sasl.external())
+    else:
+        conn.simple_bind_s(options.D, options.w)
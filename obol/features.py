@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+import json
+import logging
+import os
+import re
+import time
+
+import ldap
+
+logger = logging.getLogger(__name__)
+
+# the controls and extended operations obol has a faster path for
+PAGED_RESULTS = '1.2.840.113556.1.4.319'
+SERVER_SIDE_SORT = '1.2.840.113556.1.4.473'
+VIRTUAL_LIST_VIEW = '2.16.840.1.113730.3.4.9'
+SYNCREPL = '1.3.6.1.4.1.4203.1.9.1.1'
+TRANSACTIONS = '1.3.6.1.1.21.1'
+PASSWORD_MODIFY = '1.3.6.1.4.1.4203.1.11.1'
+
+FEATURES = [
+    ('paged results', 'controls', PAGED_RESULTS),
+    ('server side sorting', 'controls', SERVER_SIDE_SORT),
+    ('virtual list view', 'controls', VIRTUAL_LIST_VIEW),
+    ('syncrepl', 'controls', SYNCREPL),
+    ('transactions', 'extensions', TRANSACTIONS),
+    ('password modify', 'extensions', PASSWORD_MODIFY),
+]
+
+ROOT_DSE_ATTRIBUTES = {
+    'supportedcontrol': 'controls',
+    'supportedextension': 'extensions',
+    'supportedfeatures': 'features',
+    'supportedsaslmechanisms': 'sasl_mechanisms',
+    'supportedldapversion': 'ldap_versions',
+    'namingcontexts': 'naming_contexts',
+    'vendorname': 'vendor',
+    'vendorversion': 'vendor_version',
+    'subschemasubentry': 'subschema',
+}
+
+# the names in an objectClasses value: NAME 'a' or NAME ( 'a' 'b' )
+OBJECTCLASS_NAMES = re.compile(r"NAME\s+(?:'([^']+)'|\(([^)]*)\))")
+
+
+def objectclass_names(definitions):
+    """The lower case names of objectClasses schema definitions"""
+    names = set()
+    for definition in definitions:
+        match = OBJECTCLASS_NAMES.search(definition)
+        if match:
+            names.update(name.lower() for name in
+                         re.findall(r"'([^']+)'", match.group(0)))
+    return names
+
+
+def probe(conn):
+    """Read what the server supports from its root DSE and schema
+
+    When the root DSE cannot be read the profile is empty, and what
+    the server supports is unknown.
+    """
+    try:
+        result = conn.search_s('', ldap.SCOPE_BASE, '(objectclass=*)',
+                               ['+', '*'])
+    except ldap.LDAPError as error:
+        logger.warning('cannot read the root DSE: %s', error)
+        return {'probed': time.time()}
+
+    profile = dict((key, []) for key in ROOT_DSE_ATTRIBUTES.values())
+    for _, attrs in result:
+        for key, values in attrs.items():
+            name = ROOT_DSE_ATTRIBUTES.get(key.lower())
+            if name:
+                profile[name] = values
+
+    profile['objectclasses'] = []
+    if profile['subschema']:
+        try:
+            result = conn.search_s(profile['subschema'][0], ldap.SCOPE_BASE,
+                                   '(objectclass=subschema)',
+                                   ['objectClasses'])
+        except ldap.LDAPError as error:
+            logger.warning('cannot read the schema: %s', error)
+            result = []
+        for _, attrs in result:
+            for key, values in attrs.items():
+                if key.lower() == 'objectclasses':
+                    profile['objectclasses'] = sorted(
+                        objectclass_names(values))
+    profile['probed'] = time.time()
+    return profile
+
+
+class Profile(object):
+    """What a server supports, as read from its root DSE
+
+    Servers do not advertise their size limit; it is not part of the
+    profile. When the root DSE could not be read, controls and
+    extensions are None.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.controls = self.extensions = None
+        if 'controls' in data:
+            self.controls = set(data['controls'])
+            self.extensions = set(data.get('extensions', []))
+        self.objectclasses = set(data.get('objectclasses', []))
+
+    def supports(self, oid):
+        """Whether the server advertises a control or extension, None
+        when that is unknown"""
+        if self.controls is None:
+            return None
+        return oid in self.controls or oid in self.extensions
+
+    def has_objectclass(self, name):
+        """Whether the schema of the server defines an object class
+
+        Unknown if the schema could not be read, which counts as yes.
+        """
+        return not self.objectclasses or name.lower() in self.objectclasses
+
+    def age(self):
+        return time.time() - self.data.get('probed', 0)
+
+    def features(self):
+        """(name, supported) for the features obol can make use of"""
+        return [(name, self.supports(oid)) for name, _, oid in FEATURES]
+
+
+class ProfileCache(object):
+    """Server profiles kept in a JSON file, probed again after ttl"""
+    def __init__(self, path, ttl=86400):
+        self.path = path
+        self.ttl = ttl
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as stream:
+                return json.load(stream)
+        except ValueError:
+            return {}
+
+    def save(self, profiles):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = '%s.%d' % (self.path, os.getpid())
+        with open(tmp, 'w') as stream:
+            json.dump(profiles, stream)
+        os.rename(tmp, self.path)
+
+    def get(self, host, connect, refresh=False):
+        """The profile of host, probed when it is not known
+
+        connect is called for a connection to probe on, so a known
+        profile does not need one. When host cannot be reached the
+        profile known so far is used, which may be empty.
+        """
+        profiles = self.load()
+        profile = Profile(profiles.get(host, {}))
+        if refresh or host not in profiles or profile.age() > self.ttl:
+            logger.debug('probing %s', host)
+            try:
+                conn = connect()
+            except (ldap.SERVER_DOWN, ldap.TIMEOUT,
+                    ldap.CONNECT_ERROR) as error:
+                # kept for this command only, the next one tries again
+                logger.warning('cannot probe %s: %s', host, error)
+                return Profile(dict(profile.data, probed=time.time()))
+            profile = Profile(probe(conn))
+            profiles[host] = profile.data
+            self.save(profiles)
+        return profile
@@ -1,39 +1,70 @@
 #!/usr/bin/env python
-from retrying import retry
-from ldif import LDIFWriter
 import sys
 import ldap
 
 from cliff.command import Command
 
+from .api import (add_group, add_members, delete_groups, group_members,
+                  list_groups, remove_members, resolve_users)
+from .cache import cached_search
+from .mirror import local_search
+from .output import add_output_arguments, combine_filter, entry_writer
+from .pipeline import describe
+from .sort import add_sort_arguments, sort_attributes, sort_window
+from .user import read_names
+
 
 class GroupList(Command):
     """List Users"""
+    readonly = True
+
     def get_parser(self, name):
         parser = super(GroupList, self).get_parser(name)
         parser.add_argument('--subtree',
                             default=self.app.default('group_tree', 'ou=Group'))
+        add_output_arguments(parser, 'plain')
+        add_sort_arguments(parser)
+        parser.add_argument('--local', action='store_true',
+                            help="answer from the local mirror")
         return parser
 
     def take_action(self, args):
-        conn = self.app.conn
         b = self.app.options.b
         context = args.subtree
 
         base_dn = '%s,%s' % (context, b)
-        filter = '(objectclass=posixGroup)'
-        for _, attrs in conn.search_s(base_dn, ldap.SCOPE_SUBTREE, filter):
-            print(attrs['cn'][0])
+        filter = combine_filter('(objectclass=posixGroup)', args.filter)
+        attrs = args.attrs or ['cn']
+        writer = entry_writer(args.format, sys.stdout, attrs)
+        if args.local:
+            entries = local_search(self.app, base_dn, filter,
+                                   sort_attributes(attrs, args.sort))
+            entries = sort_window(entries, args.sort, args.offset,
+                                  args.count, attrs)
+        else:
+            conn = self.app.conn
+            controls = self.app.profile().controls if args.sort else None
+            entries = list_groups(conn, b, context, filter, attrs,
+                                  self.app.options.page_size, args.sort,
+                                  args.offset, args.count, controls)
+        for dn, entry in entries:
+            writer.write(dn, entry)
 
 
 class GroupDelete(Command):
-    """Delete a user from the system"""
+    """Delete one or more groups from the LDAP"""
     def get_parser(self, name):
         parser = super(GroupDelete, self).get_parser(name)
 
-        parser.add_argument('groupname')
+        parser.add_argument('groupname', nargs='*')
         parser.add_argument('--subtree',
                             default=self.app.default('group_tree', 'ou=Group'))
+        parser.add_argument('--from-file', metavar='FILENAME',
+                            help="read the group names from a file, one "
+                                 "per line, - for stdin")
+        parser.add_argument('--concurrency', type=int,
+                            default=int(self.app.default('window', 64)),
+                            help="maximum number of operations in flight")
 
         return parser
 
@@ -41,13 +72,23 @@ class GroupDelete(Command):
         conn = self.app.conn
         b = self.app.options.b
         context = args.subtree
-        groupname = args.groupname
+        groupnames = read_names(args.groupname, args.from_file)
+        if not groupnames:
+            print("No groups to delete")
+            return 1
 
-        try:
-            dn = 'cn=%s,%s,%s' % (groupname, context, b)
-            conn.delete_s(dn)
-        except Exception as e:
-            print(e)
+        self.invalidates = ['cn=%s,%s,%s' % (groupname, context, b)
+                            for groupname in groupnames]
+        errors = delete_groups(conn, b, groupnames, context,
+                               max(1, args.concurrency))
+        for groupname in sorted(errors):
+            print("%s: failed: %s" % (groupname, describe(errors[groupname])))
+
+        total = len(set(groupnames))
+        if total > 1:
+            print("Deleted %d of %d groups" % (total - len(errors), total))
+        if errors:
+            return 1
 
 
 class GroupAdd(Command):
@@ -67,37 +108,8 @@ class GroupAdd(Command):
         gidNumber = args.gidNumber
         groupname = args.groupname
 
-        if not gidNumber:
-            gidNumber = self.increment_gid(b)
-
-        # first add the group
-        dn = 'cn=%s,%s,%s' % (groupname, context, b)
-        add_record = [
-            ('objectclass', ['top', 'posixGroup']),
-            ('cn', [groupname]),
-            ('gidNumber', [gidNumber])
-        ]
-        conn.add_s(dn, add_record)
-
-    @retry(stop_max_delay=10000)
-    def increment_gid(self, b):
-        """Generate a new groupid"""
-        conn = self.app.conn
-        dn = 'cn=gid,%s' % b
-        filter = 'objectclass=*'
-        attrs = ['uidNumber']
-
-        try:
-            result = conn.search_s(dn, ldap.SCOPE_SUBTREE, filter, attrs)
-            gidNumber = result[0][1]['uidNumber'][0]
-
-            mod_attrs = [(ldap.MOD_DELETE, 'uidNumber', gidNumber),
-                         (ldap.MOD_ADD, 'uidNumber', str(int(gidNumber)+1))]
-
-            conn.modify_s(dn, mod_attrs)
-        except Exception as e:
-            print(e)
-        return gidNumber
+        self.invalidates = ['cn=%s,%s,%s' % (groupname, context, b)]
+        add_group(conn, b, groupname, gidNumber, context)
 
 
 class GroupAddUsers(Command):
@@ -119,14 +131,16 @@ class GroupAddUsers(Command):
         username = args.username
         context = args.subtree
 
-        dn = 'cn=%s,%s,%s' % (groupname, context, b)
-        for name in username:
-            try:
-                mod_attrs = []
-                mod_attrs.append((ldap.MOD_ADD, 'memberuid', name))
-                conn.modify_s(dn, mod_attrs)
-            except Exception as error:
-                print("Error adding %s to %s: %s" % (name, groupname, error))
+        self.invalidates = ['cn=%s,%s,%s' % (groupname, context, b)]
+        try:
+            errors = add_members(conn, b, groupname, username, context)
+        except ldap.LDAPError as error:
+            errors = [(name, error) for name in username]
+        for name, error in errors:
+            print("Error adding %s to %s: %s" % (name, groupname,
+                                                 describe(error)))
+        if errors:
+            return 1
 
 
 class GroupDelUsers(Command):
@@ -146,33 +160,91 @@ class GroupDelUsers(Command):
         username = args.username
         context = args.subtree
 
-        dn = 'cn=%s,%s,%s' % (groupname, context, b)
-        mod_attrs = []
-        for name in username:
-            mod_attrs.append((ldap.MOD_DELETE, 'memberuid', name))
-        conn.modify_s(dn, mod_attrs)
+        self.invalidates = ['cn=%s,%s,%s' % (groupname, context, b)]
+        try:
+            errors = remove_members(conn, b, groupname, username, context)
+        except ldap.LDAPError as error:
+            errors = [(name, error) for name in username]
+        for name, error in errors:
+            print("Error removing %s from %s: %s" % (name, groupname,
+                                                     describe(error)))
+        if errors:
+            return 1
 
 
 class GroupShow(Command):
     """Remove users from a group"""
+    readonly = True
+
     def get_parser(self, name):
         parser = super(GroupShow, self).get_parser(name)
         parser.add_argument('groupname')
         parser.add_argument('--subtree',
                             default=self.app.default('group_tree', 'ou=Group'))
+        add_output_arguments(parser, 'ldif')
+        parser.add_argument('--local', action='store_true',
+                            help="answer from the local mirror")
         return parser
 
     def take_action(self, args):
-        conn = self.app.conn
         b = self.app.options.b
         context = args.subtree
         groupname = args.groupname
 
         base_dn = '%s,%s' % (context, b)
-        filter = '(cn=%s)' % groupname
-        writer = LDIFWriter(sys.stdout)
-        for dn, attrs in conn.search_s(base_dn, ldap.SCOPE_SUBTREE, filter):
-            writer.unparse(dn, attrs)
+        filter = combine_filter('(cn=%s)' % groupname, args.filter)
+        writer = entry_writer(args.format, sys.stdout, args.attrs)
+        if args.local:
+            entries = local_search(self.app, base_dn, filter, args.attrs)
+        else:
+            entries = cached_search(self.app, base_dn, ldap.SCOPE_SUBTREE,
+                                    filter, args.attrs)
+        for dn, attrs in entries:
+            writer.write(dn, attrs)
+
+
+class GroupMembers(Command):
+    """List the members of a group"""
+    readonly = True
+
+    def get_parser(self, name):
+        parser = super(GroupMembers, self).get_parser(name)
+        parser.add_argument('groupname')
+        parser.add_argument('--subtree',
+                            default=self.app.default('group_tree', 'ou=Group'))
+        parser.add_argument('--usertree',
+                            default=self.app.default('user_tree', 'ou=People'))
+        parser.add_argument('--resolve', action='store_true',
+                            help="look up the entries of the members")
+        add_output_arguments(parser, 'plain')
+        parser.add_argument('--chunk', type=int,
+                            default=int(self.app.default('chunk', 100)),
+                            help="members to look up per search")
+        parser.add_argument('--window', type=int, default=8,
+                            help="number of searches in flight")
+        return parser
+
+    def take_action(self, args):
+        conn = self.app.conn
+        b = self.app.options.b
+        try:
+            members = group_members(conn, b, args.groupname, args.subtree)
+        except ldap.NO_SUCH_OBJECT:
+            print("%s: no such group" % args.groupname)
+            return 1
+        if not args.resolve:
+            for member in members:
+                print(member)
+            return
+
+        attrs = args.attrs or ['uid', 'uidNumber', 'cn']
+        writer = entry_writer(args.format, sys.stdout, attrs)
+        users, missing = resolve_users(conn, b, members, args.usertree,
+                                       attrs, args.chunk, args.window)
+        for dn, entry in users:
+            writer.write(dn, entry)
+        for name in missing:
+            sys.stderr.write("%s: no such user\n" % name)
 
 
 def csep(s):
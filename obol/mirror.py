@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import ldap
+
+from cliff.command import Command
+
+from .cache import encode_entries, decode_entries
+from .syncrepl import Consumer
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+create table if not exists entries (
+    uuid text primary key,
+    tree text not null,
+    dn text not null,
+    ldn text not null,
+    data text not null
+);
+create table if not exists attrs (
+    uuid text not null,
+    attr text not null,
+    norm text not null
+);
+create index if not exists attrs_value on attrs (attr, norm);
+create index if not exists attrs_uuid on attrs (uuid);
+create index if not exists entries_tree on entries (tree, ldn);
+create table if not exists cookies (
+    tree text primary key,
+    cookie text
+);
+"""
+
+
+def _unescape(value):
+    return re.sub(r'\\([0-9a-fA-F]{2})',
+                  lambda match: chr(int(match.group(1), 16)), value)
+
+
+def _parse(text, pos):
+    if text[pos] != '(':
+        raise ValueError("Bad filter %r at %d" % (text, pos))
+    pos += 1
+    op = text[pos]
+    if op in '&|':
+        pos += 1
+        children = []
+        while text[pos] == '(':
+            child, pos = _parse(text, pos)
+            children.append(child)
+        return (op, children), pos + 1
+    if op == '!':
+        child, pos = _parse(text, pos + 1)
+        return ('!', child), pos + 1
+
+    end = text.index(')', pos)
+    item = text[pos:end]
+    match = re.match(r'([\w;.-]+)(>=|<=|~=|=)(.*)$', item)
+    if not match:
+        raise ValueError("Bad filter item %r" % item)
+    attr, op, value = match.groups()
+    if op == '~=':
+        op = '='
+    if op == '=' and value == '*':
+        return ('present', attr), end + 1
+    if op == '=' and '*' in value:
+        return ('substring', attr, value), end + 1
+    return (op, attr, _unescape(value)), end + 1
+
+
+def parse_filter(text):
+    """Parse an LDAP filter string into a tree of tuples"""
+    text = text.strip()
+    if not text.startswith('('):
+        text = '(%s)' % text
+    node, pos = _parse(text, 0)
+    if pos != len(text):
+        raise ValueError("Trailing characters in filter %r" % text)
+    return node
+
+
+def _like(pattern):
+    parts = [_unescape(part).replace('\\', '\\\\')
+                            .replace('%', '\\%').replace('_', '\\_')
+             for part in pattern.split('*')]
+    return '%'.join(parts).lower().decode('utf-8')
+
+
+def filter_sql(node):
+    """Translate a parsed filter into a where clause on entries"""
+    op = node[0]
+    if op in '&|':
+        if not node[1]:
+            return ('1' if op == '&' else '0'), []
+        clauses, params = [], []
+        for child in node[1]:
+            clause, child_params = filter_sql(child)
+            clauses.append('(%s)' % clause)
+            params.extend(child_params)
+        joiner = ' and ' if op == '&' else ' or '
+        return joiner.join(clauses), params
+    if op == '!':
+        clause, params = filter_sql(node[1])
+        return 'not (%s)' % clause, params
+
+    attr = node[1].lower().decode('utf-8')
+    subquery = 'uuid in (select uuid from attrs where attr = ? and %s)'
+    if op == 'present':
+        return 'uuid in (select uuid from attrs where attr = ?)', [attr]
+    if op == 'substring':
+        return (subquery % "norm like ? escape '\\'",
+                [attr, _like(node[2])])
+
+    value = node[2].lower().decode('utf-8')
+    if op == '=':
+        return subquery % 'norm = ?', [attr, value]
+    if value.isdigit():
+        clause = subquery % ('cast(norm as integer) %s ?' % op)
+        return clause, [attr, int(value)]
+    return subquery % ('norm %s ?' % op), [attr, value]
+
+
+class Mirror(object):
+    """A local sqlite replica of parts of the directory
+
+    Every attribute value is indexed in lower case, so filters can be
+    answered with index lookups instead of scanning the entries.
+    """
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=10)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def cookie(self, tree):
+        row = self.db.execute('select cookie from cookies where tree = ?',
+                              (tree,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return row[0].encode('utf-8')
+
+    def set_cookie(self, tree, cookie):
+        self.db.execute('insert or replace into cookies values (?, ?)',
+                        (tree, cookie and cookie.decode('utf-8')))
+
+    def uuids(self, tree):
+        return [uuid for uuid, in self.db.execute(
+            'select uuid from entries where tree = ?', (tree,))]
+
+    def store(self, tree, dn, attrs, uuid):
+        self.delete([uuid])
+        dn = dn.decode('utf-8')
+        self.db.execute('insert into entries values (?, ?, ?, ?, ?)',
+                        (uuid, tree, dn, dn.lower(),
+                         encode_entries([(dn, attrs)])))
+        rows = []
+        for key, values in attrs.items():
+            for value in values:
+                try:
+                    rows.append((uuid, key.lower().decode('utf-8'),
+                                 value.decode('utf-8').lower()))
+                except UnicodeDecodeError:
+                    # binary values are not indexed
+                    pass
+        self.db.executemany('insert into attrs values (?, ?, ?)', rows)
+
+    def delete(self, uuids):
+        for uuid in uuids:
+            self.db.execute('delete from entries where uuid = ?', (uuid,))
+            self.db.execute('delete from attrs where uuid = ?', (uuid,))
+
+    def count(self, tree):
+        return self.db.execute('select count(*) from entries where tree = ?',
+                               (tree,)).fetchone()[0]
+
+    def search(self, base, filter, attrs=None):
+        """Yield the (dn, attrs) of the entries under base matching filter"""
+        where, params = filter_sql(parse_filter(filter))
+        base = base.lower().decode('utf-8')
+        suffix = ',' + base.replace('\\', '\\\\').replace('%', '\\%') \
+                           .replace('_', '\\_')
+        query = ("select data from entries where (ldn = ? or ldn like ? "
+                 "escape '\\') and %s order by ldn" % where)
+        wanted = attrs and set(attr.lower() for attr in attrs)
+        for data, in self.db.execute(query, [base, '%' + suffix] + params):
+            for dn, entry in decode_entries(data):
+                if wanted:
+                    entry = dict((key, values)
+                                 for key, values in entry.items()
+                                 if key.lower() in wanted)
+                yield dn, entry
+
+
+class TreeConsumer(Consumer):
+    """Keeps one subtree of the mirror in sync"""
+    def __init__(self, conn, mirror, tree):
+        super(TreeConsumer, self).__init__(conn)
+        self.mirror = mirror
+        self.tree = tree
+        self.cookie = mirror.cookie(tree)
+
+    def uuids(self):
+        return self.mirror.uuids(self.tree)
+
+    def entry(self, dn, attrs, uuid):
+        self.mirror.store(self.tree, dn, attrs, uuid)
+
+    def delete(self, uuids):
+        self.mirror.delete(uuids)
+
+    def checkpoint(self):
+        self.mirror.set_cookie(self.tree, self.cookie)
+        self.mirror.db.commit()
+
+
+def local_search(app, base, filter, attrs=None):
+    """Answer a search from the mirror instead of the server"""
+    path = app.state_path('mirror.sqlite')
+    if not os.path.exists(path):
+        raise RuntimeError("No local mirror, run `obol mirror` first")
+    mirror = Mirror(path)
+    try:
+        for dn, entry in mirror.search(base, filter, attrs):
+            yield dn, entry
+    finally:
+        mirror.close()
+
+
+def follow(connect, path, tree, base_dn):
+    """Apply the changes in one tree to the mirror as they happen"""
+    mirror = Mirror(path)
+    try:
+        consumer = TreeConsumer(connect(), mirror, tree)
+        consumer.refresh(base_dn, ldap.SCOPE_SUBTREE, '(objectclass=*)',
+                         ['*'], mode='refreshAndPersist')
+    except Exception as error:
+        logger.error('stopped following %s: %s', base_dn, error)
+    finally:
+        mirror.close()
+
+
+class MirrorCommand(Command):
+    """Keep a local copy of the user and group trees up to date"""
+
+    def get_parser(self, name):
+        parser = super(MirrorCommand, self).get_parser(name)
+        parser.add_argument('--user_tree',
+                            default=self.app.default('user_tree', 'ou=People'))
+        parser.add_argument('--group_tree',
+                            default=self.app.default('group_tree', 'ou=Group'))
+        parser.add_argument('--follow', action='store_true',
+                            help="keep running and apply changes as they "
+                                 "happen")
+        parser.add_argument('--reset', action='store_true',
+                            help="throw the local copy away and load it "
+                                 "again")
+        return parser
+
+    def take_action(self, args):
+        b = self.app.options.b
+        conn = self.app.conn
+        path = self.app.state_path('mirror.sqlite')
+        if args.reset and os.path.exists(path):
+            os.unlink(path)
+
+        trees = [args.user_tree, args.group_tree]
+        mirror = Mirror(path)
+        try:
+            for tree in trees:
+                base_dn = '%s,%s' % (tree, b)
+                consumer = TreeConsumer(conn, mirror, tree)
+                consumer.refresh(base_dn, ldap.SCOPE_SUBTREE,
+                                 '(objectclass=*)', ['*'])
+                consumer.checkpoint()
+                print("%s: %d entries" % (base_dn, mirror.count(tree)))
+        finally:
+            mirror.close()
+
+        if not args.follow:
+            return
+
+        # a persistent search never ends, so every tree gets its own
+        # connection and thread
+        threads = []
+        for tree in trees:
+            base_dn = '%s,%s' % (tree, b)
+            thread = threading.Thread(target=follow,
+                                      args=(self.app.connect, path,
+                                            tree, base_dn))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        logger.info('following changes, press ctrl-c to stop')
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
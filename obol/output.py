@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+import base64
+import csv
+import json
+
+from ldif import LDIFWriter
+
+FORMATS = ['plain', 'csv', 'json', 'ldif']
+
+
+def add_output_arguments(parser, format):
+    """Add the --attrs, --filter and --format options to a parser"""
+    parser.add_argument('--attrs', type=lambda s: s.split(','),
+                        help="a comma separated list of attributes "
+                             "to fetch")
+    parser.add_argument('--filter',
+                        help="an LDAP filter the entries must also match")
+    parser.add_argument('--format', choices=FORMATS, default=format)
+
+
+def combine_filter(filter, extra):
+    """AND an optional extra filter with a filter"""
+    if not extra:
+        return filter
+    if not extra.startswith('('):
+        extra = '(%s)' % extra
+    return '(&%s%s)' % (filter, extra)
+
+
+def printable(value):
+    """Return a value as is if it is text, base64 encoded otherwise"""
+    try:
+        value.decode('utf-8')
+        return value
+    except UnicodeDecodeError:
+        return base64.b64encode(value)
+
+
+def get_values(entry, attr):
+    """Look up an attribute case insensitively"""
+    attr = attr.lower()
+    for key, values in entry.items():
+        if key.lower() == attr:
+            return values
+    return []
+
+
+class PlainWriter(object):
+    """One tab separated line per entry; the dn if no attributes given"""
+    def __init__(self, stream, attrs):
+        self.stream = stream
+        self.attrs = attrs
+
+    def write(self, dn, entry):
+        if not self.attrs:
+            fields = [dn]
+        else:
+            fields = [','.join(printable(value)
+                               for value in get_values(entry, attr))
+                      for attr in self.attrs]
+        self.stream.write('\t'.join(fields) + '\n')
+
+
+class CsvWriter(object):
+    """CSV with a header; columns from the first entry if not given"""
+    def __init__(self, stream, attrs):
+        self.writer = csv.writer(stream)
+        self.attrs = attrs
+        self.header = False
+
+    def write(self, dn, entry):
+        if not self.header:
+            if not self.attrs:
+                self.attrs = sorted(entry.keys())
+            self.writer.writerow(['dn'] + self.attrs)
+            self.header = True
+        row = [dn] + [';'.join(printable(value)
+                               for value in get_values(entry, attr))
+                      for attr in self.attrs]
+        self.writer.writerow(row)
+
+
+class JsonWriter(object):
+    """JSON lines, one object per entry"""
+    def __init__(self, stream, attrs):
+        self.stream = stream
+
+    def write(self, dn, entry):
+        record = {'dn': dn}
+        for key, values in entry.items():
+            record[key] = [printable(value).decode('utf-8')
+                           for value in values]
+        self.stream.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+class LdifWriter(object):
+    def __init__(self, stream, attrs):
+        self.writer = LDIFWriter(stream)
+
+    def write(self, dn, entry):
+        self.writer.unparse(dn, entry)
+
+
+WRITERS = {
+    'plain': PlainWriter,
+    'csv': CsvWriter,
+    'json': JsonWriter,
+    'ldif': LdifWriter,
+}
+
+
+def entry_writer(format, stream, attrs=None):
+    return WRITERS[format](stream, attrs)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+import base64
+import crypt
+import hashlib
+import os
+
+SCHEMES = ['SSHA', 'SSHA512', 'PBKDF2-SHA512', 'CRYPT']
+
+# rounds used when none are given, the defaults of OpenLDAP's
+# pw-pbkdf2 module and of glibc's SHA-512 crypt
+DEFAULT_ROUNDS = {
+    'PBKDF2-SHA512': 10000,
+    'CRYPT': 5000,
+}
+
+CRYPT_SALT = ('./0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+              'abcdefghijklmnopqrstuvwxyz')
+
+
+def is_hashed(password):
+    """Whether password already carries a {SCHEME} prefix"""
+    if not password.startswith('{'):
+        return False
+    return password[1:].split('}', 1)[0].upper() in SCHEMES
+
+
+def _ab64(data):
+    """The base64 variant used by pw-pbkdf2: . for + and no padding"""
+    return base64.b64encode(data).replace('+', '.').rstrip('=')
+
+
+def ssha(password, salt_size=4):
+    salt = os.urandom(salt_size)
+    sha = hashlib.sha1(password)
+    sha.update(salt)
+    return '{SSHA}' + base64.b64encode(sha.digest() + salt)
+
+
+def ssha512(password):
+    salt = os.urandom(16)
+    sha = hashlib.sha512(password)
+    sha.update(salt)
+    return '{SSHA512}' + base64.b64encode(sha.digest() + salt)
+
+
+def pbkdf2_sha512(password, rounds):
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha512', password, salt, rounds)
+    return '{PBKDF2-SHA512}%d$%s$%s' % (rounds, _ab64(salt), _ab64(digest))
+
+
+def sha512_crypt(password, rounds):
+    salt = ''.join(CRYPT_SALT[ord(c) % len(CRYPT_SALT)]
+                   for c in os.urandom(16))
+    return '{CRYPT}' + crypt.crypt(password,
+                                   '$6$rounds=%d$%s$' % (rounds, salt))
+
+
+def hash_password(password, scheme='SSHA', rounds=None):
+    """Hash password with one of SCHEMES, tagged for userPassword"""
+    if is_hashed(password):
+        return password
+    scheme = scheme.upper()
+    rounds = rounds or DEFAULT_ROUNDS.get(scheme)
+    if scheme == 'SSHA':
+        return ssha(password)
+    if scheme == 'SSHA512':
+        return ssha512(password)
+    if scheme == 'PBKDF2-SHA512':
+        return pbkdf2_sha512(password, rounds)
+    if scheme == 'CRYPT':
+        return sha512_crypt(password, rounds)
+    raise ValueError("Unknown password scheme %s" % scheme)
+
+
+def hash_job(job):
+    """hash_password for a (tag, password, scheme, rounds) tuple
+
+    A module level function, so it can be sent to a process pool.
+    """
+    tag, password, scheme, rounds = job
+    return tag, hash_password(password, scheme, rounds)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+import collections
+import logging
+import time
+
+import ldap
+
+logger = logging.getLogger(__name__)
+
+
+class Pipeline(object):
+    """Keep a bounded window of asynchronous LDAP operations in flight
+
+    Operations are sent with the asynchronous python-ldap methods
+    (add, modify, delete, ...) and their message ids are queued. When
+    the window is full the oldest outstanding result is collected
+    before the next request is sent, so the server always has work
+    queued but memory stays bounded.
+
+    The callback is called as callback(tag, result, error) for every
+    operation once its result is in. Exactly one of result and error
+    is set.
+    """
+    def __init__(self, conn, window=64, callback=None):
+        self.conn = conn
+        self.window = max(1, window)
+        self.callback = callback
+        self.pending = collections.deque()
+        self.succeeded = 0
+        self.failed = 0
+        self.started = time.time()
+
+    def submit(self, tag, method, *args, **kwargs):
+        """Send conn.<method>(*args) and queue its message id"""
+        while len(self.pending) >= self.window:
+            self.collect()
+        try:
+            msgid = getattr(self.conn, method)(*args, **kwargs)
+        except ldap.LDAPError as error:
+            self._done(tag, None, error)
+            return
+        self.pending.append((msgid, tag))
+
+    def collect(self):
+        """Wait for the oldest outstanding operation"""
+        msgid, tag = self.pending.popleft()
+        try:
+            result = self.conn.result(msgid)
+        except ldap.LDAPError as error:
+            self._done(tag, None, error)
+        else:
+            self._done(tag, result, None)
+
+    def flush(self):
+        """Wait for all outstanding operations"""
+        while self.pending:
+            self.collect()
+
+    def _done(self, tag, result, error):
+        if error is None:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+            logger.debug('%s failed: %s', tag, error)
+        if self.callback:
+            self.callback(tag, result, error)
+
+    def elapsed(self):
+        return time.time() - self.started
+
+    def rate(self):
+        """Operations per second since the pipeline was created"""
+        elapsed = self.elapsed()
+        if not elapsed:
+            return 0.0
+        return (self.succeeded + self.failed) / elapsed
+
+
+def describe(error):
+    """Render an LDAPError as a single line"""
+    try:
+        info = error.args[0]
+        message = info.get('desc', str(error))
+        if info.get('info'):
+            message = '%s (%s)' % (message, info['info'])
+        return message
+    except (IndexError, AttributeError):
+        return str(error)
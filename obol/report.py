@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+from cliff.command import Command
+
+from .api import find_orphans
+
+
+class Orphans(Command):
+    """Report dangling memberUids and personal groups without a user
+
+    Every problem is written as a tab separated line: `dangling`, the
+    group and the missing member, or `orphaned` and the group. The
+    exit status is 1 if anything was found.
+    """
+    readonly = True
+
+    def get_parser(self, name):
+        parser = super(Orphans, self).get_parser(name)
+        parser.add_argument('--usertree',
+                            default=self.app.default('user_tree', 'ou=People'))
+        return parser
+
+    def take_action(self, args):
+        dangling, orphaned = find_orphans(self.app.conn, self.app.options.b,
+                                          args.usertree,
+                                          self.app.options.page_size)
+        for dn, member in dangling:
+            print("dangling\t%s\t%s" % (dn, member))
+        for dn in orphaned:
+            print("orphaned\t%s" % dn)
+        if dangling or orphaned:
+            return 1
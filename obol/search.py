@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+import logging
+
+import ldap
+from ldap.controls import SimplePagedResultsControl
+
+logger = logging.getLogger(__name__)
+
+
+def paged_search(conn, base, scope, filter, attrs=None, page_size=500,
+                 controls=None):
+    """Yield the (dn, attrs) pairs of a search one page at a time
+
+    Uses the Simple Paged Results control (RFC 2696), so only one page
+    is held in memory and the sizelimit of the server does not apply.
+    The control is not critical: servers that do not support it just
+    return everything in one go. A page_size of 0 disables paging.
+    controls are sent along with every page.
+    """
+    if not page_size:
+        control = None
+        serverctrls = list(controls or [])
+    else:
+        control = SimplePagedResultsControl(False, size=page_size, cookie='')
+        serverctrls = [control] + list(controls or [])
+
+    pages = 0
+    while True:
+        msgid = conn.search_ext(base, scope, filter, attrs,
+                                serverctrls=serverctrls)
+        _, rdata, _, rctrls = conn.result3(msgid)
+        pages += 1
+        for dn, entry in rdata:
+            # skip search references
+            if dn is not None:
+                yield dn, entry
+
+        if control is None:
+            break
+        cookie = None
+        for rctrl in rctrls:
+            if rctrl.controlType == SimplePagedResultsControl.controlType:
+                cookie = rctrl.cookie
+        if not cookie:
+            break
+        control.cookie = cookie
+    logger.debug('%s: %d page(s)', filter, pages)
+
+
+def supported_controls(conn):
+    """The OIDs of the controls the server advertises in its root DSE"""
+    try:
+        result = conn.search_s('', ldap.SCOPE_BASE, '(objectclass=*)',
+                               ['supportedControl'])
+    except ldap.LDAPError as error:
+        logger.debug('cannot read the root DSE: %s', error)
+        return set()
+    controls = set()
+    for _, attrs in result:
+        for key, values in attrs.items():
+            if key.lower() == 'supportedcontrol':
+                controls.update(values)
+    return controls
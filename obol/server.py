@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+import SocketServer
+import Queue
+import json
+import logging
+import os
+import socket
+import struct
+import sys
+import threading
+
+import ldap
+
+from cliff.command import Command
+
+logger = logging.getLogger(__name__)
+
+
+# the global options the pooled connections were opened with, and the
+# ones the server applies to every request; requests that ask for
+# others are run by the client itself. The password is not compared:
+# only our own user can connect, see ObolServer.trusted.
+CONNECTION_OPTIONS = ['H', 'D', 'Y']
+SERVER_OPTIONS = CONNECTION_OPTIONS + ['b', 'cache', 'trace',
+                                       'trace_output']
+
+# arguments naming a file or - for stdin; those are relative to the
+# working directory and stdin of the client, so it runs those commands
+FILE_ARGUMENTS = ['filename', 'from_file']
+
+
+class Refused(Exception):
+    """The server will not run a request, the client should run it"""
+
+
+def default_socket():
+    return '/tmp/obol-%d.sock' % os.getuid()
+
+
+class ConnectionPool(object):
+    """A fixed size pool of bound LDAP connections
+
+    Connections are opened on first use with the connect function and
+    are reopened when the server went away.
+    """
+    def __init__(self, connect, size=4):
+        self.connect = connect
+        self.size = size
+        self.idle = Queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.opened = 0
+
+    def get(self):
+        with self.lock:
+            if self.idle.empty() and self.opened < self.size:
+                self.opened += 1
+                try:
+                    return self.connect()
+                except Exception:
+                    self.opened -= 1
+                    raise
+        return self.idle.get()
+
+    def put(self, conn):
+        self.idle.put(conn)
+
+    def discard(self, conn):
+        try:
+            conn.unbind_s()
+        except ldap.LDAPError:
+            pass
+        with self.lock:
+            self.opened -= 1
+
+
+class ThreadLocalStream(object):
+    """A file like object that writes to a per thread stream
+
+    Commands print to sys.stdout; the server replaces sys.stdout and
+    sys.stderr with these so that every request thread can send its
+    own output back to its own client.
+    """
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def target(self):
+        return getattr(self.local, 'stream', None) or self.default
+
+    def write(self, data):
+        self.target().write(data)
+
+    def flush(self):
+        self.target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.target(), name)
+
+
+class SocketStream(object):
+    """Forward writes to a client as json lines"""
+    def __init__(self, wfile, key):
+        self.wfile = wfile
+        self.key = key
+
+    def write(self, data):
+        if data:
+            self.wfile.write(json.dumps({self.key: data}) + '\n')
+
+    def flush(self):
+        self.wfile.flush()
+
+
+class RequestApp(object):
+    """The application as seen by a command run for a client
+
+    Everything is delegated to the serving application, except for the
+    connection and the global options, which are per request.
+    """
+    def __init__(self, app, conn, options):
+        self._app = app
+        self.conn = conn
+        self.options = options
+
+    def __getattr__(self, name):
+        return getattr(self._app, name)
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        if not self.server.trusted(self.request):
+            logger.warning('refused a client of another user')
+            self.wfile.write(json.dumps({'refused': 'not our user'}) + '\n')
+            return
+        stdout = SocketStream(self.wfile, 'stdout')
+        stderr = SocketStream(self.wfile, 'stderr')
+        sys.stdout.local.stream = stdout
+        sys.stderr.local.stream = stderr
+        try:
+            argv = [arg.encode('utf-8') for arg in request['argv']]
+            status = self.server.execute(argv)
+        except Refused as reason:
+            logger.debug('refused %s: %s', argv, reason)
+            self.wfile.write(json.dumps({'refused': str(reason)}) + '\n')
+            return
+        except Exception as error:
+            logger.exception(error)
+            stderr.write('%s\n' % error)
+            status = 1
+        finally:
+            sys.stdout.local.stream = None
+            sys.stderr.local.stream = None
+        self.wfile.write(json.dumps({'status': status}) + '\n')
+
+
+class ObolServer(SocketServer.ThreadingMixIn,
+                 SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, app, pool):
+        if os.path.exists(path):
+            os.unlink(path)
+        # the connections are bound with our credentials, so only we
+        # may use them; the socket is created without access for others
+        umask = os.umask(0o077)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, path,
+                                                   RequestHandler)
+        finally:
+            os.umask(umask)
+        self.path = path
+        self.app = app
+        self.pool = pool
+
+    def trusted(self, client):
+        """Whether the client runs as our user
+
+        The socket is only accessible to us; the peer credentials are
+        checked too where the platform has them.
+        """
+        option = getattr(socket, 'SO_PEERCRED', None)
+        if option is None:
+            return True
+        credentials = client.getsockopt(socket.SOL_SOCKET, option,
+                                        struct.calcsize('3i'))
+        pid, uid, gid = struct.unpack('3i', credentials)
+        return uid == os.getuid()
+
+    def execute(self, argv):
+        """Run an obol command line in this process
+
+        Raises Refused for command lines the client has to run itself:
+        serve, commands for another server, bind identity or other
+        server options than ours, and commands that read or write
+        files or stdin.
+        """
+        try:
+            options, argv = self.app.parser.parse_known_args(argv)
+        except SystemExit as exit:
+            return exit.code
+        if not argv:
+            sys.stderr.write('No command given\n')
+            return 2
+        if argv[0] == 'serve':
+            raise Refused('serve is not forwarded')
+        for name in SERVER_OPTIONS:
+            if getattr(options, name) != getattr(self.app.options, name):
+                raise Refused('%s differs from the server' % name)
+
+        try:
+            factory, name, argv = self.app.command_manager.find_command(argv)
+        except ValueError as error:
+            sys.stderr.write('%s\n' % error)
+            return 2
+
+        conn = self.pool.get()
+        try:
+            app = RequestApp(self.app, conn, options)
+            cmd = factory(app, options, cmd_name=name)
+            parser = cmd.get_parser('obol %s' % name)
+            try:
+                args = parser.parse_args(argv)
+            except SystemExit as exit:
+                return exit.code
+            for argument in FILE_ARGUMENTS:
+                if getattr(args, argument, None) is not None:
+                    raise Refused('%s is read by the client' % argument)
+            try:
+                result = cmd.run(args)
+            except Exception as error:
+                app.clean_up(cmd, 1, error)
+                raise
+            app.clean_up(cmd, result, None)
+            return result
+        except ldap.SERVER_DOWN:
+            self.pool.discard(conn)
+            conn = None
+            raise
+        finally:
+            if conn is not None:
+                self.pool.put(conn)
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class Serve(Command):
+    """Keep bound connections open behind a local socket"""
+
+    def get_parser(self, name):
+        parser = super(Serve, self).get_parser(name)
+        parser.add_argument('--socket',
+                            default=self.app.default('socket',
+                                                     default_socket()),
+                            help="path of the unix socket to listen on")
+        parser.add_argument('--pool', type=int,
+                            default=int(self.app.default('pool', 4)),
+                            help="number of bound connections to keep")
+        return parser
+
+    def take_action(self, args):
+        pool = ConnectionPool(self.app.connect, args.pool)
+        pool.put(self.app.conn)
+        pool.opened = 1
+
+        sys.stdout = ThreadLocalStream(sys.stdout)
+        sys.stderr = ThreadLocalStream(sys.stderr)
+        server = ObolServer(args.socket, self.app, pool)
+        logger.info('listening on %s', args.socket)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            sys.stdout = sys.stdout.default
+            sys.stderr = sys.stderr.default
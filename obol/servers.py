@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+import calendar
+import json
+import logging
+import os
+import threading
+import time
+
+from cliff.command import Command
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ['provider', 'round-robin', 'latency']
+
+# how long a server that failed is skipped
+DOWN_TIME = 60
+
+
+def split_hosts(value):
+    """Split a comma or space separated list of hosts"""
+    return [host for host in value.replace(',', ' ').split() if host]
+
+
+class ServerList(object):
+    """The provider and read-only replicas obol can talk to
+
+    Writes always go to the provider. Reads go to the replicas,
+    round-robin or to the one with the lowest measured latency, and
+    to the provider when no replica is reachable. Latencies, failures
+    and the round-robin position are kept in a small state file, so
+    they carry over between runs.
+    """
+    def __init__(self, provider, replicas=None, policy='round-robin',
+                 path=None):
+        self.provider = provider
+        self.replicas = [host for host in replicas or []
+                         if host != provider]
+        self.policy = policy
+        self.path = path
+        self.state = {'next': 0, 'hosts': {}}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as stream:
+                    self.state = json.load(stream)
+            except ValueError:
+                pass
+
+    def save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = '%s.%d' % (self.path, os.getpid())
+        with open(tmp, 'w') as stream:
+            json.dump(self.state, stream)
+        os.rename(tmp, self.path)
+
+    def _host(self, host):
+        return self.state['hosts'].setdefault(host, {})
+
+    def is_up(self, host):
+        return self._host(host).get('down_until', 0) < time.time()
+
+    def candidates(self, readonly):
+        """Return the hosts to try, best first"""
+        if not readonly or self.policy == 'provider' or not self.replicas:
+            return [self.provider]
+
+        replicas = list(self.replicas)
+        if self.policy == 'latency':
+            replicas.sort(key=lambda host: self._host(host).get('latency', 0))
+        else:
+            start = self.state['next'] % len(replicas)
+            replicas = replicas[start:] + replicas[:start]
+            self.state['next'] = start + 1
+
+        up = [host for host in replicas if self.is_up(host)]
+        down = [host for host in replicas if not self.is_up(host)]
+        # servers that were down recently are tried last, not skipped
+        return up + [self.provider] + down
+
+    def succeeded(self, host, latency):
+        state = self._host(host)
+        state.pop('down_until', None)
+        # exponentially weighted moving average
+        previous = state.get('latency')
+        if previous is None:
+            state['latency'] = latency
+        else:
+            state['latency'] = 0.7 * previous + 0.3 * latency
+
+    def failed(self, host):
+        self._host(host)['down_until'] = time.time() + DOWN_TIME
+
+    def connect(self, connect, readonly):
+        """Open a bound connection to the best available server
+
+        connect is called with a host and must return a bound
+        connection. Returns (host, connection).
+        """
+        # imported here, so that obol can start without loading ldap
+        import ldap
+
+        error = None
+        for host in self.candidates(readonly):
+            started = time.time()
+            try:
+                conn = connect(host)
+            except (ldap.SERVER_DOWN, ldap.TIMEOUT, ldap.CONNECT_ERROR) as e:
+                logger.warning('%s is not available: %s', host, e)
+                self.failed(host)
+                error = e
+                continue
+            self.succeeded(host, time.time() - started)
+            logger.debug('connected to %s', host)
+            self.save()
+            return host, conn
+        self.save()
+        raise error
+
+
+def parse_csn(csn):
+    """Return the server id and the time in seconds of a CSN"""
+    parts = csn.split('#')
+    stamp = parts[0].rstrip('Z')
+    seconds, _, fraction = stamp.partition('.')
+    when = calendar.timegm(time.strptime(seconds, '%Y%m%d%H%M%S'))
+    if fraction:
+        when += float('0.' + fraction)
+    sid = parts[2] if len(parts) > 2 else '000'
+    return sid, when
+
+
+def context_csns(conn, base):
+    """Return {server id: time} of the contextCSN values of base"""
+    import ldap
+
+    result = conn.search_s(base, ldap.SCOPE_BASE, '(objectclass=*)',
+                           ['contextCSN'])
+    csns = {}
+    for _, attrs in result:
+        for key, values in attrs.items():
+            if key.lower() == 'contextcsn':
+                for value in values:
+                    sid, when = parse_csn(value)
+                    csns[sid] = when
+    return csns
+
+
+def drift(provider, replica):
+    """How many seconds the replica lags behind the provider"""
+    lag = 0.0
+    for sid, when in provider.items():
+        lag = max(lag, when - replica.get(sid, 0))
+    return lag
+
+
+class ServerStatus(Command):
+    """Check all servers in parallel and report replication drift"""
+    readonly = True
+
+    def take_action(self, args):
+        import ldap
+
+        b = self.app.options.b
+        servers = self.app.servers
+        results = {}
+
+        def check(host):
+            started = time.time()
+            try:
+                conn = self.app.connect(host)
+                try:
+                    csns = context_csns(conn, b)
+                finally:
+                    conn.unbind_s()
+            except ldap.LDAPError as error:
+                results[host] = ('down', None, None, error)
+                return
+            results[host] = ('up', time.time() - started, csns, None)
+
+        hosts = [servers.provider] + servers.replicas
+        threads = [threading.Thread(target=check, args=(host,))
+                   for host in hosts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        provider = results[servers.provider][2]
+        failed = False
+        for host in hosts:
+            role = 'provider' if host == servers.provider else 'replica'
+            state, latency, csns, error = results[host]
+            if state == 'down':
+                servers.failed(host)
+                failed = True
+                print("%-40s %-8s down %s" % (host, role, error))
+                continue
+            servers.succeeded(host, latency)
+            if provider is None or not csns:
+                lag = 'unknown'
+            else:
+                lag = '%.1fs' % drift(provider, csns)
+            print("%-40s %-8s up %6.1fms drift %s" %
+                  (host, role, latency * 1000, lag))
+        servers.save()
+        if failed:
+            return 1
+
+
+class ServerInfo(Command):
+    """Show what the provider supports, from its root DSE"""
+
+    def get_parser(self, name):
+        parser = super(ServerInfo, self).get_parser(name)
+        parser.add_argument('--refresh', action='store_true',
+                            help="read the root DSE again instead of "
+                                 "using the cached profile")
+        return parser
+
+    def take_action(self, args):
+        profile = self.app.profile(refresh=args.refresh)
+        data = profile.data
+        probed = time.strftime('%Y-%m-%d %H:%M:%S',
+                               time.localtime(data.get('probed', 0)))
+        print("%-20s %s" % ('host', self.app.options.H))
+        print("%-20s %s (%ds ago)" % ('probed', probed, profile.age()))
+        vendor = ' '.join(data.get('vendor', []) +
+                          data.get('vendor_version', []))
+        print("%-20s %s" % ('vendor', vendor or 'unknown'))
+        print("%-20s %s" % ('ldap versions',
+                            ', '.join(data.get('ldap_versions', []))))
+        print("%-20s %s" % ('naming contexts',
+                            ', '.join(data.get('naming_contexts', []))))
+        print("%-20s %s" % ('sasl mechanisms',
+                            ', '.join(data.get('sasl_mechanisms', []))))
+        answers = {True: 'yes', False: 'no', None: 'unknown'}
+        for name, supported in profile.features():
+            print("%-20s %s" % (name, answers[supported]))
+        uidnext = None
+        if profile.objectclasses:
+            uidnext = profile.has_objectclass('uidNext')
+        print("%-20s %s" % ('uidNext schema', answers[uidnext]))
+        if profile.controls is None:
+            print("%-20s %s" % ('advertises', 'unknown, the root DSE '
+                                'could not be read'))
+            return
+        print("%-20s %d controls, %d extensions, %d object classes" %
+              ('advertises', len(profile.controls), len(profile.extensions),
+               len(profile.objectclasses)))
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+import cPickle
+import heapq
+import itertools
+import logging
+import tempfile
+
+import ldap
+
+from .features import SERVER_SIDE_SORT, VIRTUAL_LIST_VIEW
+from .output import get_values
+from .search import paged_search, supported_controls
+
+logger = logging.getLogger(__name__)
+
+# entries sorted in memory at a time by the client side sort
+BUFFER_SIZE = 10000
+
+
+def add_sort_arguments(parser):
+    """Add the --sort, --offset and --count options to a parser"""
+    parser.add_argument('--sort', metavar='ATTRS',
+                        help="a comma separated list of attributes to "
+                             "sort on, -ATTR for descending (give it as "
+                             "--sort=-ATTR)")
+    parser.add_argument('--offset', type=int, default=0,
+                        help="skip this many entries")
+    parser.add_argument('--count', type=int,
+                        help="return at most this many entries")
+
+
+def parse_sort(value):
+    """Split a --sort value into (attribute, descending) pairs"""
+    keys = []
+    for attr in (value or '').split(','):
+        attr = attr.strip()
+        if attr:
+            keys.append((attr.lstrip('-'), attr.startswith('-')))
+    return keys
+
+
+class Descending(object):
+    """Wraps a sort key to order it the other way around"""
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def sort_key(entry, keys):
+    """The key of an entry: numbers sort as numbers, text ignoring case,
+    entries without the attribute last"""
+    parts = []
+    for attr, descending in keys:
+        values = get_values(entry, attr)
+        if not values:
+            part = (1, 0, 0, '')
+        elif values[0].isdigit():
+            part = (0, 0, int(values[0]), '')
+        else:
+            part = (0, 1, 0, values[0].lower())
+        parts.append(Descending(part) if descending else part)
+    return tuple(parts)
+
+
+def _spill(run):
+    """Write a sorted run to a temporary file"""
+    stream = tempfile.TemporaryFile()
+    for item in run:
+        cPickle.dump(item, stream, cPickle.HIGHEST_PROTOCOL)
+    stream.seek(0)
+    return stream
+
+
+def _read(stream):
+    try:
+        while True:
+            yield cPickle.load(stream)
+    except EOFError:
+        pass
+    finally:
+        stream.close()
+
+
+def sort_entries(entries, keys, offset=0, count=None,
+                 buffer_size=BUFFER_SIZE):
+    """Yield (dn, attributes) pairs in the order of keys
+
+    At most buffer_size entries are held in memory. When only the first
+    offset + count entries are needed and they fit, they are selected
+    with a heap in a single pass. Otherwise the entries are sorted in
+    runs of buffer_size that are spilled to temporary files and
+    merged.
+    """
+    decorated = ((sort_key(entry, keys), index, dn, entry)
+                 for index, (dn, entry) in enumerate(entries))
+    if count is not None and offset + count <= buffer_size:
+        for _, _, dn, entry in heapq.nsmallest(offset + count,
+                                               decorated)[offset:]:
+            yield dn, entry
+        return
+
+    runs = []
+    run = []
+    for item in decorated:
+        run.append(item)
+        if len(run) >= buffer_size:
+            runs.append(_read(_spill(sorted(run))))
+            run = []
+    run.sort()
+    if runs:
+        logger.debug('merging %d sorted runs', len(runs) + 1)
+        merged = heapq.merge(iter(run), *runs)
+    else:
+        merged = iter(run)
+    end = offset + count if count is not None else None
+    for _, _, dn, entry in itertools.islice(merged, offset, end):
+        yield dn, entry
+
+
+def vlv_search(conn, base, filter, attrs, sss, offset, count):
+    """Fetch one window of a sorted search with the VLV control"""
+    from ldap.controls.vlv import VLVRequestControl, VLVResponseControl
+
+    # VLV offsets start at 1
+    vlv = VLVRequestControl(True, before_count=0, after_count=count - 1,
+                            offset=offset + 1, content_count=0)
+    msgid = conn.search_ext(base, ldap.SCOPE_SUBTREE, filter, attrs,
+                            serverctrls=[sss, vlv])
+    _, rdata, _, rctrls = conn.result3(msgid)
+    for rctrl in rctrls:
+        if rctrl.controlType == VLVResponseControl.controlType and \
+                offset >= rctrl.content_count:
+            # past the end the server returns the last entry
+            return []
+    return [(dn, entry) for dn, entry in rdata if dn is not None]
+
+
+def sort_attributes(attrs, sort):
+    """attrs and the attributes of sort that are not in it"""
+    fetch = list(attrs)
+    for attr, _ in parse_sort(sort):
+        if attr.lower() not in [name.lower() for name in fetch]:
+            fetch.append(attr)
+    return fetch
+
+
+def sort_window(entries, sort=None, offset=0, count=None, attrs=None,
+                buffer_size=BUFFER_SIZE):
+    """Sort entries here and select a window of them
+
+    Attributes that are not in attrs, because they were only fetched
+    to sort on, are dropped.
+    """
+    keys = parse_sort(sort)
+    if not keys:
+        end = offset + count if count is not None else None
+        return itertools.islice(entries, offset, end)
+    entries = sort_entries(entries, keys, offset, count, buffer_size)
+    if attrs is not None and sort_attributes(attrs, sort) != list(attrs):
+        wanted = set(attr.lower() for attr in attrs)
+        entries = ((dn, dict((key, values) for key, values in entry.items()
+                             if key.lower() in wanted))
+                   for dn, entry in entries)
+    return entries
+
+
+def sorted_search(conn, base, filter, attrs, sort=None, offset=0,
+                  count=None, page_size=500, buffer_size=BUFFER_SIZE,
+                  controls=None):
+    """Yield the entries of a subtree search in order, a window of them
+
+    With sort, the server sorts with the SSS control when it
+    advertises it, and fetches only the window with the VLV control
+    when it advertises that too and a count is given. Otherwise the
+    entries are sorted here, see sort_entries. offset and count select
+    the window, also without sort. controls are the OIDs the server
+    supports, from obol.features; the root DSE is read when None.
+    """
+    keys = parse_sort(sort)
+    end = offset + count if count is not None else None
+    if not keys:
+        entries = paged_search(conn, base, ldap.SCOPE_SUBTREE, filter,
+                               attrs, page_size)
+        return itertools.islice(entries, offset, end)
+
+    supported = controls
+    if supported is None:
+        supported = supported_controls(conn)
+    if SERVER_SIDE_SORT in supported:
+        from ldap.controls.sss import SSSRequestControl
+
+        rules = [('-' if descending else '') + attr
+                 for attr, descending in keys]
+        sss = SSSRequestControl(True, rules)
+        if count is not None and VIRTUAL_LIST_VIEW in supported:
+            if count <= 0:
+                return iter([])
+            return iter(vlv_search(conn, base, filter, attrs, sss, offset,
+                                   count))
+        entries = paged_search(conn, base, ldap.SCOPE_SUBTREE, filter,
+                               attrs, page_size, [sss])
+        return itertools.islice(entries, offset, end)
+
+    logger.debug('no server side sorting, sorting %s here', base)
+    entries = paged_search(conn, base, ldap.SCOPE_SUBTREE, filter,
+                           sort_attributes(attrs, sort), page_size)
+    return sort_window(entries, sort, offset, count, attrs, buffer_size)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+import logging
+import sys
+
+import ldap
+
+from cliff.command import Command
+
+from .allocator import gid_allocator, uid_allocator
+from .api import USER_ATTRIBUTES, lower_keys, replace_mods, user_records
+from .pipeline import Pipeline, describe
+from .search import paged_search
+from .user import guess_format, read_user_records
+
+logger = logging.getLogger(__name__)
+
+
+def current_state(conn, user_base, group_base, page_size=500):
+    """Read all users and groups, indexed by lower case uid and cn
+
+    The members of a group map lower case uids to the memberUid values
+    as they are stored.
+    """
+    users = {}
+    attrs = ['uid'] + [attr for _, attr in USER_ATTRIBUTES]
+    for dn, entry in paged_search(conn, user_base, ldap.SCOPE_SUBTREE,
+                                  '(objectclass=posixAccount)', attrs,
+                                  page_size):
+        entry = lower_keys(entry)
+        for uid in entry.get('uid', []):
+            users[uid.lower()] = entry
+
+    groups = {}
+    for dn, entry in paged_search(conn, group_base, ldap.SCOPE_SUBTREE,
+                                  '(objectclass=posixGroup)',
+                                  ['cn', 'memberUid'], page_size):
+        entry = lower_keys(entry)
+        members = dict((member.lower(), member)
+                       for member in entry.get('memberuid', []))
+        for cn in entry.get('cn', []):
+            groups[cn] = members
+    return users, groups
+
+
+def desired_state(records):
+    """Index the records of a desired state file by lower case username
+    and by group"""
+    users = {}
+    groups = {}
+    for record in records:
+        username = record.get('username')
+        if not username:
+            raise ValueError("Record without a username: %r" % record)
+        users[username.lower()] = record
+        for group in record.get('groups', []):
+            groups.setdefault(group, set()).add(username.lower())
+    return users, groups
+
+
+class Plan(object):
+    """The changes that bring the directory to the desired state
+
+    Users that are missing are added, users whose attributes differ
+    are modified and users that are not in the desired state are
+    deleted. The membership of every group named in the desired state
+    is made to match it exactly; groups that do not exist yet are
+    added. Other groups are only touched to remove deleted users.
+    Usernames are compared ignoring case; users that exist keep the
+    spelling of their uid.
+    """
+    def __init__(self, current, desired, delete=False):
+        current_users, current_groups = current
+        desired_users, desired_groups = desired
+
+        def name(key):
+            if key in current_users:
+                return current_users[key]['uid'][0]
+            return desired_users[key]['username']
+
+        self.add_users = sorted(name(key) for key in
+                                set(desired_users) - set(current_users))
+        deleted = set()
+        if delete:
+            deleted = set(current_users) - set(desired_users)
+        self.delete_users = sorted(name(key) for key in deleted)
+
+        self.modify_users = []
+        for key in sorted(set(desired_users) & set(current_users)):
+            mods = replace_mods(current_users[key], desired_users[key])
+            if mods:
+                self.modify_users.append((name(key), mods))
+
+        self.add_groups = sorted(set(desired_groups) - set(current_groups))
+        self.members = []
+        for group in sorted(set(desired_groups) | set(current_groups)):
+            current = current_groups.get(group, {})
+            if group in desired_groups:
+                wanted = desired_groups[group]
+            else:
+                wanted = set(current) - deleted
+            add = sorted(name(key) for key in wanted - set(current))
+            remove = sorted(current[key] for key in set(current) - wanted)
+            if add or remove:
+                self.members.append((group, add, remove))
+
+        self.desired_users = desired_users
+
+    def __len__(self):
+        return (len(self.add_users) + len(self.delete_users) +
+                len(self.modify_users) + len(self.add_groups) +
+                len(self.members))
+
+    def lines(self):
+        for username in self.add_users:
+            yield 'add user %s' % username
+        for username, mods in self.modify_users:
+            yield 'modify user %s: %s' % (
+                username, ', '.join('%s=%s' % (attr, values[0])
+                                    for _, attr, values in mods))
+        for username in self.delete_users:
+            yield 'delete user %s' % username
+        for group in self.add_groups:
+            yield 'add group %s' % group
+        for group, add, remove in self.members:
+            changes = (['+%s' % name for name in add] +
+                       ['-%s' % name for name in remove])
+            yield 'group %s: %s' % (group, ' '.join(changes))
+
+
+class Sync(Command):
+    """Bring the users and groups in line with a desired state file"""
+
+    def get_parser(self, name):
+        parser = super(Sync, self).get_parser(name)
+        parser.add_argument('filename', help="desired state, - for stdin")
+        parser.add_argument('--format', choices=['csv', 'ldif', 'jsonl'],
+                            help="input format (default: from extension)")
+        parser.add_argument('--subtree',
+                            default=self.app.default('user_tree', 'ou=People'))
+        parser.add_argument('--grouptree',
+                            default=self.app.default('group_tree', 'ou=Group'))
+        parser.add_argument('--dry-run', action='store_true',
+                            help="only print the changes")
+        parser.add_argument('--delete', action='store_true',
+                            help="delete users that are not in the file")
+        parser.add_argument('--window', type=int,
+                            default=int(self.app.default('window', 64)),
+                            help="maximum number of operations in flight")
+        return parser
+
+    def take_action(self, args):
+        b = self.app.options.b
+        conn = self.app.conn
+        context = args.subtree
+        grouptree = args.grouptree
+        user_base = '%s,%s' % (context, b)
+        group_base = '%s,%s' % (grouptree, b)
+        format = args.format or guess_format(args.filename)
+
+        if args.filename == '-':
+            stream = sys.stdin
+        else:
+            stream = open(args.filename, 'rb' if format == 'ldif' else 'r')
+        try:
+            desired = desired_state(read_user_records(stream, format))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        current = current_state(conn, user_base, group_base,
+                                self.app.options.page_size)
+        plan = Plan(current, desired, args.delete)
+        for line in plan.lines():
+            print(line)
+        if args.dry_run or not len(plan):
+            print("%d changes" % len(plan))
+            return
+
+        self.invalidates = [user_base, group_base]
+        errors = []
+
+        def done(tag, result, error):
+            if error is not None:
+                errors.append(tag)
+                print("%s: failed: %s" % (tag, describe(error)))
+
+        pipeline = Pipeline(conn, args.window, done)
+
+        # adds first, the membership changes need the groups to exist
+        uids = uid_allocator(conn, b, len(plan.add_users))
+        gids = gid_allocator(conn, b, len(plan.add_groups))
+        try:
+            for username in plan.add_users:
+                record = plan.desired_users[username.lower()]
+                uidNumber = record.get('uidNumber') or uids.allocate()
+                for dn, add_record in user_records(
+                        b, context, username, uidNumber, record.get('cn'),
+                        record.get('sn'), record.get('givenName'),
+                        record.get('password'),
+                        record.get('shell', '/bin/bash')):
+                    pipeline.submit(dn, 'add', dn, add_record)
+            for group in plan.add_groups:
+                dn = 'cn=%s,%s' % (group, group_base)
+                add_record = [
+                    ('objectclass', ['top', 'posixGroup']),
+                    ('cn', [group]),
+                    ('gidNumber', [gids.allocate()])
+                ]
+                pipeline.submit(dn, 'add', dn, add_record)
+            pipeline.flush()
+        finally:
+            uids.release()
+            gids.release()
+
+        for username, mods in plan.modify_users:
+            dn = 'uid=%s,%s' % (username, user_base)
+            pipeline.submit(dn, 'modify', dn, mods)
+        for group, add, remove in plan.members:
+            dn = 'cn=%s,%s' % (group, group_base)
+            mods = []
+            if add:
+                mods.append((ldap.MOD_ADD, 'memberuid', add))
+            if remove:
+                mods.append((ldap.MOD_DELETE, 'memberuid', remove))
+            pipeline.submit(dn, 'modify', dn, mods)
+        pipeline.flush()
+
+        for username in plan.delete_users:
+            for dn in ('uid=%s,%s' % (username, user_base),
+                       'cn=%s,%s' % (username, user_base)):
+                pipeline.submit(dn, 'delete', dn)
+        pipeline.flush()
+
+        print("Applied %d of %d operations in %.2fs" %
+              (pipeline.succeeded, pipeline.succeeded + pipeline.failed,
+               pipeline.elapsed()))
+        if errors:
+            return 1
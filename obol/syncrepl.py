@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+import json
+import logging
+import os
+
+from ldap.syncrepl import SyncRequestControl, SyncStateControl
+from ldap.syncrepl import SyncDoneControl, SyncInfoMessage
+
+logger = logging.getLogger(__name__)
+
+RES_SEARCH_ENTRY = 100
+RES_SEARCH_RESULT = 101
+RES_INTERMEDIATE = 121
+
+
+class Consumer(object):
+    """A refreshOnly content synchronization (RFC 4533) client
+
+    Runs on an already bound connection. Every refresh sends the
+    cookie of the previous one, so the server only returns what
+    changed since then. Subclasses keep the local copy by implementing
+    entry(), delete() and uuids().
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.cookie = None
+        self._present = set()
+        self._refresh_done = False
+
+    def uuids(self):
+        """Return the entryUUIDs of all entries held locally"""
+        raise NotImplementedError
+
+    def entry(self, dn, attrs, uuid):
+        """Add or update an entry"""
+        raise NotImplementedError
+
+    def delete(self, uuids):
+        """Forget entries"""
+        raise NotImplementedError
+
+    def _present_done(self, refresh_deletes):
+        # in the present phase the server lists everything that is still
+        # there; whatever it did not mention has gone
+        if not refresh_deletes:
+            gone = set(self.uuids()) - self._present
+            if gone:
+                self.delete(list(gone))
+        self._present = set()
+
+    def checkpoint(self):
+        """Called after every message when following changes"""
+
+    def _set_cookie(self, cookie):
+        if cookie is not None:
+            self.cookie = cookie
+
+    def refresh(self, base, scope, filter, attrs=None, mode='refreshOnly'):
+        """Bring the local copy up to date in a single search
+
+        With mode='refreshAndPersist' the search does not end after the
+        refresh, and changes are applied as the server sends them.
+        """
+        persist = mode == 'refreshAndPersist'
+        control = SyncRequestControl(criticality=True, cookie=self.cookie,
+                                     mode=mode)
+        msgid = self.conn.search_ext(base, scope, filter, attrs,
+                                     serverctrls=[control])
+        self._present = set()
+        self._refresh_done = False
+        while True:
+            rtype, rdata, _, rctrls = self.conn.result4(
+                msgid, all=0, add_ctrls=1, add_intermediates=1)[:4]
+
+            if rtype == RES_SEARCH_RESULT:
+                for rctrl in rctrls:
+                    if rctrl.controlType != SyncDoneControl.controlType:
+                        continue
+                    self._set_cookie(rctrl.cookie)
+                    if rctrl.refreshDeletes is False:
+                        self._present_done(False)
+                return
+
+            if rtype == RES_SEARCH_ENTRY:
+                for dn, entry, ectrls in rdata:
+                    for ectrl in ectrls:
+                        if ectrl.controlType != SyncStateControl.controlType:
+                            continue
+                        if ectrl.state == 'present':
+                            self._present.add(ectrl.entryUUID)
+                        elif ectrl.state == 'delete':
+                            self.delete([ectrl.entryUUID])
+                        else:
+                            self.entry(dn, entry, ectrl.entryUUID)
+                            if not self._refresh_done:
+                                self._present.add(ectrl.entryUUID)
+                        self._set_cookie(ectrl.cookie)
+
+            elif rtype == RES_INTERMEDIATE:
+                for name, value, _ in rdata:
+                    if name != SyncInfoMessage.responseName:
+                        continue
+                    info = SyncInfoMessage(value)
+                    if info.newcookie is not None:
+                        self._set_cookie(info.newcookie)
+                    elif info.refreshPresent is not None:
+                        self._present_done(False)
+                        self._set_cookie(info.refreshPresent['cookie'])
+                        if info.refreshPresent['refreshDone']:
+                            self._refresh_done = True
+                    elif info.refreshDelete is not None:
+                        self._present_done(True)
+                        self._set_cookie(info.refreshDelete['cookie'])
+                        if info.refreshDelete['refreshDone']:
+                            self._refresh_done = True
+                    elif info.syncIdSet is not None:
+                        uuids = info.syncIdSet['syncUUIDs']
+                        if info.syncIdSet['refreshDeletes']:
+                            self.delete(uuids)
+                        else:
+                            self._present.update(uuids)
+                        self._set_cookie(info.syncIdSet['cookie'])
+
+            if persist:
+                self.checkpoint()
+
+
+class MemberIndex(Consumer):
+    """A local memberUid -> groups index of the group tree
+
+    The groups are kept in a json file together with the sync cookie,
+    so refreshing the index only transfers the groups that changed
+    since the last run. members maps lower case uids to the dns of
+    their groups.
+    """
+    filter = '(objectclass=posixGroup)'
+    attrs = ['memberUid']
+
+    def __init__(self, conn, path):
+        super(MemberIndex, self).__init__(conn)
+        self.path = path
+        self.groups = {}
+        self.members = {}
+        if os.path.exists(path):
+            with open(path) as stream:
+                state = json.load(stream)
+            self.cookie = state.get('cookie')
+            if self.cookie is not None:
+                self.cookie = self.cookie.encode('utf-8')
+            for uuid, (dn, members) in state.get('groups', {}).items():
+                members = [member.encode('utf-8') for member in members]
+                self.groups[uuid] = [dn.encode('utf-8'), members]
+                self._index(dn.encode('utf-8'), members, True)
+
+    def _index(self, dn, members, add):
+        for member in members:
+            key = member.lower()
+            if add:
+                self.members.setdefault(key, set()).add(dn)
+            elif key in self.members:
+                self.members[key].discard(dn)
+                if not self.members[key]:
+                    del self.members[key]
+
+    def uuids(self):
+        return self.groups.keys()
+
+    def entry(self, dn, attrs, uuid):
+        members = []
+        for key, values in attrs.items():
+            if key.lower() == 'memberuid':
+                members = values
+        if uuid in self.groups:
+            self._index(self.groups[uuid][0], self.groups[uuid][1], False)
+        self.groups[uuid] = [dn, members]
+        self._index(dn, members, True)
+
+    def delete(self, uuids):
+        for uuid in uuids:
+            if uuid in self.groups:
+                self._index(self.groups[uuid][0], self.groups[uuid][1],
+                            False)
+                del self.groups[uuid]
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = '%s.tmp' % self.path
+        with open(tmp, 'w') as stream:
+            json.dump({'cookie': self.cookie, 'groups': self.groups}, stream)
+        os.rename(tmp, self.path)
+
+    def update(self, base, scope):
+        self.refresh(base, scope, self.filter, self.attrs)
+        self.save()
+        logger.debug('member index has %d groups', len(self.groups))
+
+    def groups_of(self, username):
+        """Return the dns of the groups that have username as member"""
+        return sorted(self.members.get(username.lower(), ()))
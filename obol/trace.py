@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+# the python-ldap methods that send a request, and the operation
+# they are counted as
+OPERATIONS = {
+    'simple_bind': 'bind', 'simple_bind_s': 'bind',
+    'sasl_interactive_bind_s': 'bind', 'sasl_non_interactive_bind_s': 'bind',
+    'search': 'search', 'search_s': 'search', 'search_st': 'search',
+    'search_ext': 'search', 'search_ext_s': 'search',
+    'add': 'add', 'add_s': 'add', 'add_ext': 'add', 'add_ext_s': 'add',
+    'modify': 'modify', 'modify_s': 'modify', 'modify_ext': 'modify',
+    'modify_ext_s': 'modify',
+    'delete': 'delete', 'delete_s': 'delete', 'delete_ext': 'delete',
+    'delete_ext_s': 'delete',
+    'passwd': 'passwd', 'passwd_s': 'passwd',
+    'extop': 'extop', 'extop_s': 'extop',
+}
+
+RESULTS = set(['result', 'result2', 'result3', 'result4'])
+
+# RES_SEARCH_ENTRY, RES_SEARCH_REFERENCE and RES_INTERMEDIATE: results
+# read with all=0 that are followed by more for the same request
+PARTIAL = set([100, 115, 121])
+
+
+def process_started():
+    """When this process was started, from /proc, or None"""
+    try:
+        with open('/proc/self/stat') as stream:
+            # the command name may contain spaces, skip past it
+            fields = stream.read().rsplit(')', 1)[1].split()
+        with open('/proc/stat') as stream:
+            for line in stream:
+                if line.startswith('btime'):
+                    boot = int(line.split()[1])
+        return boot + float(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (IOError, OSError, IndexError, ValueError, NameError):
+        return None
+
+
+class Tracer(object):
+    """Count and time the LDAP operations of a command
+
+    Synchronous calls are timed directly. Asynchronous requests are
+    timed from the moment they are sent until their result is read,
+    so pipelined operations overlap. The number of entries returned by
+    searches is recorded as well.
+    """
+    def __init__(self, target='stderr'):
+        self.target = target
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.command = None
+        self.stats = {}
+        self.pending = {}
+        self.retries = {}
+
+    def start(self, command):
+        self.started = time.time()
+        self.command = command
+
+    def record(self, op, elapsed, entries=0, error=None):
+        with self.lock:
+            stats = self.stats.setdefault(op, {'count': 0, 'errors': 0,
+                                               'time': 0.0, 'max': 0.0,
+                                               'entries': 0})
+            stats['count'] += 1
+            stats['time'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+            stats['entries'] += entries
+            if error is not None:
+                stats['errors'] += 1
+
+    def sent(self, conn, msgid, op):
+        with self.lock:
+            self.pending[(id(conn), msgid)] = (op, time.time(), 0)
+
+    def received(self, conn, msgid, entries, error, done=True):
+        key = (id(conn), msgid)
+        with self.lock:
+            if key not in self.pending:
+                return
+            op, started, seen = self.pending[key]
+            if not done:
+                self.pending[key] = (op, started, seen + entries)
+                return
+            del self.pending[key]
+        self.record(op, time.time() - started, seen + entries, error)
+
+    def retried(self, what):
+        with self.lock:
+            self.retries[what] = self.retries.get(what, 0) + 1
+
+    def summary(self):
+        now = time.time()
+        summary = {
+            'command': self.command,
+            'wall': now - self.started,
+            'ldap': sum(stats['time'] for stats in self.stats.values()),
+            'operations': self.stats,
+            'retries': self.retries,
+        }
+        started = process_started()
+        if started is not None:
+            summary['startup'] = max(0.0, self.started - started)
+        return summary
+
+    def report(self, stream=None):
+        """Write the summary to the trace target and start over"""
+        summary = self.summary()
+        target = self.target
+        if target.startswith('json:'):
+            with open(target[5:], 'a') as output:
+                output.write(json.dumps(summary) + '\n')
+        elif target.startswith('statsd'):
+            lines = statsd_lines(summary)
+            if target.startswith('statsd://'):
+                host, _, port = target[9:].partition(':')
+                send_udp(host, int(port or 8125), lines)
+            else:
+                (stream or sys.stderr).write('\n'.join(lines) + '\n')
+        else:
+            write_summary(summary, stream or sys.stderr)
+        self.reset()
+
+
+def write_summary(summary, stream):
+    if 'startup' in summary:
+        stream.write('startup %8.1fms\n' % (summary['startup'] * 1000))
+    stream.write('%-8s %6s %6s %8s %10s %10s\n' %
+                 ('op', 'count', 'errors', 'entries', 'total ms', 'max ms'))
+    for op, stats in sorted(summary['operations'].items()):
+        stream.write('%-8s %6d %6d %8d %10.1f %10.1f\n' %
+                     (op, stats['count'], stats['errors'], stats['entries'],
+                      stats['time'] * 1000, stats['max'] * 1000))
+    for what, count in sorted(summary['retries'].items()):
+        stream.write('retries %s: %d\n' % (what, count))
+    stream.write('ldap %.1fms of %.1fms in %s\n' %
+                 (summary['ldap'] * 1000, summary['wall'] * 1000,
+                  summary['command']))
+
+
+def statsd_lines(summary):
+    """The summary as StatsD counters and timers"""
+    lines = ['obol.command.time:%.3f|ms' % (summary['wall'] * 1000),
+             'obol.ldap.time:%.3f|ms' % (summary['ldap'] * 1000)]
+    if 'startup' in summary:
+        lines.append('obol.startup.time:%.3f|ms' %
+                     (summary['startup'] * 1000))
+    for op, stats in sorted(summary['operations'].items()):
+        lines.append('obol.ldap.%s.count:%d|c' % (op, stats['count']))
+        lines.append('obol.ldap.%s.errors:%d|c' % (op, stats['errors']))
+        lines.append('obol.ldap.%s.entries:%d|c' % (op, stats['entries']))
+        lines.append('obol.ldap.%s.time:%.3f|ms' % (op, stats['time'] * 1000))
+    for what, count in sorted(summary['retries'].items()):
+        lines.append('obol.retries.%s:%d|c' % (what.replace(' ', '_'), count))
+    return lines
+
+
+def send_udp(host, port, lines):
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        client.sendto('\n'.join(lines), (host, port))
+    except socket.error:
+        pass
+    finally:
+        client.close()
+
+
+def _entries(result):
+    """Count the search entries in the result of a python-ldap call"""
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) and len(result) > 1 and \
+            isinstance(result[1], list):
+        return len(result[1])
+    return 0
+
+
+class TracedConnection(object):
+    """Wraps an LDAP connection and reports every operation to a Tracer"""
+    def __init__(self, conn, tracer):
+        self._conn = conn
+        self.tracer = tracer
+
+    def retried(self, what):
+        self.tracer.retried(what)
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if name in RESULTS:
+            return self._result(attr)
+        op = OPERATIONS.get(name)
+        if op is None:
+            return attr
+        if name.endswith('_s') or name == 'search_st':
+            return self._sync(attr, op)
+        return self._async(attr, op)
+
+    def _sync(self, method, op):
+        def call(*args, **kwargs):
+            started = time.time()
+            try:
+                result = method(*args, **kwargs)
+            except Exception as error:
+                self.tracer.record(op, time.time() - started, 0, error)
+                raise
+            self.tracer.record(op, time.time() - started, _entries(result))
+            return result
+        return call
+
+    def _async(self, method, op):
+        def send(*args, **kwargs):
+            msgid = method(*args, **kwargs)
+            self.tracer.sent(self._conn, msgid, op)
+            return msgid
+        return send
+
+    def _result(self, method):
+        def result(msgid=-1, all=1, *args, **kwargs):
+            try:
+                data = method(msgid, all, *args, **kwargs)
+            except Exception as error:
+                self.tracer.received(self._conn, msgid, 0, error)
+                raise
+            # with all=0 more results for the msgid may follow
+            rtype = data[0] if data else None
+            done = all or rtype not in PARTIAL
+            self.tracer.received(self._conn, msgid, _entries(data), None,
+                                 done)
+            return data
+        return result
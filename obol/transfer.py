@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+import bz2
+import gzip
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+import ldap
+from ldif import LDIFWriter
+from ldif3 import LDIFParser
+
+from cliff.command import Command
+
+from .pipeline import Pipeline, describe
+from .search import paged_search
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION = ['none', 'gzip', 'bzip2', 'zstd']
+
+BUFFER_SIZE = 1024 * 1024
+
+
+def guess_compression(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return {'.gz': 'gzip', '.bz2': 'bzip2',
+            '.zst': 'zstd'}.get(extension, 'none')
+
+
+class _Zstd(object):
+    """A file object that (de)compresses through the zstd program
+
+    Python has no zstd support of its own, the zstd command line tool
+    is used instead.
+    """
+    def __init__(self, filename, mode):
+        try:
+            if 'r' in mode:
+                self.process = subprocess.Popen(
+                    ['zstd', '-q', '-d', '-c', filename],
+                    stdout=subprocess.PIPE, bufsize=BUFFER_SIZE)
+                self.stream = self.process.stdout
+            else:
+                self.output = open(filename, 'wb')
+                self.process = subprocess.Popen(
+                    ['zstd', '-q', '-c'], stdin=subprocess.PIPE,
+                    stdout=self.output, bufsize=BUFFER_SIZE)
+                self.stream = self.process.stdin
+        except OSError as error:
+            raise IOError("zstd compression needs the zstd program: %s" %
+                          error)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def __iter__(self):
+        return iter(self.stream)
+
+    def close(self):
+        self.stream.close()
+        status = self.process.wait()
+        if getattr(self, 'output', None) is not None:
+            self.output.close()
+        if status:
+            raise IOError("zstd exited with status %d" % status)
+
+
+def open_ldif(filename, mode, compression=None):
+    """Open a possibly compressed LDIF file, - for stdin or stdout"""
+    if filename == '-':
+        return sys.stdin if 'r' in mode else sys.stdout
+    compression = compression or guess_compression(filename)
+    if compression == 'gzip':
+        return gzip.open(filename, mode + 'b')
+    if compression == 'bzip2':
+        return bz2.BZ2File(filename, mode + 'b', BUFFER_SIZE)
+    if compression == 'zstd':
+        return _Zstd(filename, mode)
+    if 'r' in mode:
+        return io.open(filename, 'rb', buffering=BUFFER_SIZE)
+    return io.open(filename, 'wb', buffering=BUFFER_SIZE)
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+class Export(Command):
+    """Write the user and group trees to an LDIF file"""
+
+    def get_parser(self, name):
+        parser = super(Export, self).get_parser(name)
+        parser.add_argument('filename', nargs='?', default='-',
+                            help="output file, - for stdout (default)")
+        parser.add_argument('--tree', action='append',
+                            help="subtree to export, may be repeated "
+                                 "(default: the user and group trees)")
+        parser.add_argument('--compress', choices=COMPRESSION,
+                            help="compression (default: from extension)")
+        return parser
+
+    def take_action(self, args):
+        b = self.app.options.b
+        conn = self.app.conn
+        trees = args.tree or [self.app.default('user_tree', 'ou=People'),
+                              self.app.default('group_tree', 'ou=Group')]
+
+        stream = open_ldif(args.filename, 'w', args.compress)
+        writer = LDIFWriter(stream)
+        started = time.time()
+        count = 0
+        try:
+            # the base, so the trees can be added to an empty server, and
+            # the id counters, so the copy continues where we are
+            for single in [b, 'cn=uid,%s' % b, 'cn=gid,%s' % b]:
+                try:
+                    for dn, entry in conn.search_s(single, ldap.SCOPE_BASE,
+                                                   '(objectclass=*)', ['*']):
+                        writer.unparse(dn, entry)
+                        count += 1
+                except ldap.NO_SUCH_OBJECT:
+                    pass
+
+            for tree in trees:
+                base_dn = '%s,%s' % (tree, b)
+                for dn, entry in paged_search(conn, base_dn,
+                                              ldap.SCOPE_SUBTREE,
+                                              '(objectclass=*)', ['*'],
+                                              self.app.options.page_size):
+                    writer.unparse(dn, entry)
+                    count += 1
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        elapsed = time.time() - started
+        sys.stderr.write("Exported %d entries in %.2fs (%.1f entries/s)\n" %
+                         (count, elapsed, count / elapsed if elapsed else 0))
+
+
+class Checkpoint(object):
+    """How far an import got, kept in a small JSON file
+
+    Results come back in the order the operations were sent, so all
+    records before the last result that came in are done. Only the
+    number of those records is saved, together with the size and
+    modification time of the input, so a checkpoint of another file
+    is not used by mistake.
+    """
+    def __init__(self, path, filename):
+        self.path = path
+        self.source = None
+        if filename != '-':
+            stat = os.stat(filename)
+            self.source = [os.path.abspath(filename), stat.st_size,
+                           int(stat.st_mtime)]
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        with open(self.path) as stream:
+            state = json.load(stream)
+        if state.get('source') != self.source:
+            logger.warning('%s belongs to another input, starting over',
+                           self.path)
+            return 0
+        return state['done']
+
+    def save(self, done):
+        if not self.path:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as stream:
+            json.dump({'source': self.source, 'done': done}, stream)
+        os.rename(tmp, self.path)
+
+    def remove(self):
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class Import(Command):
+    """Load entries from an LDIF file with pipelined adds
+
+    The cn=uid and cn=gid counters are replaced when they exist, also
+    with --existing skip, so new ids continue after the imported ones.
+    """
+
+    def get_parser(self, name):
+        parser = super(Import, self).get_parser(name)
+        parser.add_argument('filename', help="input file, - for stdin")
+        parser.add_argument('--compress', choices=COMPRESSION,
+                            help="compression (default: from extension)")
+        parser.add_argument('--existing', default='skip',
+                            choices=['skip', 'replace', 'fail'],
+                            help="what to do with entries that already "
+                                 "exist (default: skip)")
+        parser.add_argument('--window', type=int,
+                            default=int(self.app.default('window', 64)),
+                            help="maximum number of operations in flight")
+        parser.add_argument('--checkpoint', metavar='FILENAME',
+                            help="where to keep track of the progress "
+                                 "(default: FILENAME.checkpoint)")
+        parser.add_argument('--every', type=int, default=1000,
+                            help="save the progress every this many "
+                                 "entries")
+        parser.add_argument('--restart', action='store_true',
+                            help="ignore the checkpoint and start at the "
+                                 "first entry")
+        return parser
+
+    def take_action(self, args):
+        conn = self.app.conn
+        path = args.checkpoint
+        if not path and args.filename != '-':
+            path = args.filename + '.checkpoint'
+        checkpoint = Checkpoint(path, args.filename)
+        skip = 0 if args.restart else checkpoint.load()
+        if skip:
+            print("Resuming after entry %d" % skip)
+        b = self.app.options.b
+        self.invalidates = [b]
+        counters = set(['cn=uid,%s' % b.lower(), 'cn=gid,%s' % b.lower()])
+
+        # index, dn and attributes of the entries that failed to add
+        # because they exist, to be replaced
+        existing = []
+        replacing = set()
+        counts = {'added': 0, 'replaced': 0, 'skipped': 0, 'failed': 0}
+        progress = {'done': skip}
+        # lower case DNs of the adds that are in flight
+        adding = set()
+
+        def done(tag, result, error):
+            index, dn, modlist = tag
+            if modlist is None:
+                replacing.discard(index)
+            else:
+                progress['done'] = index + 1
+                adding.discard(dn.lower())
+            if error is None:
+                counts['replaced' if modlist is None else 'added'] += 1
+            elif (isinstance(error, ldap.ALREADY_EXISTS) and
+                    modlist is not None and dn.lower() in counters):
+                existing.append((index, dn, modlist))
+            elif (isinstance(error, ldap.ALREADY_EXISTS) and
+                    modlist is not None and args.existing != 'fail'):
+                if args.existing == 'replace':
+                    existing.append((index, dn, modlist))
+                else:
+                    counts['skipped'] += 1
+            else:
+                counts['failed'] += 1
+                print("%s: failed: %s" % (dn, describe(error)))
+
+        def replace_existing():
+            while existing:
+                index, dn, modlist = existing.pop(0)
+                replacing.add(index)
+                replace = [(ldap.MOD_REPLACE, key, values)
+                           for key, values in modlist]
+                pipeline.submit((index, dn, None), 'modify', dn, replace)
+
+        def safe_point():
+            """Number of entries that are completely done"""
+            return min([progress['done']] + list(replacing) +
+                       [index for index, _, _ in existing])
+
+        stream = open_ldif(args.filename, 'r', args.compress)
+        pipeline = Pipeline(conn, args.window, done)
+        try:
+            for index, (dn, entry) in enumerate(LDIFParser(stream).parse()):
+                if index < skip:
+                    continue
+                dn = _encode(dn)
+                modlist = [(_encode(key), [_encode(value) for value in values])
+                           for key, values in entry.items()]
+                # the server may handle the operations in flight in any
+                # order, a child has to wait until its parent is added
+                if dn.split(',', 1)[-1].lower() in adding:
+                    pipeline.flush()
+                adding.add(dn.lower())
+                pipeline.submit((index, dn, modlist), 'add', dn, modlist)
+                replace_existing()
+                if (index + 1) % args.every == 0:
+                    checkpoint.save(safe_point())
+            pipeline.flush()
+            while existing:
+                replace_existing()
+                pipeline.flush()
+        except BaseException:
+            # everything that came back before the failure is done
+            checkpoint.save(safe_point())
+            raise
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        checkpoint.remove()
+        elapsed = pipeline.elapsed()
+        total = sum(counts.values())
+        print("Imported %d entries in %.2fs (%.1f entries/s): %d added, "
+              "%d replaced, %d skipped, %d failed" %
+              (total, elapsed, total / elapsed if elapsed else 0.0,
+               counts['added'], counts['replaced'], counts['skipped'],
+               counts['failed']))
+        if counts['failed']:
+            return 1
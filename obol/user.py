@@ -1,35 +1,39 @@
 #!/usr/bin/env python
-from retrying import retry
-from ldif import LDIFWriter
+from ldif3 import LDIFParser
 import sys
 import ldap
 import os
-import hashlib
+import csv
+import collections
+import json
 import logging
+import multiprocessing
 
 from cliff.command import Command
 
-logger = logging.getLogger(__name__)
-
-
-def make_secret(password):
-    """Encodes the given password as a base64 SSHA hash+salt buffer"""
-    if password.startswith('{SSHA}'):
-        return password
+from .allocator import uid_allocator
+from .api import (USER_ATTRIBUTES, add_user, current_users, delete_users,
+                  list_users, replace_mods, reset_password, search_chunks,
+                  user_groups, user_records)
+from .cache import cached_search
+from .features import PASSWORD_MODIFY, SYNCREPL, TRANSACTIONS
+from .mirror import local_search
+from .pipeline import Pipeline, describe
+from .output import add_output_arguments, combine_filter, entry_writer
+from .passwords import SCHEMES, hash_job, hash_password
+from .sort import add_sort_arguments, sort_attributes, sort_window
+from .syncrepl import MemberIndex
 
-    salt = os.urandom(4)
-
-    # hash the password and append the salt
-    sha = hashlib.sha1(password)
-    sha.update(salt)
+logger = logging.getLogger(__name__)
 
-    # create a base64 encoded string of the concatenated digest + salt
-    digest_salt = '{}{}'.format(sha.digest(), salt).encode('base64').strip()
 
-    # now tag the digest above with the {SSHA} tag
-    tagged_digest_salt = '{{SSHA}}{}'.format(digest_salt)
+def make_secret(password, scheme='SSHA', rounds=None):
+    """Encodes the given password as a tagged userPassword hash
 
-    return tagged_digest_salt
+    The default is a base64 SSHA hash+salt buffer; see
+    obol.passwords for the other schemes.
+    """
+    return hash_password(password, scheme, rounds)
 
 
 class Init(Command):
@@ -50,6 +54,14 @@ class Init(Command):
 
         group_tree = args.group_tree
         user_tree = args.user_tree
+        # the schema may have been loaded since the profile was cached
+        profile = self.app.profile()
+        if not profile.has_objectclass('uidNext'):
+            profile = self.app.profile(refresh=True)
+        if not profile.has_objectclass('uidNext'):
+            print("The schema of the server has no uidNext object class")
+            return 1
+        self.invalidates = [b]
 
         dn = '%s' % (b)
         add_record = [
@@ -89,26 +101,6 @@ class Init(Command):
 class UserAdd(Command):
     """Add a user to the LDAP"""
 
-    @retry(stop_max_delay=10000)
-    def increment_uid(self, b):
-        """Generate a new userid"""
-        conn = self.app.conn
-        dn = 'cn=uid,%s' % b
-        filter = 'objectclass=*'
-        attrs = ['uidNumber']
-
-        try:
-            result = conn.search_s(dn, ldap.SCOPE_SUBTREE, filter, attrs)
-            uidNumber = result[0][1]['uidNumber'][0]
-
-            mod_attrs = [(ldap.MOD_DELETE, 'uidNumber', uidNumber),
-                         (ldap.MOD_ADD, 'uidNumber', str(int(uidNumber)+1))]
-
-            conn.modify_s(dn, mod_attrs)
-        except Exception:
-            raise
-        return uidNumber
-
     def get_parser(self, name):
         parser = super(UserAdd, self).get_parser(name)
         parser.add_argument('username')
@@ -140,173 +132,439 @@ class UserAdd(Command):
         groups = args.groups
         grouptree = args.grouptree
         conn = self.app.conn
+        self.invalidates = ['%s,%s' % (context, b)]
+        self.invalidates += ['cn=%s,%s,%s' % (group, grouptree, b)
+                             for group in groups or []]
 
-        if not uidNumber:
-            uidNumber = self.increment_uid(b)
-
-        # first add the group
-        dn = 'cn=%s,%s,%s' % (username, context, b)
-        logger.debug(dn)
-        add_record = [
-            ('objectclass', ['top', 'posixGroup']),
-            ('cn', [username]),
-            ('memberuid', [uidNumber]),
-            ('gidNumber', [uidNumber])
-        ]
-        conn.add_s(dn, add_record)
-
-        # now add the user
-        dn = 'uid=%s,%s,%s' % (username, context, b)
-        logger.debug(dn)
-
-        # set some default values
-        if not cn:
-            cn = username
-        if not sn:
-            sn = username
+        transactions = self.app.profile().supports(TRANSACTIONS)
+        try:
+            add_user(conn, b, username, uidNumber, cn, sn, givenName,
+                     password, shell, groups, context, grouptree,
+                     transactions)
+        except ldap.LDAPError as error:
+            print("Error adding %s: %s" % (username, describe(error)))
+            return 1
+
+
+# Map the column/attribute names accepted by `user import` to the
+# keyword arguments of user_records()
+IMPORT_FIELDS = {
+    'username': 'username',
+    'uid': 'username',
+    'cn': 'cn',
+    'sn': 'sn',
+    'givenname': 'givenName',
+    'shell': 'shell',
+    'loginshell': 'shell',
+    'uidnumber': 'uidNumber',
+    'password': 'password',
+    'userpassword': 'password',
+    'groups': 'groups',
+}
+
+
+def _import_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if not isinstance(value, str):
+        return value.encode('utf-8')
+    return value
+
+
+def normalize_record(fields):
+    """Map an input record onto the user fields obol knows about"""
+    record = {}
+    for key, value in fields.items():
+        key = IMPORT_FIELDS.get(key.lower())
+        if not key or value in (None, '', []):
+            continue
+        if key == 'groups':
+            if isinstance(value, list):
+                value = [_import_value(group) for group in value]
+            else:
+                value = csep(_import_value(value))
+        else:
+            if isinstance(value, list):
+                value = value[0]
+            value = _import_value(value)
+        record[key] = value
+    return record
+
+
+def read_user_records(stream, format):
+    """Yield user records from a csv, ldif or jsonl stream"""
+    if format == 'csv':
+        for fields in csv.DictReader(stream):
+            yield normalize_record(fields)
+    elif format == 'ldif':
+        for _, entry in LDIFParser(stream).parse():
+            yield normalize_record(entry)
+    elif format == 'jsonl':
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield normalize_record(json.loads(line))
+    else:
+        raise ValueError("Unknown input format %s" % format)
+
+
+def guess_format(filename):
+    """Guess the input format from the file extension"""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in ('.ldif', '.ldf'):
+        return 'ldif'
+    if extension in ('.json', '.jsonl', '.ndjson'):
+        return 'jsonl'
+    return 'csv'
+
+
+class UserImport(Command):
+    """Add users in bulk from a CSV, LDIF or JSON lines file"""
 
-        add_record = [
-            ('objectclass', ['top', 'person', 'organizationalPerson',
-                             'inetOrgPerson', 'posixAccount',
-                             'shadowAccount']),
-            ('uid', [username]),
-            ('cn', [cn]),
-            ('sn', [sn]),
-            ('loginShell', [shell]),
-            ('uidNumber', [uidNumber]),
-            ('gidNumber', [uidNumber]),
-            ('homeDirectory', ['/home/%s' % username])
-        ]
+    def get_parser(self, name):
+        parser = super(UserImport, self).get_parser(name)
+        parser.add_argument('filename', help="input file, - for stdin")
+        parser.add_argument('--format', choices=['csv', 'ldif', 'jsonl'],
+                            help="input format (default: from extension)")
+        parser.add_argument('--subtree',
+                            default=self.app.default('user_tree', 'ou=People'))
+        parser.add_argument('--grouptree',
+                            default=self.app.default('group_tree', 'ou=Group'))
+        parser.add_argument('--window', type=int,
+                            default=int(self.app.default('window', 64)),
+                            help="maximum number of operations in flight")
+        parser.add_argument('--block', type=int,
+                            default=int(self.app.default('id_block', 100)),
+                            help="number of uidNumbers to reserve at once")
+        return parser
 
-        if givenName:
-            add_record.append(('givenName', [givenName]))
-        if password:
-            password = make_secret(password)
-            add_record.append(('userPassword', [password]))
+    def take_action(self, args):
+        b = self.app.options.b
+        conn = self.app.conn
+        context = args.subtree
+        grouptree = args.grouptree
+        format = args.format or guess_format(args.filename)
+        self.invalidates = ['%s,%s' % (context, b), '%s,%s' % (grouptree, b)]
+
+        # username, outstanding operations and errors for each record
+        status = {}
+        totals = {'ok': 0, 'failed': 0}
+
+        def report(index, errors):
+            username = status.pop(index)[0]
+            if errors:
+                totals['failed'] += 1
+                print("%s: failed: %s" % (username, '; '.join(errors)))
+            else:
+                totals['ok'] += 1
+                print("%s: ok" % username)
+
+        def done(tag, result, error):
+            index, dn = tag
+            entry = status[index]
+            entry[1] -= 1
+            if error is not None:
+                entry[2].append('%s: %s' % (dn, describe(error)))
+            if entry[1] == 0:
+                report(index, entry[2])
+
+        pipeline = Pipeline(conn, args.window, done)
+        allocator = uid_allocator(conn, b, args.block)
+
+        if args.filename == '-':
+            stream = sys.stdin
+        else:
+            stream = open(args.filename, 'rb' if format == 'ldif' else 'r')
 
-        conn.add_s(dn, add_record)
+        try:
+            for index, record in enumerate(read_user_records(stream, format)):
+                username = record.get('username')
+                if not username:
+                    status[index] = ['record %d' % (index + 1), 0, []]
+                    report(index, ['no username'])
+                    continue
 
-        if groups:
-            for group in groups:
-                dn = 'cn=%s,%s,%s' % (group, grouptree, b)
                 try:
-                    mod_attrs = []
-                    mod_attrs.append((ldap.MOD_ADD, 'memberuid', username))
-                    conn.modify_s(dn, mod_attrs)
-                except Exception as error:
-                    print("Error adding %s to %s: %s" %
-                          (username, group, error))
+                    uidNumber = (record.get('uidNumber') or
+                                 allocator.allocate())
+                except ldap.LDAPError as error:
+                    status[index] = [username, 0, []]
+                    report(index, [describe(error)])
+                    continue
+
+                records = user_records(b, context, username, uidNumber,
+                                       record.get('cn'), record.get('sn'),
+                                       record.get('givenName'),
+                                       record.get('password'),
+                                       record.get('shell', '/bin/bash'))
+                groups = record.get('groups', [])
+                status[index] = [username, len(records) + len(groups), []]
+
+                for dn, add_record in records:
+                    pipeline.submit((index, dn), 'add', dn, add_record)
+                for group in groups:
+                    dn = 'cn=%s,%s,%s' % (group, grouptree, b)
+                    mod_attrs = [(ldap.MOD_ADD, 'memberuid', username)]
+                    pipeline.submit((index, dn), 'modify', dn, mod_attrs)
+            pipeline.flush()
+        finally:
+            allocator.release()
+            if stream is not sys.stdin:
+                stream.close()
+
+        elapsed = pipeline.elapsed()
+        count = totals['ok'] + totals['failed']
+        print("Imported %d of %d users in %.2fs (%.1f users/s)" %
+              (totals['ok'], count, elapsed,
+               count / elapsed if elapsed else 0.0))
+        logger.debug('uid allocation: %s', allocator.stats())
+        if totals['failed']:
+            return 1
+
+
+def read_names(names, filename=None):
+    """The names given as arguments followed by the ones in filename
+
+    The file has a name per line and can be - for stdin, so the output
+    of a list command can be piped in.
+    """
+    names = list(names)
+    if filename:
+        stream = sys.stdin if filename == '-' else open(filename)
+        try:
+            names.extend(line.strip() for line in stream if line.strip())
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+    return names
 
 
 class UserDelete(Command):
-    """Delete a user from the LDAP"""
+    """Delete one or more users from the LDAP"""
 
     def get_parser(self, name):
         parser = super(UserDelete, self).get_parser(name)
-        parser.add_argument('username')
+        parser.add_argument('username', nargs='*')
         parser.add_argument('--subtree',
                             default=self.app.default('user_tree', 'ou=People'))
+        parser.add_argument('--grouptree',
+                            default=self.app.default('group_tree', 'ou=Group'))
+        parser.add_argument('--from-file', metavar='FILENAME',
+                            help="read the usernames from a file, one per "
+                                 "line, - for stdin")
+        parser.add_argument('--concurrency', type=int,
+                            default=int(self.app.default('window', 64)),
+                            help="maximum number of operations in flight")
+        parser.add_argument('--index', action='store_true',
+                            default=self.app.default('member_index') == 'yes',
+                            help="find the groups of the user in a local "
+                                 "index kept up to date with syncrepl")
         return parser
 
+    def indexed_groups(self, usernames, grouptree):
+        """The group dns of every user from the local member index
+
+        Returns None when the index is not available.
+        """
+        if self.app.profile().supports(SYNCREPL) is False:
+            logger.warning('member index not available: the server does '
+                           'not support syncrepl')
+            return None
+        base_dn = '%s,%s' % (grouptree, self.app.options.b)
+        path = self.app.state_path('members-%s.json' % grouptree)
+        index = MemberIndex(self.app.conn, path)
+        try:
+            index.update(base_dn, ldap.SCOPE_SUBTREE)
+        except ldap.LDAPError as error:
+            logger.warning('member index not available: %s',
+                           describe(error))
+            return None
+        return dict((name, index.groups_of(name)) for name in usernames)
+
     def take_action(self, args):
         b = self.app.options.b
         conn = self.app.conn
-        username = args.username
         context = args.subtree
-
-        # First delete the user
-        try:
-            dn = 'uid=%s,%s,%s' % (username, context, b)
-            conn.delete_s(dn)
-        except Exception as e:
-            print(e)
-
-        base_dn = '%s,%s' % (context, b)
-        filter = '(memberuid=%s)' % username
-        attrs = ['']
-        groups = conn.search_s(base_dn, ldap.SCOPE_SUBTREE, filter, attrs)
-        dns = [_dn for _dn, _attrs in groups]
-
-        try:
-            for dn in dns:
-                mod_attrs = [(ldap.MOD_DELETE, 'memberuid', username)]
-                conn.modify_s(dn, mod_attrs)
-        except Exception as e:
-            print(e)
-
-        # Next delete the group
-        try:
-            dn = 'cn=%s,%s,%s' % (username, context, b)
-            conn.delete_s(dn)
-        except Exception as e:
-            print(e)
+        usernames = read_names(args.username, args.from_file)
+        if not usernames:
+            print("No users to delete")
+            return 1
+        self.invalidates = ['%s,%s' % (context, b),
+                            '%s,%s' % (args.grouptree, b)]
+
+        failed = set()
+        groups = None
+        if args.index:
+            groups = self.indexed_groups(usernames, args.grouptree)
+        errors = delete_users(conn, b, usernames, context, args.grouptree,
+                              groups, max(1, args.concurrency))
+        for username in usernames:
+            for dn, error in errors.pop(username, []):
+                print("%s: failed: %s: %s" % (username, dn, describe(error)))
+                failed.add(username)
+
+        total = len(set(usernames))
+        if total > 1:
+            print("Deleted %d of %d users" % (total - len(failed), total))
+        if failed:
+            return 1
 
 
 class UserList(Command):
     """List all users"""
+    readonly = True
+
     log = logging.getLogger(__name__)
 
     def get_parser(self, name):
         parser = super(UserList, self).get_parser(name)
         parser.add_argument('--subtree',
                             default=self.app.default('user_tree', 'ou=People'))
+        add_output_arguments(parser, 'plain')
+        add_sort_arguments(parser)
+        parser.add_argument('--local', action='store_true',
+                            help="answer from the local mirror")
         return parser
 
     def take_action(self, args):
         """List users defined in the system"""
         b = self.app.options.b
-        conn = self.app.conn
         context = args.subtree
 
         base_dn = '%s,%s' % (context, b)
-        filter = '(objectclass=person)'
-        attrs = ['uid']
-        for _, attrs in conn.search_s(base_dn,
-                                      ldap.SCOPE_SUBTREE, filter, attrs):
-            print(attrs['uid'][0])
+        filter = combine_filter('(objectclass=person)', args.filter)
+        attrs = args.attrs or ['uid']
+        page_size = self.app.options.page_size
+        writer = entry_writer(args.format, sys.stdout, attrs)
+        if args.local:
+            entries = local_search(self.app, base_dn, filter,
+                                   sort_attributes(attrs, args.sort))
+            entries = sort_window(entries, args.sort, args.offset,
+                                  args.count, attrs)
+        else:
+            conn = self.app.conn
+            controls = self.app.profile().controls if args.sort else None
+            entries = list_users(conn, b, context, filter, attrs, page_size,
+                                 args.sort, args.offset, args.count,
+                                 controls)
+        for dn, entry in entries:
+            writer.write(dn, entry)
 
 
 class UserModify(Command):
-    """Modify a user"""
+    """Modify one or more users"""
     def get_parser(self, name):
         parser = super(UserModify, self).get_parser(name)
-        parser.add_argument('username')
+        parser.add_argument('username', nargs='*')
         parser.add_argument('--subtree',
                             default=self.app.default('user_tree', 'ou=People'))
         parser.add_argument('--cn')
         parser.add_argument('--sn')
         parser.add_argument('--givenName')
         parser.add_argument('--shell')
+        parser.add_argument('--from-file', metavar='FILENAME',
+                            help="read the users and their new values from "
+                                 "a csv, ldif or jsonl file, - for stdin")
+        parser.add_argument('--format', choices=['csv', 'ldif', 'jsonl'],
+                            help="input format (default: from extension)")
+        parser.add_argument('--window', type=int,
+                            default=int(self.app.default('window', 64)),
+                            help="maximum number of operations in flight")
         return parser
 
     def take_action(self, args):
-        username = args.username
         context = args.subtree
         b = self.app.options.b
         conn = self.app.conn
+        base_dn = '%s,%s' % (context, b)
 
-        dn = 'uid=%s,%s,%s' % (username, context, b)
-
-        mod_attrs = []
-        for key in ['cn', 'sn', 'givenName', 'shell']:
-            value = getattr(args, key)
-            if not value:
+        # the values on the command line apply to every user
+        values = dict((field, getattr(args, field))
+                      for field, _ in USER_ATTRIBUTES
+                      if getattr(args, field))
+        changes = collections.OrderedDict()
+        for username in args.username:
+            changes[username] = dict(values)
+        if args.from_file:
+            format = args.format or guess_format(args.from_file)
+            if args.from_file == '-':
+                stream = sys.stdin
+            else:
+                stream = open(args.from_file,
+                              'rb' if format == 'ldif' else 'r')
+            try:
+                for record in read_user_records(stream, format):
+                    if record.get('username'):
+                        record.update(values)
+                        changes[record['username']] = record
+            finally:
+                if stream is not sys.stdin:
+                    stream.close()
+        if not changes:
+            print("No users to modify")
+            return 1
+
+        current = current_users(conn, base_dn, changes,
+                                self.app.options.page_size)
+        self.invalidates = []
+        failed = []
+
+        def done(username, result, error):
+            if error is not None:
+                failed.append(username)
+                print("%s: failed: %s" % (username, describe(error)))
+
+        pipeline = Pipeline(conn, args.window, done)
+        unchanged = 0
+        for username, record in changes.items():
+            if username not in current:
+                failed.append(username)
+                print("%s: no such user" % username)
                 continue
-            if key == 'shell':
-                key = 'loginShell'
-            mod_attrs.append((ldap.MOD_DELETE, key, None))
-            mod_attrs.append((ldap.MOD_ADD, key, value))
-        conn.modify_s(dn, mod_attrs)
+            mod_attrs = replace_mods(current[username], record)
+            if not mod_attrs:
+                unchanged += 1
+                continue
+            dn = 'uid=%s,%s' % (username, base_dn)
+            self.invalidates.append(dn)
+            pipeline.submit(username, 'modify', dn, mod_attrs)
+        pipeline.flush()
+
+        if len(changes) > 1:
+            print("Modified %d of %d users, %d unchanged" %
+                  (pipeline.succeeded, len(changes), unchanged))
+        if failed:
+            return 1
 
 
 class UserReset(Command):
-    """Reset a user's password"""
+    """Reset a user's password, or the passwords of many users"""
     def get_parser(self, name):
         parser = super(UserReset, self).get_parser(name)
-        parser.add_argument('username')
+        parser.add_argument('username', nargs='?')
         parser.add_argument('--subtree',
                             default=self.app.default('user_tree', 'ou=People'))
         parser.add_argument('--password')
+        parser.add_argument('--from-file', metavar='FILENAME',
+                            help="read usernames and passwords from a csv, "
+                                 "ldif or jsonl file, - for stdin")
+        parser.add_argument('--format', choices=['csv', 'ldif', 'jsonl'],
+                            help="input format (default: from extension)")
+        parser.add_argument('--scheme', type=str.upper, choices=SCHEMES,
+                            default=self.app.default('password_scheme')
+                            or None,
+                            help="hash the passwords locally with this "
+                                 "scheme instead of letting the server do it")
+        parser.add_argument('--rounds', type=int,
+                            default=self.app.default('password_rounds')
+                            or None,
+                            help="rounds for PBKDF2-SHA512 and CRYPT")
+        parser.add_argument('--processes', type=int,
+                            help="processes hashing passwords (default: "
+                                 "one per core)")
+        parser.add_argument('--window', type=int,
+                            default=int(self.app.default('window', 64)),
+                            help="maximum number of operations in flight")
         return parser
 
     def take_action(self, args):
@@ -316,30 +574,193 @@ class UserReset(Command):
         b = self.app.options.b
         conn = self.app.conn
 
-        dn = 'uid=%s,%s,%s' % (username, context, b)
-        conn.passwd_s(dn, None, password)
+        if args.from_file:
+            return self.reset_many(args)
+        if not username:
+            print("A username or --from-file is required")
+            return 1
+
+        self.invalidates = ['uid=%s,%s,%s' % (username, context, b)]
+        reset_password(conn, b, username, password, context,
+                       self.scheme(args), args.rounds)
+
+    def scheme(self, args):
+        """--scheme, or the default scheme when the server cannot hash"""
+        if args.scheme or not args.password and not args.from_file:
+            return args.scheme
+        if self.app.profile().supports(PASSWORD_MODIFY) is not False:
+            return None
+        logger.info('the server has no password modify operation, '
+                    'hashing with %s', SCHEMES[0])
+        return SCHEMES[0]
+
+    def reset_many(self, args):
+        """Reset the passwords in a file with pipelined operations
+
+        With --scheme the passwords are hashed on a process pool, so
+        the hashing runs on all cores while the results are written.
+        Without it they are sent with the password modify extended
+        operation and the server hashes them.
+        """
+        b = self.app.options.b
+        conn = self.app.conn
+        base_dn = '%s,%s' % (args.subtree, b)
+        format = args.format or guess_format(args.from_file)
+        args.scheme = self.scheme(args)
+        self.invalidates = [base_dn]
+        failed = []
+
+        def done(username, result, error):
+            if error is not None:
+                failed.append(username)
+                print("%s: failed: %s" % (username, describe(error)))
+
+        if args.from_file == '-':
+            stream = sys.stdin
+        else:
+            stream = open(args.from_file, 'rb' if format == 'ldif' else 'r')
+
+        jobs = []
+        try:
+            for record in read_user_records(stream, format):
+                if not record.get('username') or not record.get('password'):
+                    failed.append(record.get('username'))
+                    print("%s: failed: no username or password" %
+                          record.get('username'))
+                    continue
+                jobs.append((record['username'], record['password'],
+                             args.scheme, args.rounds))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        pipeline = Pipeline(conn, args.window, done)
+        if args.scheme:
+            pool = multiprocessing.Pool(args.processes)
+            try:
+                for username, secret in pool.imap_unordered(hash_job, jobs,
+                                                            16):
+                    dn = 'uid=%s,%s' % (username, base_dn)
+                    mod_attrs = [(ldap.MOD_REPLACE, 'userPassword',
+                                  [secret])]
+                    pipeline.submit(username, 'modify', dn, mod_attrs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for username, password, _, _ in jobs:
+                dn = 'uid=%s,%s' % (username, base_dn)
+                pipeline.submit(username, 'passwd', dn, None, password)
+        pipeline.flush()
+
+        elapsed = pipeline.elapsed()
+        print("Reset %d of %d passwords in %.2fs (%.1f/s)" %
+              (pipeline.succeeded, len(failed) + pipeline.succeeded,
+               elapsed, pipeline.succeeded / elapsed if elapsed else 0.0))
+        if failed:
+            return 1
 
 
 class UserShow(Command):
-    """Show a user"""
+    """Show one or more users"""
+    readonly = True
+
     def get_parser(self, name):
         parser = super(UserShow, self).get_parser(name)
-        parser.add_argument('username')
+        parser.add_argument('username', nargs='*')
         parser.add_argument('--subtree',
                             default=self.app.default('user_tree', 'ou=People'))
+        parser.add_argument('--from-file', metavar='FILENAME',
+                            help="read the usernames from a file, one per "
+                                 "line, - for stdin")
+        add_output_arguments(parser, 'ldif')
+        parser.add_argument('--local', action='store_true',
+                            help="answer from the local mirror")
+        parser.add_argument('--chunk', type=int,
+                            default=int(self.app.default('chunk', 100)),
+                            help="users to look up per search")
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help="number of searches in flight")
         return parser
 
+    def search(self, args, base_dn, username):
+        filter = combine_filter('(uid=%s)' % username, args.filter)
+        if args.local:
+            return local_search(self.app, base_dn, filter, args.attrs)
+        return cached_search(self.app, base_dn, ldap.SCOPE_SUBTREE,
+                             filter, args.attrs)
+
     def take_action(self, args):
-        username = args.username
         context = args.subtree
         b = self.app.options.b
-        conn = self.app.conn
+        usernames = read_names(args.username, args.from_file)
+        if not usernames:
+            print("No users to show")
+            return 1
 
         base_dn = '%s,%s' % (context, b)
-        filter = '(uid=%s)' % username
-        writer = LDIFWriter(sys.stdout)
-        for dn, attrs in conn.search_s(base_dn, ldap.SCOPE_SUBTREE, filter):
-            writer.unparse(dn, attrs)
+        writer = entry_writer(args.format, sys.stdout, args.attrs)
+        if len(usernames) == 1:
+            found = False
+            for dn, attrs in self.search(args, base_dn, usernames[0]):
+                writer.write(dn, attrs)
+                found = True
+            if not found:
+                sys.stderr.write("%s: no such user\n" % usernames[0])
+                return 1
+            return
+
+        # many users: the mirror and the cache are asked per user, the
+        # server with a search per chunk of names
+        found = {}
+        if args.local or self.app.cache is not None:
+            for username in usernames:
+                for dn, attrs in self.search(args, base_dn, username):
+                    found[username.lower()] = (dn, attrs)
+        else:
+            filter = combine_filter('(objectclass=*)', args.filter)
+            for dn, attrs in search_chunks(self.app.conn, base_dn, 'uid',
+                                           usernames, filter, args.attrs,
+                                           max(1, args.chunk),
+                                           max(1, args.concurrency)):
+                rdn = dn.split(',', 1)[0]
+                found[rdn.split('=', 1)[-1].lower()] = (dn, attrs)
+
+        missing = 0
+        for username in usernames:
+            if username.lower() in found:
+                writer.write(*found[username.lower()])
+            else:
+                missing += 1
+                sys.stderr.write("%s: no such user\n" % username)
+        if missing:
+            return 1
+
+
+class UserGroups(Command):
+    """List the groups of a user"""
+    readonly = True
+
+    def get_parser(self, name):
+        parser = super(UserGroups, self).get_parser(name)
+        parser.add_argument('username')
+        parser.add_argument('--subtree',
+                            default=self.app.default('user_tree', 'ou=People'))
+        add_output_arguments(parser, 'plain')
+        return parser
+
+    def take_action(self, args):
+        b = self.app.options.b
+        attrs = args.attrs or ['cn']
+        writer = entry_writer(args.format, sys.stdout, attrs)
+        try:
+            groups = user_groups(self.app.conn, b, args.username,
+                                 args.subtree, attrs)
+        except ldap.NO_SUCH_OBJECT:
+            print("%s: no such user" % args.username)
+            return 1
+        for dn, entry in sorted(groups):
+            writer.write(dn, entry)
 
 
 def csep(s):
@@ -16,8 +16,10 @@ setup(
   license = 'GPLv3',
   long_description=read('README.rst'),
   packages = ['obol'],
+  python_requires = '>=2.7.8, <3',
   classifiers=[
         "Development Status :: 4 - Beta",
+        "Programming Language :: Python :: 2.7",
         "Topic :: Utilities",
         "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
   ],
@@ -29,7 +31,6 @@ setup(
   install_requires = [
      'python-ldap',
      'ldif3',
-     'retrying',
      'cliff'
   ]
 )
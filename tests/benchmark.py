@@ -0,0 +1,798 @@
+#!/usr/bin/env python
+"""Benchmark the obol commands against an LDAP stand-in
+
+Every command runs through ObolApp.run, as it would from the shell,
+against an in-process stand-in for the directory that is filled with
+the given number of users first. With -H the commands run against a
+real server instead, for example a throwaway slapd loaded with
+tests/setup.ldif; the users are then added to that server.
+
+For every command and directory size the benchmark reports the
+commands per second, the p50 and p99 latency, the LDAP round trips
+per command and the peak memory of the process. --json writes the
+numbers to a file, --compare prints the change against such a file.
+--startup measures how long obol takes to start instead, also when it
+forwards the command to `obol serve`.
+
+The "serve" commands are forwarded to an `obol serve` daemon that is
+forked from the benchmark, so it answers from the same directory.
+
+    python tests/benchmark.py --sizes 100,1000 --json after.json \\
+        --compare before.json
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import ldap  # noqa: E402
+from ldap.controls import SimplePagedResultsControl  # noqa: E402
+from ldap.syncrepl import (SyncDoneControl, SyncRequestControl,  # noqa: E402
+                           SyncStateControl)
+
+from obol.app import ObolApp  # noqa: E402
+from obol.client import forward  # noqa: E402
+from obol.mirror import parse_filter  # noqa: E402
+from obol.api import user_records  # noqa: E402
+
+BASE = 'dc=local'
+SETUP = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                     'setup.ldif')
+
+# the methods that send a request to the server
+REQUESTS = set([
+    'simple_bind_s', 'search', 'search_s', 'search_ext', 'search_ext_s',
+    'add', 'add_s', 'add_ext', 'add_ext_s', 'modify', 'modify_s',
+    'modify_ext', 'modify_ext_s', 'delete', 'delete_s', 'delete_ext',
+    'delete_ext_s', 'passwd', 'passwd_s', 'extop', 'extop_s',
+])
+
+# attributes the stand-in keeps an equality index for
+INDEXED = set(['uid', 'cn', 'memberuid'])
+
+# what the stand-in advertises: paged results, syncrepl and password
+# modify, but no transactions or sorting
+ROOT_DSE = {
+    'objectClass': ['top'],
+    'supportedControl': ['1.2.840.113556.1.4.319',
+                         '1.3.6.1.4.1.4203.1.9.1.1'],
+    'supportedExtension': ['1.3.6.1.4.1.4203.1.11.1'],
+    'supportedLDAPVersion': ['3'],
+    'namingContexts': [BASE],
+}
+
+
+def _error(cls, desc):
+    return cls({'desc': desc})
+
+
+class _Response(object):
+    """A response control as python-ldap decodes it"""
+    def __init__(self, controlType, **values):
+        self.controlType = controlType
+        self.__dict__.update(values)
+
+
+class StandIn(object):
+    """An in-memory directory with the python-ldap methods obol uses
+
+    Searches are answered from an equality index on uid, cn and
+    memberUid where the filter allows it, so the stand-in adds little
+    to the cost measured for obol itself.
+    """
+    def __init__(self):
+        self.entries = {}
+        self.index = {}
+        self.results = {}
+        self.msgid = 0
+        self.load('', ROOT_DSE)
+
+    def load(self, dn, attrs):
+        key = dn.lower()
+        self.entries[key] = (dn, attrs)
+        self._index(key, attrs, True)
+
+    def _index(self, key, attrs, add):
+        for attr, values in attrs.items():
+            attr = attr.lower()
+            if attr not in INDEXED:
+                continue
+            for value in values:
+                dns = self.index.setdefault((attr, value.lower()), set())
+                if add:
+                    dns.add(key)
+                else:
+                    dns.discard(key)
+
+    def _candidates(self, node):
+        if node[0] == '=' and node[1].lower() in INDEXED:
+            return self.index.get((node[1].lower(), node[2].lower()), set())
+        if node[0] == '&':
+            for child in node[1]:
+                found = self._candidates(child)
+                if found is not None:
+                    return found
+        if node[0] == '|' and node[1]:
+            found = set()
+            for child in node[1]:
+                more = self._candidates(child)
+                if more is None:
+                    return None
+                found |= more
+            return found
+        return None
+
+    def _match(self, node, attrs):
+        op = node[0]
+        if op == '&':
+            return all(self._match(child, attrs) for child in node[1])
+        if op == '|':
+            return any(self._match(child, attrs) for child in node[1])
+        if op == '!':
+            return not self._match(node[1], attrs)
+        values = [value.lower() for key, values in attrs.items()
+                  if key.lower() == node[1].lower() for value in values]
+        if op == 'present':
+            return bool(values)
+        if op == 'substring':
+            parts = node[2].lower().split('*')
+            for value in values:
+                if not value.startswith(parts[0]):
+                    continue
+                pos = len(parts[0])
+                for part in parts[1:-1]:
+                    pos = value.find(part, pos)
+                    if pos < 0:
+                        break
+                    pos += len(part)
+                else:
+                    if value[pos:].endswith(parts[-1]):
+                        return True
+            return False
+        if op == '=':
+            return node[2].lower() in values
+        if op == '>=':
+            return any(value >= node[2].lower() for value in values)
+        return any(value <= node[2].lower() for value in values)
+
+    def search_s(self, base, scope, filterstr='(objectclass=*)',
+                 attrlist=None, attrsonly=0):
+        base = base.lower()
+        if scope == ldap.SCOPE_BASE and base not in self.entries:
+            raise _error(ldap.NO_SUCH_OBJECT, 'No such object')
+        node = parse_filter(filterstr)
+        if scope == ldap.SCOPE_BASE:
+            keys = [base]
+        else:
+            keys = self._candidates(node)
+        if keys is None:
+            keys = self.entries.keys()
+        wanted = None
+        if attrlist and '*' not in attrlist:
+            wanted = set(attr.lower() for attr in attrlist)
+        result = []
+        for key in sorted(keys):
+            if scope == ldap.SCOPE_BASE and key != base:
+                continue
+            if key != base and not key.endswith(',' + base):
+                continue
+            if scope == ldap.SCOPE_ONELEVEL and (
+                    key == base or key[:-len(base) - 1].count(',')):
+                continue
+            dn, attrs = self.entries[key]
+            if not self._match(node, attrs):
+                continue
+            if wanted is not None:
+                attrs = dict((name, values) for name, values in attrs.items()
+                             if name.lower() in wanted)
+            result.append((dn, dict(attrs)))
+        return result
+
+    def add_s(self, dn, modlist):
+        if dn.lower() in self.entries:
+            raise _error(ldap.ALREADY_EXISTS, 'Already exists')
+        self.load(dn, dict((name, list(values)) for name, values in modlist))
+
+    def delete_s(self, dn):
+        key = dn.lower()
+        if key not in self.entries:
+            raise _error(ldap.NO_SUCH_OBJECT, 'No such object')
+        self._index(key, self.entries.pop(key)[1], False)
+
+    def modify_s(self, dn, modlist):
+        key = dn.lower()
+        if key not in self.entries:
+            raise _error(ldap.NO_SUCH_OBJECT, 'No such object')
+        dn, old = self.entries[key]
+        attrs = dict((name.lower(), (name, list(values)))
+                     for name, values in old.items())
+        for op, name, values in modlist:
+            if values is not None and not isinstance(values, list):
+                values = [values]
+            name, current = attrs.get(name.lower(), (name, []))
+            lower = [value.lower() for value in current]
+            if op == ldap.MOD_ADD:
+                for value in values:
+                    if value.lower() in lower:
+                        raise _error(ldap.TYPE_OR_VALUE_EXISTS,
+                                     'Type or value exists')
+                current = current + values
+            elif op == ldap.MOD_DELETE:
+                if not current:
+                    raise _error(ldap.NO_SUCH_ATTRIBUTE,
+                                 'No such attribute')
+                if values is None:
+                    current = []
+                else:
+                    for value in values:
+                        if value.lower() not in lower:
+                            raise _error(ldap.NO_SUCH_ATTRIBUTE,
+                                         'No such attribute')
+                    remove = set(value.lower() for value in values)
+                    current = [value for value in current
+                               if value.lower() not in remove]
+            else:
+                current = list(values or [])
+            attrs[name.lower()] = (name, current)
+        self._index(key, old, False)
+        self.load(dn, dict((name, values) for name, values in attrs.values()
+                           if values))
+
+    def passwd_s(self, user, oldpw, newpw):
+        self.modify_s(user, [(ldap.MOD_REPLACE, 'userPassword',
+                              [newpw or 'secret'])])
+
+    def extop_s(self, extreq, serverctrls=None, clientctrls=None,
+                extop_resp_class=None):
+        # like a server without transactions (RFC 5805), so adds take
+        # the pipelined path with rollback
+        raise _error(ldap.PROTOCOL_ERROR, 'Unsupported extended operation')
+
+    def _controls(self, serverctrls):
+        for control in serverctrls or []:
+            if control.criticality:
+                raise _error(ldap.UNAVAILABLE_CRITICAL_EXTENSION,
+                             'Critical extension is unavailable')
+
+    def add_ext_s(self, dn, modlist, serverctrls=None, clientctrls=None):
+        self._controls(serverctrls)
+        self.add_s(dn, modlist)
+
+    def modify_ext_s(self, dn, modlist, serverctrls=None, clientctrls=None):
+        self._controls(serverctrls)
+        self.modify_s(dn, modlist)
+
+    def delete_ext_s(self, dn, serverctrls=None, clientctrls=None):
+        self._controls(serverctrls)
+        self.delete_s(dn)
+
+    def simple_bind_s(self, who='', cred=''):
+        return (ldap.RES_BIND, [])
+
+    def unbind_s(self):
+        pass
+
+    def set_option(self, option, value):
+        pass
+
+    def _send(self, method, *args):
+        self.msgid += 1
+        try:
+            self.results[self.msgid] = (method(*args), None)
+        except ldap.LDAPError as error:
+            self.results[self.msgid] = (None, error)
+        return self.msgid
+
+    def add(self, dn, modlist):
+        return self._send(self.add_s, dn, modlist)
+
+    def modify(self, dn, modlist):
+        return self._send(self.modify_s, dn, modlist)
+
+    def delete(self, dn):
+        return self._send(self.delete_s, dn)
+
+    def add_ext(self, dn, modlist, serverctrls=None, clientctrls=None):
+        return self._send(self.add_ext_s, dn, modlist, serverctrls)
+
+    def modify_ext(self, dn, modlist, serverctrls=None, clientctrls=None):
+        return self._send(self.modify_ext_s, dn, modlist, serverctrls)
+
+    def delete_ext(self, dn, serverctrls=None, clientctrls=None):
+        return self._send(self.delete_ext_s, dn, serverctrls)
+
+    def passwd(self, user, oldpw, newpw):
+        return self._send(self.passwd_s, user, oldpw, newpw)
+
+    def search(self, base, scope, filterstr='(objectclass=*)',
+               attrlist=None, attrsonly=0):
+        return self._send(self.search_s, base, scope, filterstr, attrlist)
+
+    def search_ext(self, base, scope, filterstr='(objectclass=*)',
+                   attrlist=None, attrsonly=0, serverctrls=None, **kwargs):
+        msgid = self._send(self.search_s, base, scope, filterstr, attrlist)
+        for control in serverctrls or []:
+            if control.controlType in (SimplePagedResultsControl.controlType,
+                                       SyncRequestControl.controlType):
+                self.results[msgid] += (control,)
+        return msgid
+
+    def result(self, msgid=ldap.RES_ANY, all=1, timeout=None):
+        rtype, data, _, _ = self.result3(msgid, all, timeout)
+        return rtype, data
+
+    def result3(self, msgid=ldap.RES_ANY, all=1, timeout=None):
+        outcome = self.results.pop(msgid)
+        data, error = outcome[:2]
+        if error is not None:
+            raise error
+        if not isinstance(data, list):
+            return ldap.RES_MODIFY, [], msgid, []
+        if len(outcome) < 3:
+            return ldap.RES_SEARCH_RESULT, data, msgid, []
+
+        # the cookie is simply the offset of the next page
+        control = outcome[2]
+        start = int(control.cookie or 0)
+        end = start + control.size
+        cookie = str(end) if end < len(data) else ''
+        reply = SimplePagedResultsControl(False, size=control.size,
+                                          cookie=cookie)
+        return ldap.RES_SEARCH_RESULT, data[start:end], msgid, [reply]
+
+    def result4(self, msgid=ldap.RES_ANY, all=1, timeout=None, add_ctrls=0,
+                add_intermediates=0, add_extop=0, resp_ctrl_classes=None):
+        """Answer a sync search with a full refresh, whatever the cookie
+
+        Every entry is sent as added in one batch, then the search is
+        done, so entries the client has that were not sent are gone.
+        """
+        outcome = self.results.pop(msgid)
+        data, error = outcome[:2]
+        if error is not None:
+            raise error
+        if data is None:
+            done = _Response(SyncDoneControl.controlType,
+                             cookie=str(msgid), refreshDeletes=False)
+            return ldap.RES_SEARCH_RESULT, [], msgid, [done], None, None
+        self.results[msgid] = (None, None)
+        entries = [(dn, attrs, [_Response(SyncStateControl.controlType,
+                                          state='add', entryUUID=dn.lower(),
+                                          cookie=None)])
+                   for dn, attrs in data]
+        return ldap.RES_SEARCH_ENTRY, entries, msgid, [], None, None
+
+
+class Counting(object):
+    """Count the requests sent over a connection"""
+    def __init__(self, conn, counter):
+        self._conn = conn
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if name not in REQUESTS:
+            return attr
+
+        def request(*args, **kwargs):
+            with self._counter.get_lock():
+                self._counter.value += 1
+            return attr(*args, **kwargs)
+        return request
+
+
+def user_name(i):
+    return 'bench%d' % i
+
+
+def group_name(i):
+    return 'benchgroup%d' % i
+
+
+def populate(add, size):
+    """Add size users and size / 10 groups of 10 members each"""
+    for i in range(size):
+        for dn, record in user_records(BASE, 'ou=People', user_name(i),
+                                       str(10000 + i)):
+            add(dn, record)
+    for i in range(max(1, size // 10)):
+        members = [user_name(j) for j in range(i * 10, min(size, i * 10 + 10))]
+        record = [('objectclass', ['top', 'posixGroup']),
+                  ('cn', [group_name(i)]),
+                  ('gidNumber', [str(5000 + i)])]
+        if members:
+            record.append(('memberUid', members))
+        add('cn=%s,ou=Group,%s' % (group_name(i), BASE), record)
+
+
+def setup_entries():
+    from ldif3 import LDIFParser
+    with open(SETUP, 'rb') as stream:
+        for dn, entry in LDIFParser(stream).parse():
+            yield dn, entry
+
+
+def write_users(path, first, count):
+    with open(path, 'w') as stream:
+        stream.write('username,cn\n')
+        for i in range(first, first + count):
+            stream.write('bench_import%d,Imported %d\n' % (i, i))
+    return path
+
+
+def scenarios(size, tmp):
+    """(name, argv for iteration i[, exit status]) of every command to
+    measure; commands are expected to succeed unless a status is given
+
+    The commands whose name starts with "serve" are forwarded.
+    """
+    def user(i):
+        return user_name(i % size)
+
+    def group(i):
+        return group_name(i % max(1, size // 10))
+
+    desired = os.path.join(tmp, 'desired.csv')
+    with open(desired, 'w') as stream:
+        stream.write('username\n')
+        for i in range(size):
+            stream.write('%s\n' % user_name(i))
+
+    return [
+        ('user add', lambda i: ['user', 'add', 'bench_new%d' % i]),
+        # the membership fails, so the user and its group are removed
+        ('user add rollback', lambda i: ['user', 'add', 'bench_half',
+                                         '--groups', 'bench_nogroup'], 1),
+        ('user show', lambda i: ['user', 'show', user(i)]),
+        ('user list', lambda i: ['user', 'list']),
+        ('user modify', lambda i: ['user', 'modify', user(i),
+                                   '--shell', '/bin/sh%d' % (i % 2)]),
+        ('user reset', lambda i: ['user', 'reset', user(i),
+                                  '--password', 'secret%d' % i]),
+        ('user import', lambda i: ['user', 'import', write_users(
+            os.path.join(tmp, 'import%d.csv' % i), i * 10, 10)]),
+        ('group add', lambda i: ['group', 'add', 'bench_newgroup%d' % i]),
+        ('group addusers', lambda i: ['group', 'addusers',
+                                      'bench_newgroup%d' % i,
+                                      user(i), user(i + 1)]),
+        ('group delusers', lambda i: ['group', 'delusers',
+                                      'bench_newgroup%d' % i,
+                                      user(i), user(i + 1)]),
+        ('group show', lambda i: ['group', 'show', group(i)]),
+        ('group list', lambda i: ['group', 'list']),
+        ('group delete', lambda i: ['group', 'delete',
+                                    'bench_newgroup%d' % i]),
+        ('user delete', lambda i: ['user', 'delete', 'bench_new%d' % i]),
+        ('sync', lambda i: ['sync', '--dry-run', desired]),
+        ('init', lambda i: ['-b', 'dc=init%d' % i, 'init']),
+        ('mirror', lambda i: ['mirror']),
+        # from the mirror of the scenario before
+        ('user list local', lambda i: ['user', 'list', '--local']),
+        ('server status', lambda i: ['server', 'status']),
+        ('server info', lambda i: ['server', 'info', '--refresh']),
+        ('serve user show', lambda i: ['user', 'show', user(i)]),
+        ('serve user list', lambda i: ['user', 'list']),
+        ('serve group show', lambda i: ['group', 'show', group(i)]),
+    ]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def peak_memory():
+    """Peak resident size of the process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak /= 1024
+    return peak / 1024.0
+
+
+def run_command(argv, global_args, devnull):
+    stdout = sys.stdout
+    sys.stdout = devnull
+    try:
+        return ObolApp().run(global_args + argv)
+    finally:
+        sys.stdout = stdout
+
+
+def forward_command(path, argv, global_args, devnull):
+    stdout = sys.stdout
+    sys.stdout = devnull
+    try:
+        return forward(path, global_args + argv)
+    finally:
+        sys.stdout = stdout
+
+
+def start_daemon(path, global_args, devnull):
+    """Fork an obol serve daemon and wait until it listens on path"""
+    pid = os.fork()
+    if pid == 0:
+        # drop the log handlers of the commands that ran before the fork
+        logging.getLogger().handlers = []
+        sys.stdout = sys.stderr = devnull
+        try:
+            ObolApp().run(global_args + ['serve', '--socket', path])
+        finally:
+            os._exit(0)
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.1)
+    return pid
+
+
+def stop_daemon(pid):
+    os.kill(pid, signal.SIGINT)
+    os.waitpid(pid, 0)
+
+
+def benchmark(size, args, tmp):
+    # shared with the forked daemon, which counts its requests too
+    counter = multiprocessing.Value('l', 0)
+    initialize = ldap.initialize
+    if args.H:
+        global_args = ['-H', args.H, '-D', args.D, '-w', args.w]
+        conn = initialize(args.H)
+        conn.simple_bind_s(args.D, args.w)
+        populate(conn.add_s, size)
+
+        def connect(uri, *args, **kwargs):
+            return Counting(initialize(uri, *args, **kwargs), counter)
+    else:
+        global_args = ['-w', 'secret']
+        standin = StandIn()
+        for dn, entry in setup_entries():
+            standin.load(dn, entry)
+        populate(standin.add_s, size)
+
+        def connect(uri, *args, **kwargs):
+            return Counting(standin, counter)
+    global_args += ['--page-size', str(args.page_size)]
+
+    results = {}
+    devnull = open(os.devnull, 'w')
+    path = os.path.join(tmp, 'obol.sock')
+    daemon = None
+    ldap.initialize = connect
+    try:
+        for scenario in scenarios(size, tmp):
+            name, argv, expected = (scenario + (0,))[:3]
+            if args.only and name not in args.only:
+                continue
+            if name.startswith('serve ') and daemon is None:
+                daemon = start_daemon(path, global_args, devnull)
+            timings = []
+            counter.value = 0
+            failures = 0
+            for i in range(args.repeat):
+                started = time.time()
+                if name.startswith('serve '):
+                    status = forward_command(path, argv(i), global_args,
+                                             devnull)
+                else:
+                    status = run_command(argv(i), global_args, devnull) or 0
+                if status != expected:
+                    failures += 1
+                timings.append(time.time() - started)
+            total = sum(timings)
+            results[name] = {
+                'ops_per_sec': len(timings) / total if total else 0.0,
+                'p50_ms': percentile(timings, 0.50) * 1000,
+                'p99_ms': percentile(timings, 0.99) * 1000,
+                'round_trips': counter.value / float(len(timings)),
+                'peak_mb': peak_memory(),
+                'failures': failures,
+            }
+    finally:
+        if daemon is not None:
+            stop_daemon(daemon)
+        ldap.initialize = initialize
+        devnull.close()
+    return results
+
+
+# command lines that measure the start up cost of obol
+STARTUP = [
+    ['--version'],
+    ['--help'],
+    ['user', 'list', '--help'],
+]
+
+RUN_OBOL = ('import sys; from obol.main import main; '
+            'sys.exit(main(sys.argv[1:]))')
+IMPORTED = 'import sys, obol.main; print(" ".join(sorted(sys.modules)))'
+HELP = ('import sys; from obol.main import main\n'
+        'try:\n'
+        '    main(["--help"])\n'
+        'except SystemExit:\n'
+        '    pass\n'
+        'sys.stderr.write(" ".join(sorted(sys.modules)))')
+FORWARDED = ('import sys; from obol.main import main; '
+             'status = main(["user", "list"]); '
+             'print(" ".join(sorted(sys.modules)))')
+
+
+class Responder(threading.Thread):
+    """Answer forwarded command lines like obol serve, without running
+    them, so only the cost of the client is measured"""
+    daemon = True
+
+    def __init__(self, path):
+        super(Responder, self).__init__()
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen(16)
+
+    def run(self):
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except socket.error:
+                return
+            try:
+                client.makefile('r').readline()
+                client.sendall(json.dumps({'status': 0}) + '\n')
+            finally:
+                client.close()
+
+    def close(self):
+        self.listener.close()
+
+
+def startup(args):
+    """Time fresh obol processes that do not talk to a server"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')] +
+        [path for path in [env.get('PYTHONPATH')] if path])
+    env.pop('OBOL_SOCKET', None)
+
+    def measure(argv, env=env):
+        timings = []
+        with open(os.devnull, 'w') as devnull:
+            for i in range(args.repeat):
+                started = time.time()
+                subprocess.call(argv, stdout=devnull, stderr=devnull,
+                                env=env)
+                timings.append(time.time() - started)
+        return {'p50_ms': percentile(timings, 0.50) * 1000,
+                'p99_ms': percentile(timings, 0.99) * 1000}
+
+    results = {'python': measure([sys.executable, '-c', 'pass'])}
+    for argv in STARTUP:
+        results['obol ' + ' '.join(argv)] = measure(
+            [sys.executable, '-c', RUN_OBOL] + argv)
+
+    modules = subprocess.check_output([sys.executable, '-c', IMPORTED],
+                                      env=env).split()
+    results['ldap imported at start'] = 'ldap' in modules
+    with open(os.devnull, 'w') as devnull:
+        modules = subprocess.Popen([sys.executable, '-c', HELP], env=env,
+                                   stdout=devnull, stderr=subprocess.PIPE
+                                   ).communicate()[1].split()
+    results['ldap imported for --help'] = 'ldap' in modules
+
+    tmp = tempfile.mkdtemp(prefix='obol-bench-')
+    forwarding = dict(env, OBOL_SOCKET=os.path.join(tmp, 'obol.sock'))
+    responder = Responder(forwarding['OBOL_SOCKET'])
+    responder.start()
+    try:
+        results['obol user list (forwarded)'] = measure(
+            [sys.executable, '-c', RUN_OBOL, 'user', 'list'], forwarding)
+        modules = subprocess.check_output(
+            [sys.executable, '-c', FORWARDED], env=forwarding).split()
+    finally:
+        responder.close()
+        shutil.rmtree(tmp)
+    results['ldap imported when forwarding'] = 'ldap' in modules
+    results['cliff imported when forwarding'] = 'cliff' in modules
+    return results
+
+
+def report_startup(results, baseline=None):
+    print('start up')
+    print('  %-28s %9s %9s %s' % ('command', 'p50 ms', 'p99 ms', 'change'))
+    for name, result in sorted(results.items()):
+        if not isinstance(result, dict):
+            print('  %s: %s' % (name, 'yes' if result else 'no'))
+            continue
+        change = ''
+        if baseline and name in baseline:
+            before = baseline[name]['p50_ms']
+            if before:
+                change = '%+.0f%%' % ((result['p50_ms'] / before - 1) * 100)
+        print('  %-28s %9.1f %9.1f %s' %
+              (name, result['p50_ms'], result['p99_ms'], change))
+
+
+def report(size, results, baseline=None):
+    print('%d users' % size)
+    print('  %-16s %9s %9s %9s %7s %8s %s' %
+          ('command', 'ops/s', 'p50 ms', 'p99 ms', 'trips', 'peak MB',
+           'change'))
+    for name, result in sorted(results.items()):
+        change = ''
+        if baseline and name in baseline:
+            before = baseline[name]['p50_ms']
+            if before:
+                change = '%+.0f%%' % ((result['p50_ms'] / before - 1) * 100)
+        if result['failures']:
+            change += ' (%d failed)' % result['failures']
+        print('  %-16s %9.1f %9.2f %9.2f %7.1f %8.1f %s' %
+              (name, result['ops_per_sec'], result['p50_ms'],
+               result['p99_ms'], result['round_trips'], result['peak_mb'],
+               change))
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='100,1000',
+                        help="comma separated directory sizes")
+    parser.add_argument('--repeat', type=int, default=20,
+                        help="runs of every command")
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--only', action='append',
+                        help="only run this command, may be repeated")
+    parser.add_argument('--json', metavar='FILENAME',
+                        help="write the results to a file")
+    parser.add_argument('--compare', metavar='FILENAME',
+                        help="compare with the results of an earlier run")
+    parser.add_argument('--startup', action='store_true',
+                        help="measure the start up time instead")
+    parser.add_argument('-H', metavar='URI',
+                        help="run against this server instead")
+    parser.add_argument('-D', default='cn=Manager,dc=local')
+    parser.add_argument('-w', default='system')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as stream:
+            baseline = json.load(stream)
+
+    output = {'python': platform.python_version(),
+              'stand-in': not args.H,
+              'repeat': args.repeat,
+              'sizes': {}}
+    if args.startup:
+        output['startup'] = startup(args)
+        report_startup(output['startup'], baseline.get('startup'))
+        args.sizes = ''
+    home = os.environ.get('HOME')
+    for size in [int(size) for size in args.sizes.split(',') if size]:
+        # keep the caches and state files of obol out of the way
+        tmp = tempfile.mkdtemp(prefix='obol-bench-')
+        os.environ['HOME'] = tmp
+        try:
+            results = benchmark(size, args, tmp)
+        finally:
+            if home is not None:
+                os.environ['HOME'] = home
+            shutil.rmtree(tmp)
+        output['sizes'][str(size)] = results
+        report(size, results, baseline.get('sizes', {}).get(str(size)))
+
+    if args.json:
+        with open(args.json, 'w') as stream:
+            json.dump(output, stream, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())